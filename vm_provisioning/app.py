@@ -12,7 +12,6 @@ from flask import (
     send_from_directory,
 )
 import threading
-import queue
 import secrets
 import logging
 from datetime import datetime, timedelta
@@ -23,6 +22,12 @@ import re
 import time
 import random
 from config import config
+from inventory_cache import InventoryCache
+from job_store import JobStore
+from jobs import JobManager
+from log_bus import LogBus
+from ip_allocation import AllocationError, NicRange
+from federation import federation
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", secrets.token_hex(32))
@@ -34,8 +39,20 @@ app.permanent_session_lifetime = timedelta(
 DEMO_MODE = config["DEMO_MODE"]
 app.logger.info(f"Demo mode is {'enabled' if DEMO_MODE else 'disabled'}")
 
-# Global variable for storing last provision VMs data
-last_provision_vms = []
+# Shared inventory cache for the dropdown endpoints. With the live inventory
+# mirror enabled lookups are already in-memory and current, so skip the TTLs.
+inventory_cache = InventoryCache(
+    {} if config["INVENTORY_MIRROR_ENABLED"] else config["INVENTORY_CACHE_TTL"],
+    default_ttl=0 if config["INVENTORY_MIRROR_ENABLED"] else 300,
+    max_entries=config["INVENTORY_CACHE_MAX_ENTRIES"],
+)
+
+# Jobs and per-VM results persist in SQLite; provisioning batches run on the
+# job manager's workers instead of in the request thread
+job_store = JobStore(config["JOB_DB_PATH"], flush_interval=config["JOB_DB_FLUSH_INTERVAL"])
+job_manager = JobManager(
+    workers=config["JOB_WORKERS"], history=config["JOB_HISTORY"], store=job_store
+)
 
 
 @app.route("/get_demo_mode", methods=["GET"])
@@ -48,6 +65,8 @@ def toggle_demo_mode():
     """Toggle demo mode"""
     global DEMO_MODE
     DEMO_MODE = not DEMO_MODE
+    # Mock and real inventories must never be served from each other's cache
+    inventory_cache.invalidate()
     app.logger.info(f"Demo mode {'enabled' if DEMO_MODE else 'disabled'}")
     return jsonify({"demo_mode": DEMO_MODE})
 
@@ -59,8 +78,12 @@ logging.basicConfig(
     handlers=[logging.FileHandler("vm_provisioning.log"), logging.StreamHandler()],
 )
 
-# Thread-safe queue for log messages
-log_queue = queue.Queue()
+# Per-job log channels streamed by /stream?job=<id>
+log_bus = LogBus(
+    capacity=config["LOG_CHANNEL_CAPACITY"],
+    max_channels=config["LOG_MAX_CHANNELS"],
+    retention=config["LOG_CHANNEL_RETENTION"],
+)
 
 # In-memory storage for demo (use database in production)
 users = {
@@ -103,6 +126,12 @@ MOCK_NETWORKS = {
     ],
 }
 
+# Per-batch clone modes accepted by /provision (see provision_vms)
+CLONE_MODES = ("full", "linked", "instant")
+MAX_BATCH_SIZE = config["MAX_BATCH_SIZE"]
+# Dry runs are planned inside the request, so they are kept smaller
+DRY_RUN_MAX_VMS = min(config["DRY_RUN_MAX_VMS"], MAX_BATCH_SIZE)
+
 
 def validate_ip(ip):
     """Validate IP address format"""
@@ -182,6 +211,7 @@ def mock_provision_vms(
     network_name,
     ip_map,
     logger=print,
+    **kwargs,
 ):
     """Mock function to simulate VM provisioning"""
 
@@ -259,11 +289,13 @@ def get_current_functions():
             from vm_provision import (
                 provision_vms,
                 provision_vms_demo_mode,
+                provision_vms_federated,
                 get_template_names,
                 get_nic_count,
                 get_datacenters,
                 get_clusters,
                 get_networks,
+                invalidate_indexes,
             )
             app.logger.info("Successfully loaded REAL vCenter functions")
             return {
@@ -273,7 +305,9 @@ def get_current_functions():
                 'get_networks': get_networks,
                 'get_nic_count': get_nic_count,
                 'provision_vms': provision_vms,
-                'provision_vms_demo_mode': provision_vms_demo_mode  # Also available in production for troubleshooting
+                'provision_vms_demo_mode': provision_vms_demo_mode,  # Also available in production for troubleshooting
+                'provision_vms_federated': provision_vms_federated,
+                'invalidate_indexes': invalidate_indexes,
             }
         except Exception as e:
             app.logger.error(f"Error loading real vCenter functions: {e}, falling back to mock")
@@ -286,23 +320,61 @@ def get_current_functions():
             'provision_vms': mock_provision_vms,
             'provision_vms_demo_mode': provision_vms_demo_mode  # Add demo mode function
         }# Wrapper functions that dynamically select implementation
+# Inventory lookups are served from inventory_cache when fresh, per vCenter user
 def get_template_names(vcenter_host, vcenter_user, vcenter_pass):
-    return get_current_functions()['get_template_names'](vcenter_host, vcenter_user, vcenter_pass)
+    return inventory_cache.get_or_load(
+        vcenter_host, "templates",
+        lambda: get_current_functions()['get_template_names'](vcenter_host, vcenter_user, vcenter_pass),
+        user=vcenter_user,
+    )
 
 def get_datacenters(vcenter_host, vcenter_user, vcenter_pass):
-    return get_current_functions()['get_datacenters'](vcenter_host, vcenter_user, vcenter_pass)
+    return inventory_cache.get_or_load(
+        vcenter_host, "datacenters",
+        lambda: get_current_functions()['get_datacenters'](vcenter_host, vcenter_user, vcenter_pass),
+        user=vcenter_user,
+    )
 
 def get_clusters(vcenter_host, vcenter_user, vcenter_pass, datacenter_name):
-    return get_current_functions()['get_clusters'](vcenter_host, vcenter_user, vcenter_pass, datacenter_name)
+    return inventory_cache.get_or_load(
+        vcenter_host, "clusters",
+        lambda dc: get_current_functions()['get_clusters'](vcenter_host, vcenter_user, vcenter_pass, dc),
+        datacenter_name,
+        user=vcenter_user,
+    )
 
 def get_networks(vcenter_host, vcenter_user, vcenter_pass, datacenter_name):
-    return get_current_functions()['get_networks'](vcenter_host, vcenter_user, vcenter_pass, datacenter_name)
+    return inventory_cache.get_or_load(
+        vcenter_host, "networks",
+        lambda dc: get_current_functions()['get_networks'](vcenter_host, vcenter_user, vcenter_pass, dc),
+        datacenter_name,
+        user=vcenter_user,
+    )
 
 def get_nic_count(vcenter_host, vcenter_user, vcenter_pass, template_name):
-    return get_current_functions()['get_nic_count'](vcenter_host, vcenter_user, vcenter_pass, template_name)
+    return inventory_cache.get_or_load(
+        vcenter_host, "nic_count",
+        lambda name: get_current_functions()['get_nic_count'](vcenter_host, vcenter_user, vcenter_pass, name),
+        template_name,
+        user=vcenter_user,
+    )
 
-def provision_vms(vcenter_host, vcenter_user, vcenter_pass, template, prefix, count, datacenter_name, cluster_name, network_name, ip_map, logger=print):
-    return get_current_functions()['provision_vms'](vcenter_host, vcenter_user, vcenter_pass, template, prefix, count, datacenter_name, cluster_name, network_name, ip_map, logger)
+def invalidate_inventory(vcenter_host):
+    """Provisioning hook: drop cached inventory so new VMs/templates show up"""
+    inventory_cache.invalidate(vcenter_host)
+    # Name indexes only exist with real vCenter functions
+    invalidate_indexes = get_current_functions().get('invalidate_indexes')
+    if invalidate_indexes:
+        invalidate_indexes(vcenter_host)
+
+def provision_vms(vcenter_host, vcenter_user, vcenter_pass, template, prefix, count, datacenter_name, cluster_name, network_name, ip_map, logger=print, **kwargs):
+    return get_current_functions()['provision_vms'](vcenter_host, vcenter_user, vcenter_pass, template, prefix, count, datacenter_name, cluster_name, network_name, ip_map, logger, **kwargs)
+
+def provision_vms_federated(sites, vcenter_user, vcenter_pass, template, prefix, count, datacenter_name, cluster_name, network_name, ip_map, logger=print, **kwargs):
+    federated = get_current_functions().get('provision_vms_federated')
+    if not federated:
+        raise Exception("Federated provisioning needs production mode")
+    return federated(sites, vcenter_user, vcenter_pass, template, prefix, count, datacenter_name, cluster_name, network_name, ip_map, logger, **kwargs)
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -904,22 +976,28 @@ def provision():
             datacenter = request.form.get("datacenter", "").strip()
             cluster = request.form.get("cluster", "").strip()
             network = request.form.get("network", "").strip()
+            clone_mode = request.form.get("clone_mode", "full").strip() or "full"
+            if clone_mode not in CLONE_MODES:
+                raise ValueError(f"Clone mode must be one of: {', '.join(CLONE_MODES)}")
+            dry_run = request.form.get("dry_run", "").strip().lower() in ["true", "1", "yes", "on", "y"]
 
             # Check if individual configuration is enabled
             is_individual_config = request.form.get("individualConfig") == "on"
 
             ip_map = {}
+            ip_exclusions = {}
             individual_nodes_data = None
+            early_logs = []  # published once the job's log channel exists
             if is_individual_config:
                 individual_nodes_data_str = request.form.get("individual_nodes_data")
                 if not individual_nodes_data_str:
                     raise ValueError("Individual node configuration data is missing.")
                 individual_nodes_data = json.loads(individual_nodes_data_str)
-                log_queue.put(
+                early_logs.append(
                     f"ℹ️ Backend received individual node config: {len(individual_nodes_data)} nodes."
                 )
                 for i, node in enumerate(individual_nodes_data):
-                    log_queue.put(
+                    early_logs.append(
                         f"   Node {i+1}: Name='{node.get('name')}', Hostname='{node.get('hostname')}', IPs={node.get('ips')}"
                     )
                 prefix = "individual-vm"
@@ -934,39 +1012,153 @@ def provision():
                 hostname_prefix = request.form.get("hostname", "").strip()
                 if not all([prefix]):
                     raise ValueError("VM Name Prefix is required for bulk provisioning")
-                if count < 1 or count > 50:
-                    raise ValueError("Number of VMs must be between 1 and 50")
+                if count < 1 or count > MAX_BATCH_SIZE:
+                    raise ValueError(f"Number of VMs must be between 1 and {MAX_BATCH_SIZE}")
                 if not re.match(r"^[a-zA-Z0-9\-_]+$", prefix):
                     raise ValueError(
                         "Prefix can only contain letters, numbers, hyphens, and underscores"
                     )
+                # Starting address per NIC, optionally "addr/prefix" or IPv6,
+                # plus addresses/ranges the batch must not use
                 for i in range(1, 10):
                     ip_val = request.form.get(f"ip{i}", "").strip()
+                    exclude_val = request.form.get(f"ip{i}_exclude", "").strip()
                     if ip_val:
-                        if not validate_ip(ip_val):
-                            raise ValueError(f"Invalid IP address format for NIC {i}")
+                        try:
+                            nic_range = NicRange(ip_val, exclude=exclude_val)
+                            if "/" in ip_val:
+                                nic_range.take(count)
+                        except AllocationError as e:
+                            raise ValueError(f"NIC {i}: {e}")
                         ip_map[f"net{i}"] = ip_val
+                        if exclude_val:
+                            ip_exclusions[f"net{i}"] = exclude_val
             if not all([template, datacenter, cluster, network]):
                 raise ValueError(
                     "Template, Datacenter, Cluster, and Network are required"
                 )
+            # Federated batches are split over every configured vCenter site
+            federated = request.form.get("federated", "").strip().lower() in ["true", "1", "yes", "on", "y"]
+            sites = federation.sites if federated else []
+            if federated:
+                if not sites:
+                    raise ValueError("No vCenter sites are configured (VCENTER_SITES)")
+                if DEMO_MODE:
+                    raise ValueError("Federated provisioning needs production mode")
+                if is_individual_config or dry_run:
+                    raise ValueError("Federated provisioning is available for bulk batches only, without dry run")
+                if ip_map:
+                    raise ValueError("Static IPs cannot be split across vCenter sites; leave the NIC IPs empty (DHCP)")
             vcenter_host = session["vcenter_host"]
             vcenter_user = session["vcenter_user"]
             vcenter_pass = session["vcenter_pass"]
             username = session.get("username", "Unknown")
+            job_params = {
+                "vcenter_host": vcenter_host,
+                "template": template,
+                "datacenter": datacenter,
+                "cluster": cluster,
+                "network": network,
+                "count": count,
+                "mode": "individual" if is_individual_config else "bulk",
+                "clone_mode": clone_mode,
+                "demo": DEMO_MODE,
+            }
+            if sites:
+                job_params["sites"] = [site.name for site in sites]
+            if dry_run and count > DRY_RUN_MAX_VMS:
+                raise ValueError(f"A dry run plans at most {DRY_RUN_MAX_VMS} VMs; plan a smaller batch")
+            if dry_run:
+                # Plan only: runs inline (no clones, no job) and returns the plan
+                plan_log = []
+                plan_func = provision_vms
+                extra = {}
+                if DEMO_MODE:
+                    plan_func = get_current_functions()['provision_vms_demo_mode']
+                    extra["hostname_prefix"] = hostname_prefix if not is_individual_config else None
+                result = plan_func(
+                    vcenter_host,
+                    vcenter_user,
+                    vcenter_pass,
+                    template,
+                    prefix,
+                    count,
+                    datacenter,
+                    cluster,
+                    network,
+                    ip_map,
+                    logger=plan_log.append,
+                    individual_nodes_data=individual_nodes_data if is_individual_config else None,
+                    clone_mode=clone_mode,
+                    ip_exclusions=ip_exclusions,
+                    dry_run=True,
+                    clone_durations=job_store.clone_durations(vcenter_host, template, clone_mode),
+                    **extra,
+                )
+                return jsonify({
+                    "status": "success",
+                    "dry_run": True,
+                    "message": result["message"],
+                    "plan": result["plan"],
+                    "vms": result["vms"],
+                    "logs": plan_log,
+                })
+            job = job_manager.create(
+                username,
+                f"{template} → {len(sites)} vCenter sites ({count} VMs)" if sites
+                else f"{template} → {datacenter}/{cluster} ({count} VMs)",
+                params=job_params,
+                emitter=log_bus.emitter,
+            )
+            # VMs are reported as they are submitted, not all up front
+            job.expect(count)
+            # Every job logs to its own channel; /stream?job=<id> follows it
+            log = log_bus.logger(job.id)
             if DEMO_MODE:
-                # ใช้ queue เพื่อรับผลลัพธ์จาก thread
-                result_queue = queue.Queue()
-                def task():
+                def task(job):
+                    current_functions = get_current_functions()
+                    demo_provision_func = current_functions.get('provision_vms_demo_mode')
+                    if not demo_provision_func:
+                        log("⚠️ Demo provision function not found")
+                        raise Exception("Demo provision function not found")
                     try:
-                        current_functions = get_current_functions()
-                        demo_provision_func = current_functions.get('provision_vms_demo_mode')
-                        if demo_provision_func:
-                            individual_data = None
-                            if is_individual_config and individual_nodes_data:
-                                individual_data = individual_nodes_data
-                            result = demo_provision_func(
-                                vcenter_host,
+                        result = demo_provision_func(
+                            vcenter_host,
+                            vcenter_user,
+                            vcenter_pass,
+                            template,
+                            prefix,
+                            count,
+                            datacenter,
+                            cluster,
+                            network,
+                            ip_map,
+                            logger=log,
+                            individual_nodes_data=individual_nodes_data if is_individual_config else None,
+                            hostname_prefix=hostname_prefix if not is_individual_config else None,
+                            on_vm_update=job.update_vm,
+                            clone_mode=clone_mode,
+                            ip_exclusions=ip_exclusions,
+                        )
+                    except Exception as e:
+                        log(f"❌ Demo provision error: {str(e)}")
+                        raise
+                    if isinstance(result, dict) and 'vms' in result:
+                        log(f"📊 VMs data prepared: {len(result['vms'])} VMs")
+                        for i, vm in enumerate(result['vms']):
+                            log(f"   VM{i+1}: {vm}")
+                        log("✅ Demo provisioning completed successfully!")
+                    else:
+                        log("⚠️ No VMs data in result")
+                    return result
+            else:
+                # Production mode - real provisioning with per-VM customization
+                def task(job):
+                    log("🏭 PRODUCTION MODE: Starting real VM provisioning with per-VM customization")
+                    try:
+                        if sites:
+                            result = provision_vms_federated(
+                                sites,
                                 vcenter_user,
                                 vcenter_pass,
                                 template,
@@ -976,117 +1168,93 @@ def provision():
                                 cluster,
                                 network,
                                 ip_map,
-                                logger=log_queue.put,
-                                individual_nodes_data=individual_data,
-                                hostname_prefix=hostname_prefix if not is_individual_config else None,
+                                logger=log,
+                                timeout_seconds=30,
+                                on_vm_update=job.update_vm,
+                                clone_mode=clone_mode,
                             )
-                            # ส่ง vms array กลับมาทาง queue
-                            if isinstance(result, dict) and 'vms' in result:
-                                result_queue.put(result['vms'])
-                                log_queue.put(f"📊 VMs data prepared: {len(result['vms'])} VMs")
-                                # Debug: แสดง vms data
-                                for i, vm in enumerate(result['vms']):
-                                    log_queue.put(f"   VM{i+1}: {vm}")
-                                log_queue.put("✅ Demo provisioning completed successfully!")
-                            else:
-                                result_queue.put([])
-                                log_queue.put("⚠️ No VMs data in result")
-                                log_queue.put(f"Result type: {type(result)}")
-                                log_queue.put(f"Result content: {result}")
                         else:
-                            result_queue.put([])
-                            log_queue.put("⚠️ Demo provision function not found")
+                            result = provision_vms(
+                                vcenter_host,
+                                vcenter_user,
+                                vcenter_pass,
+                                template,
+                                prefix,
+                                count,
+                                datacenter,
+                                cluster,
+                                network,
+                                ip_map,
+                                logger=log,
+                                timeout_seconds=30,
+                                individual_nodes_data=individual_nodes_data if is_individual_config else None,
+                                on_vm_update=job.update_vm,
+                                clone_mode=clone_mode,
+                                ip_exclusions=ip_exclusions,
+                            )
                     except Exception as e:
-                        result_queue.put([])
-                        log_queue.put(f"❌ Demo provision error: {str(e)}")
-                t = threading.Thread(target=task, daemon=True)
-                t.start()
-                # ไม่ต้อง join() เพื่อให้ frontend ได้รับ log ก่อน
-                # vms_result = result_queue.get()
-                # session['last_provision_vms'] = vms_result
-                # return jsonify({'status': 'success', 'message': 'Provisioning completed', 'vms': vms_result})
-                
-                # ส่ง vms array ผ่าน eventSource เมื่อเสร็จ
-                def save_vms_result():
-                    global last_provision_vms
-                    try:
-                        log_queue.put("⏳ Waiting for VMs data...")
-                        vms_result = result_queue.get(timeout=60)  # เพิ่ม timeout เป็น 60 วินาที
-                        # ใช้ global variable แทน session
-                        last_provision_vms = vms_result
-                        log_queue.put(f"📊 VMs data saved: {len(vms_result)} VMs")
-                        if vms_result:
-                            for vm in vms_result:
-                                log_queue.put(f"   • {vm.get('name', 'Unknown')}: {vm.get('status', 'Unknown')} - {vm.get('ips', 'No IP')}")
+                        error_msg = str(e)
+                        log(f"❌ ERROR: Provisioning failed: {error_msg}")
+                        if "customiz" in error_msg.lower():
+                            log("❗ Guest Customization failed. Please check that your template has VMware Tools installed, network config is not hardcoded, and OS is supported by vSphere Guest Customization.")
+                        elif "vcenter" in error_msg.lower() or "connect" in error_msg.lower():
+                            log("❗ vCenter connection or resource discovery failed. Please check vCenter credentials, network, and permissions.")
                         else:
-                            log_queue.put("⚠️ No VMs data received")
-                    except queue.Empty:
-                        log_queue.put("⚠️ Timeout waiting for VMs data (60s)")
-                        last_provision_vms = []
-                    except Exception as e:
-                        log_queue.put(f"⚠️ Error waiting for VMs data: {str(e)}")
-                        last_provision_vms = []
-                
-                # เริ่ม thread สำหรับเก็บ vms result
-                save_thread = threading.Thread(target=save_vms_result, daemon=True)
-                save_thread.start()
-            else:
-                # Production mode - use real provisioning with per-VM customization
-                try:
-                    log_queue.put("🏭 PRODUCTION MODE: Starting real VM provisioning with per-VM customization")
-                    result = provision_vms(
-                        vcenter_host,
-                        vcenter_user,
-                        vcenter_pass,
-                        template,
-                        prefix,
-                        count,
-                        datacenter,
-                        cluster,
-                        network,
-                        ip_map,
-                        logger=log_queue.put,
-                        timeout_seconds=30,
-                        individual_nodes_data=individual_nodes_data if is_individual_config else None,
-                    )
-                    log_queue.put(f"✅ {result}")
-                    logging.info(
-                        f"Provisioning completed by {username}: {result}"
-                    )
-                except Exception as e:
-                    # Enhanced error handling for production provisioning
-                    error_msg = str(e)
-                    log_queue.put(f"❌ ERROR: Provisioning failed: {error_msg}")
-                    if "customiz" in error_msg.lower():
-                        log_queue.put("❗ Guest Customization failed. Please check that your template has VMware Tools installed, network config is not hardcoded, and OS is supported by vSphere Guest Customization.")
-                    elif "vcenter" in error_msg.lower() or "connect" in error_msg.lower():
-                        log_queue.put("❗ vCenter connection or resource discovery failed. Please check vCenter credentials, network, and permissions.")
-                    else:
-                        log_queue.put("❗ An unexpected error occurred during provisioning. Please check logs and vSphere tasks for more details.")
-                    logging.error(f"Provisioning failed for user {username}: {error_msg}")
-                    return jsonify({"status": "error", "message": error_msg}), 500
-            # Add initial logs to queue for immediate streaming
-            log_queue.put("🚀 Starting VM provisioning...")
-            log_queue.put("📋 Configuration validated successfully")
+                            log("❗ An unexpected error occurred during provisioning. Please check logs and vSphere tasks for more details.")
+                        logging.error(f"Provisioning failed for user {username}: {error_msg}")
+                        raise
+                    message = result.get('message') if isinstance(result, dict) else result
+                    log(f"✅ {message}")
+                    logging.info(f"Provisioning completed by {username}: {message}")
+                    return result
+
+            def on_finish(job):
+                vms = job.vms
+                # Results must be queryable before the stream reports the end
+                job_store.flush()
+                log(f"📊 VMs data saved: {len(vms)} VMs")
+                for vm in vms:
+                    log(f"   • {vm.get('name', 'Unknown')}: {vm.get('status', 'Unknown')} - {vm.get('ips', 'No IP')}")
+                # Even a partly failed batch may have created VMs
+                invalidate_inventory(vcenter_host)
+                for site in sites:
+                    invalidate_inventory(site.host)
+                log_bus.close(job.id)
+
+            log(f"🆔 Job {job.id} queued")
+            for message in early_logs:
+                log(message)
+            # Add initial logs to the job channel for immediate streaming
+            log("🚀 Starting VM provisioning...")
+            log("📋 Configuration validated successfully")
             
             # Add network zone information if available
             network_zones = request.form.get("networkZones")
             if network_zones:
                 try:
                     zones_data = json.loads(network_zones)
-                    log_queue.put("🌐 Detected network zones:")
+                    log("🌐 Detected network zones:")
                     for nic, zone in zones_data.items():
-                        log_queue.put(f"   {nic.upper()}: {zone}")
+                        log(f"   {nic.upper()}: {zone}")
                 except:
                     pass
 
+            job_manager.start(job, task, on_finish=on_finish)
+
             message = "Provisioning started! Check the logs below."
             if DEMO_MODE:
                 message = "DEMO: Provisioning started! This is simulated data."
 
             # Return JSON response for successful POST via AJAX
             return (
-                jsonify({"message": message, "status": "success"}),
+                jsonify(
+                    {
+                        "message": message,
+                        "status": "success",
+                        "job_id": job.id,
+                        "job_url": url_for("get_job_api", job_id=job.id),
+                    }
+                ),
                 202,
             )  # 202 Accepted
 
@@ -1097,12 +1265,14 @@ def provision():
         except Exception as e:
             # Top-level error handler for form/validation errors
             error_msg = str(e)
-            log_queue.put(f"❌ ERROR: {error_msg}")
+            app.logger.error(f"Provisioning request failed: {error_msg}")
             return jsonify({"status": "error", "message": error_msg}), 400
 
     # For GET requests, render the HTML template
     return render_template_string(
-        open("templates/provision.html", "r", encoding="utf-8").read()
+        open("templates/provision.html", "r", encoding="utf-8").read(),
+        max_batch_size=MAX_BATCH_SIZE,
+        sites=[site.name for site in federation.sites],
     )
 
 
@@ -1116,25 +1286,70 @@ def logout():
     return redirect(url_for("login"))
 
 
+def sse_event(event, data, seq=None):
+    """
+    One server-sent event: log lines are sent as text, everything else
+    (vm.state, job.progress) as compact JSON. seq becomes the event id the
+    browser sends back as Last-Event-ID when it reconnects.
+    """
+    if event == "log" or isinstance(data, str):
+        # Escape newlines in the message for proper SSE format
+        payload = str(data).replace('\n', '\\n').replace('\r', '\\r')
+    else:
+        payload = json.dumps(data, separators=(",", ":"), default=str)
+    event_id = f"id: {seq}\n" if seq is not None else ""
+    return f"{event_id}event: {event}\ndata: {payload}\n\n"
+
+
 @app.route("/stream")
 def stream():
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    job_id = request.args.get("job")
+    if not job_id:
+        # Without a job id follow the caller's most recent job
+        jobs = job_manager.list(owner=session["username"])
+        job_id = jobs[0].id if jobs else None
+    job = job_manager.get(job_id) if job_id else None
+    if job is None or job.owner != session["username"]:
+        return jsonify({"error": "Job not found"}), 404
+    # EventSource resends the id of the last event it received when it
+    # reconnects; only what it missed is replayed
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        after_seq = int(last_event_id or 0)
+    except ValueError:
+        after_seq = 0
+    subscription = log_bus.subscribe(job.id, after_seq=after_seq)
+    if subscription is None:
+        return jsonify({"error": "Job log is no longer available"}), 404
+
     def event_stream():
-        while True:
-            try:
-                message = log_queue.get(timeout=30)
-                # Clean the message and ensure proper encoding
-                if message:
-                    # Escape newlines in the message for proper SSE format
-                    clean_message = str(message).replace('\n', '\\n').replace('\r', '\\r')
-                    yield f"data: {clean_message}\n\n"
-                else:
-                    yield f"data: \n\n"  # Keep connection alive
-            except queue.Empty:
-                yield f"data: \n\n"  # Keep connection alive with ping
-            except Exception as e:
-                logging.error(f"EventSource error: {e}")
-                yield f"data: ❌ Stream error: {e}\n\n"
-                break
+        yield f"retry: {config['STREAM_RETRY_MS']}\n\n"
+        try:
+            while True:
+                messages = subscription.read(timeout=30)
+                if subscription.dropped:
+                    # The missed events are gone; resync the client from the job itself
+                    yield sse_event(
+                        "log",
+                        f"⚠️ {subscription.dropped} event(s) no longer buffered; sending current VM states",
+                    )
+                    yield sse_event("job.snapshot", job.snapshot())
+                    subscription.dropped = 0
+                for seq, event, data in messages:
+                    yield sse_event(event, data, seq)
+                if subscription.finished:
+                    yield sse_event("end", job.state)
+                    break
+                if not messages:
+                    yield ": keepalive\n\n"
+        except Exception as e:
+            logging.error(f"EventSource error: {e}")
+            yield sse_event("log", f"❌ Stream error: {e}")
+        finally:
+            subscription.close()
 
     response = Response(event_stream(), mimetype="text/event-stream")
     response.headers['Cache-Control'] = 'no-cache'
@@ -1225,6 +1440,53 @@ def get_nic_count_api():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/inventory/refresh", methods=["POST"])
+def refresh_inventory_api():
+    """Explicitly drop cached inventory for the session's vCenter"""
+    if not session.get("username") or not session.get("vcenter_host"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    invalidate_inventory(session["vcenter_host"])
+    return jsonify({"status": "success", "cache": inventory_cache.snapshot()})
+
+
+# Inventory of every registered vCenter site, queried concurrently
+FEDERATED_INVENTORY = {
+    "templates": lambda site, user, pwd, args: get_template_names(site.host, user, pwd),
+    "datacenters": lambda site, user, pwd, args: get_datacenters(site.host, user, pwd),
+    "clusters": lambda site, user, pwd, args: get_clusters(
+        site.host, user, pwd, args.get("datacenter") or site.datacenter
+    ),
+    "networks": lambda site, user, pwd, args: get_networks(
+        site.host, user, pwd, args.get("datacenter") or site.datacenter
+    ),
+}
+
+
+@app.route("/api/sites")
+def list_sites_api():
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    return jsonify({"sites": [site.as_dict() for site in federation.sites]})
+
+
+@app.route("/api/federation/<kind>")
+def federated_inventory_api(kind):
+    """Names of one inventory kind across all sites, each tagged with its site"""
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+    if kind not in FEDERATED_INVENTORY:
+        return jsonify({"error": f"Unknown inventory kind '{kind}'"}), 404
+
+    user, pwd = session["vcenter_user"], session["vcenter_pass"]
+    args = request.args.to_dict()
+    items, errors = federation.merged(
+        lambda site: FEDERATED_INVENTORY[kind](site, user, pwd, args)
+    )
+    return jsonify({kind: items, "errors": errors})
+
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(
@@ -1232,10 +1494,58 @@ def favicon():
         'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
 
+@app.route("/api/jobs")
+def list_jobs_api():
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    offset = request.args.get("offset", 0, type=int)
+    jobs = job_store.list_jobs(owner=session["username"], limit=limit, offset=offset)
+    return jsonify({"jobs": jobs})
+
+
+@app.route("/api/jobs/<job_id>")
+def get_job_api(job_id):
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    # Running and recent jobs are served from memory, older ones from the store
+    job = job_manager.get(job_id)
+    data = job.to_dict() if job is not None else job_store.get_job(job_id)
+    if data is None or data["owner"] != session["username"]:
+        return jsonify({"error": "Job not found"}), 404
+    data["log"] = log_bus.snapshot(job_id)
+    return jsonify(data)
+
+
+@app.route("/api/jobs/<job_id>/vms")
+def get_job_vms_api(job_id):
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    data = job_store.get_job(job_id, include_vms=False)
+    if data is None or data["owner"] != session["username"]:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job_id": job_id, "state": data["state"], "vms": job_store.job_vms(job_id)})
+
+
+@app.route("/api/vms/<vm_name>")
+def get_vm_history_api(vm_name):
+    """Provisioning history of one VM name across the caller's jobs"""
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    return jsonify({"name": vm_name, "history": job_store.find_vm(vm_name, owner=session["username"])})
+
+
 @app.route('/api/last-provision-vms')
 def api_last_provision_vms():
-    global last_provision_vms
-    return jsonify({'vms': last_provision_vms})
+    if not session.get("username"):
+        return jsonify({"error": "Not authenticated"}), 401
+
+    job = job_store.latest_finished_job(session["username"])
+    return jsonify({'job_id': job["id"] if job else None, 'vms': job["vms"] if job else []})
 
 
 if __name__ == "__main__":
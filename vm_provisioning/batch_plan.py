@@ -0,0 +1,97 @@
+import math
+import statistics
+
+
+def numbered_name(prefix, number, count):
+    """prefix plus number, zero-padded to the width of count (at least 2 digits)"""
+    return f"{prefix}{number:0{max(2, len(str(count)))}d}"
+
+
+def bulk_plan(prefix, count, ip_plan=None, first=1, of=None):
+    """
+    (number, {'name', 'hostname', 'ips'}) of every VM of a bulk batch,
+    generated as they are consumed; ip_plan is an ip_allocation.IpPlan.
+    A share of a larger batch (see federation.split_batch) names its VMs
+    from first on, padded to the width of the whole batch's size of.
+    """
+    for i in range(count):
+        name = numbered_name(prefix, first + i, of or count)
+        yield i + 1, {'name': name, 'hostname': name, 'ips': ip_plan[i] if ip_plan is not None else []}
+
+
+def individual_plan(nodes, nics=9):
+    """Like bulk_plan for explicitly configured nodes ({'name', 'hostname', 'ips': {'netN': ip}})"""
+    for number, node in enumerate(nodes, 1):
+        name = node.get('name') or f"vm{number:02d}"
+        node_ips = node.get('ips') or {}
+        ips = [node_ips.get(f"net{nic}") or None for nic in range(1, nics + 1)]
+        yield number, {'name': name, 'hostname': node.get('hostname') or name, 'ips': ips}
+
+
+class VmRecord:
+    """
+    Status of one VM of a running batch, kept while it is in flight.
+
+    Slotted, so the VMs in flight each take one small fixed-size record
+    instead of a dict; as_dict() gives the result row.
+    """
+
+    __slots__ = FIELDS = (
+        "name",
+        "hostname",
+        "ips",
+        "status",
+        "progress",
+        "error",
+        "task",
+        "submitted_at",
+        "completed_at",
+        "duration",
+        "ready_seconds",
+    )
+
+    def __init__(self, name):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.name = name
+
+    def update(self, fields):
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    def as_dict(self):
+        return {
+            field: getattr(self, field)
+            for field in self.FIELDS
+            if getattr(self, field) is not None
+        }
+
+
+def estimate_seconds(per_datastore, windows, max_slots, clone_seconds):
+    """
+    Rough wall time of a batch and the concurrency it will run at.
+
+    per_datastore maps a datastore key to the clones planned there and
+    windows to its in-flight window; max_slots is what the vCenter and
+    global limits leave. Clones run in waves of that concurrency, and no
+    faster than the busiest datastore's window allows.
+    """
+    total = sum(per_datastore.values())
+    if not total:
+        return 0.0, 0
+    concurrency = max(1, min(
+        max_slots, sum(min(windows.get(key, 1), n) for key, n in per_datastore.items())
+    ))
+    waves = max(
+        [math.ceil(total / concurrency)]
+        + [math.ceil(n / max(1, windows.get(key, 1))) for key, n in per_datastore.items()]
+    )
+    return waves * clone_seconds, concurrency
+
+
+def typical_duration(durations, default):
+    """(median of durations or default, where it came from)"""
+    durations = [d for d in durations or [] if d]
+    if not durations:
+        return default, "default"
+    return statistics.median(durations), f"median of {len(durations)} recent clone(s)"
@@ -0,0 +1,250 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import config
+
+
+class InFlightLimiter:
+    """
+    Process-wide count of clone tasks in flight.
+
+    A slot is held from just before Clone() is called until its task finishes.
+    Slots are capped globally, per vCenter host and per datastore so that
+    several concurrent batches share the same limits. Each datastore also has
+    a window at or below max_per_datastore that an adaptive controller may
+    move with set_window().
+    """
+
+    def __init__(self, max_total, max_per_host, max_per_datastore, initial_window=None):
+        self.max_total = max(1, int(max_total))
+        self.max_per_host = max(1, int(max_per_host))
+        self.max_per_datastore = max(1, int(max_per_datastore))
+        self.initial_window = min(
+            self.max_per_datastore, max(1, int(initial_window or self.max_per_datastore))
+        )
+        self._cond = threading.Condition()
+        self._total = 0
+        self._hosts = {}  # vCenter host -> slots in use
+        self._datastores = {}  # (vCenter host, datastore moId) -> slots in use
+        self._windows = {}  # (vCenter host, datastore moId) -> current window
+
+    def _keys(self, host, datastore):
+        return host, (host, datastore._moId if datastore is not None else None)
+
+    def _free(self, host_key, ds_key):
+        return (
+            self._total < self.max_total
+            and self._hosts.get(host_key, 0) < self.max_per_host
+            and self._datastores.get(ds_key, 0) < self.window(ds_key)
+        )
+
+    def window(self, ds_key):
+        return self._windows.get(ds_key, self.initial_window)
+
+    def set_window(self, ds_key, size):
+        """Resize one datastore window within [1, max_per_datastore]"""
+        size = min(self.max_per_datastore, max(1, int(size)))
+        with self._cond:
+            self._windows[ds_key] = size
+            self._cond.notify_all()
+        return size
+
+    def acquire(self, host, datastore, cancel=None):
+        """Block until a slot is free; returns the slot, or None when cancel is set"""
+        host_key, ds_key = self._keys(host, datastore)
+        with self._cond:
+            while not self._free(host_key, ds_key):
+                if cancel is not None and cancel.is_set():
+                    return None
+                self._cond.wait(1)
+            self._total += 1
+            self._hosts[host_key] = self._hosts.get(host_key, 0) + 1
+            self._datastores[ds_key] = self._datastores.get(ds_key, 0) + 1
+        return host_key, ds_key
+
+    def release(self, slot):
+        host_key, ds_key = slot
+        with self._cond:
+            self._total -= 1
+            for counts, key in ((self._hosts, host_key), (self._datastores, ds_key)):
+                counts[key] -= 1
+                if counts[key] <= 0:
+                    del counts[key]
+            self._cond.notify_all()
+
+    def in_flight(self, host=None):
+        with self._cond:
+            return self._total if host is None else self._hosts.get(host, 0)
+
+
+limiter = InFlightLimiter(
+    config["CLONE_MAX_IN_FLIGHT"],
+    config["CLONE_MAX_IN_FLIGHT_PER_HOST"],
+    config["CLONE_MAX_IN_FLIGHT_PER_DATASTORE"],
+    initial_window=config["CLONE_WINDOW_INITIAL"] if config["CLONE_ADAPTIVE_ENABLED"] else None,
+)
+
+
+# Returned by CloneScheduler._next() once the job iterable is used up
+DRAINED = object()
+
+
+class CloneJob:
+    """
+    One VM to clone: prepare() builds its spec, launch(spec) calls Clone()
+    and on_failure(error), when given, runs if the clone cannot be submitted
+    """
+
+    def __init__(self, key, datastore, prepare, launch, datastore_name=None, on_failure=None):
+        self.key = key
+        self.datastore = datastore
+        self.datastore_name = datastore_name
+        self.prepare = prepare
+        self.launch = launch
+        self.on_failure = on_failure
+
+
+class CloneScheduler:
+    """
+    Submits clone jobs through a worker pool and keeps the in-flight window full.
+
+    Workers pull jobs from a possibly lazy iterable one at a time, build the
+    spec and wait for a limiter slot before each Clone() call; every
+    finished task hands its slot to the next waiting job. Only the jobs
+    workers hold exist at any moment, so batches of thousands of VMs are
+    planned as they are submitted. results() yields a TaskResult per
+    submitted clone in finishing order.
+    """
+
+    def __init__(self, tracker, host, limiter=limiter, throttle=None, workers=None, logger=print):
+        self.tracker = tracker
+        self.host = host
+        self.limiter = limiter
+        self.throttle = throttle
+        self.workers = max(1, int(workers or config["CLONE_SUBMIT_WORKERS"]))
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._slots = {}  # task -> (limiter slot, datastore label)
+        self._cancel = threading.Event()
+        self._executor = None
+        self._feed_lock = threading.Lock()
+        self._jobs = iter(())
+        self._remaining = 0  # items announced to the tracker but not pulled yet
+        self.submit_failures = 0
+
+    def start(self, jobs, total=None):
+        """
+        Start submitting jobs; returns immediately.
+
+        jobs may be a generator; total is then the number of items it will
+        yield. A None item is a VM that will not be cloned (e.g. it could
+        not be placed).
+        """
+        if total is None:
+            jobs = list(jobs)
+            total = len(jobs)
+        self._jobs = iter(jobs)
+        self._remaining = total
+        self.tracker.expect(total)
+        workers = min(self.workers, max(1, total))
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"clone-submit-{self.host}"
+        )
+        for _ in range(workers):
+            self._executor.submit(self._feed)
+
+    def _next(self):
+        """Next item of the job iterable, or DRAINED"""
+        with self._feed_lock:
+            if self._remaining <= 0:
+                return DRAINED
+            try:
+                job = next(self._jobs)
+            except Exception as e:
+                if not isinstance(e, StopIteration):
+                    self.logger(f"❌ Planning stopped: {e}")
+                # Announced items that will never come
+                for _ in range(self._remaining):
+                    self.tracker.forget()
+                self._remaining = 0
+                return DRAINED
+            self._remaining -= 1
+            return job
+
+    def _feed(self):
+        while not self._cancel.is_set():
+            job = self._next()
+            if job is DRAINED:
+                return
+            if job is None:
+                self.tracker.forget()
+            else:
+                self._submit(job)
+
+    def _submit(self, job):
+        slot = None
+        task = None
+        tracking = False
+        try:
+            if self._cancel.is_set():
+                raise RuntimeError("submission cancelled")
+            spec = job.prepare()
+            slot = self.limiter.acquire(self.host, job.datastore, cancel=self._cancel)
+            if slot is None:
+                raise RuntimeError("submission cancelled")
+            task = job.launch(spec)
+            with self._lock:
+                self._slots[task] = (slot, job.datastore_name)
+            # track() settles the tracker's expected count even when it fails
+            tracking = True
+            self.tracker.track(task, job.key)
+            self.logger(f"✅ Clone task initiated for {job.key}")
+        except Exception as e:
+            error = str(e)
+            if task is not None:
+                with self._lock:
+                    # Only released here when close() has not already done so
+                    held = self._slots.pop(task, None)
+                slot = held[0] if held else None
+                # A clone nobody follows must not run on unnoticed
+                try:
+                    task.CancelTask()
+                    error = f"{error} (clone task cancelled)"
+                except Exception as cancel_error:
+                    self.logger(f"⚠️ Could not cancel the untracked clone task of {job.key}: {cancel_error}")
+            if slot is not None:
+                self.limiter.release(slot)
+            with self._lock:
+                self.submit_failures += 1
+            self.logger(f"❌ Failed to initiate clone for {job.key}: {error}")
+            if not tracking:
+                self.tracker.forget()
+            if job.on_failure is not None:
+                try:
+                    job.on_failure(error)
+                except Exception as report_error:
+                    self.logger(f"⚠️ Could not record the failed submission of {job.key}: {report_error}")
+
+    def results(self):
+        """Yield TaskResults as clones finish, releasing their slots"""
+        for result in self.tracker.completed():
+            with self._lock:
+                slot, label = self._slots.pop(result.task, (None, None))
+            if slot is not None:
+                self.limiter.release(slot)
+                if self.throttle is not None:
+                    decision = self.throttle.observe(slot[1], result, label)
+                    if decision:
+                        self.logger(decision)
+            yield result
+
+    def close(self):
+        """Stop pending submissions and give back slots of unfinished tasks"""
+        self._cancel.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        with self._lock:
+            slots = [slot for slot, _label in self._slots.values()]
+            self._slots.clear()
+        for slot in slots:
+            self.limiter.release(slot)
@@ -12,4 +12,182 @@ config = {
         os.environ.get("SESSION_LIFETIME", "1800")
     ),  # 30 minutes in seconds
     "LOG_FILE": os.environ.get("LOG_FILE", "vm_provisioning.log"),
+    # vCenter session pool
+    "VCENTER_POOL_MAX_SESSIONS": int(
+        os.environ.get("VCENTER_POOL_MAX_SESSIONS", "8")
+    ),  # live sessions per vCenter, across its users
+    "VCENTER_POOL_MAX_PER_USER": int(
+        os.environ.get("VCENTER_POOL_MAX_PER_USER", "4")
+    ),  # live sessions per (host, user)
+    "VCENTER_KEEPALIVE_INTERVAL": int(
+        os.environ.get("VCENTER_KEEPALIVE_INTERVAL", "60")
+    ),  # seconds idle before a session is re-checked
+    "VCENTER_POOL_ACQUIRE_TIMEOUT": int(
+        os.environ.get("VCENTER_POOL_ACQUIRE_TIMEOUT", "30")
+    ),  # seconds to wait for a free session
+    # Multi-vCenter federation
+    "VCENTER_SITES": os.environ.get(
+        "VCENTER_SITES", ""
+    ),  # name=host[/datacenter/cluster/network] entries separated by ";"
+    "FEDERATION_QUERY_TIMEOUT": int(
+        os.environ.get("FEDERATION_QUERY_TIMEOUT", "30")
+    ),  # seconds an inventory query waits for each site before reporting it as failed
+    # Inventory retrieval
+    "INVENTORY_PAGE_SIZE": int(
+        os.environ.get("INVENTORY_PAGE_SIZE", "1000")
+    ),  # objects per RetrievePropertiesEx page
+    # Inventory cache for the /api/* dropdown endpoints
+    "INVENTORY_CACHE_MAX_ENTRIES": int(
+        os.environ.get("INVENTORY_CACHE_MAX_ENTRIES", "512")
+    ),
+    "INVENTORY_CACHE_TTL": {
+        kind: int(os.environ.get(f"INVENTORY_CACHE_TTL_{kind.upper()}", default))
+        for kind, default in [
+            ("templates", "300"),
+            ("datacenters", "3600"),
+            ("clusters", "900"),
+            ("networks", "900"),
+            ("nic_count", "900"),
+        ]
+    },  # seconds per object kind, 0 disables caching for that kind
+    # Live inventory mirror (WaitForUpdatesEx)
+    "INVENTORY_MIRROR_ENABLED": str(
+        os.environ.get("INVENTORY_MIRROR_ENABLED", "false")
+    ).lower()
+    in ["true", "1", "yes", "on", "y"],
+    "INVENTORY_MIRROR_WAIT_SECONDS": int(
+        os.environ.get("INVENTORY_MIRROR_WAIT_SECONDS", "30")
+    ),  # maxWaitSeconds per WaitForUpdatesEx call
+    "INVENTORY_MIRROR_READY_TIMEOUT": int(
+        os.environ.get("INVENTORY_MIRROR_READY_TIMEOUT", "60")
+    ),  # seconds to wait for the initial full load
+    "INVENTORY_INDEX_TTL": int(
+        os.environ.get("INVENTORY_INDEX_TTL", "300")
+    ),  # seconds a bulk-built name index is reused when the mirror is off
+    "INVENTORY_INDEX_MIN_REBUILD": int(
+        os.environ.get("INVENTORY_INDEX_MIN_REBUILD", "10")
+    ),  # minimum index age before a lookup miss may rebuild it
+    # Clone task tracking
+    "TASK_TRACKER_WAIT_SECONDS": int(
+        os.environ.get("TASK_TRACKER_WAIT_SECONDS", "30")
+    ),  # maxWaitSeconds per WaitForUpdatesEx call while clones run
+    # Post-provision readiness (VMware Tools running, IP reported)
+    "READINESS_CHECK": str(
+        os.environ.get("READINESS_CHECK", "true")
+    ).lower()
+    in ["true", "1", "yes", "on", "y"],
+    "READINESS_TIMEOUT": int(
+        os.environ.get("READINESS_TIMEOUT", "900")
+    ),  # seconds after a batch's last clone its guests may take to report ready
+    # Clone submission window
+    "CLONE_MAX_IN_FLIGHT": int(
+        os.environ.get("CLONE_MAX_IN_FLIGHT", "16")
+    ),  # clone tasks running at once across all batches
+    "CLONE_MAX_IN_FLIGHT_PER_HOST": int(
+        os.environ.get("CLONE_MAX_IN_FLIGHT_PER_HOST", "8")
+    ),  # clone tasks running at once per vCenter
+    "CLONE_MAX_IN_FLIGHT_PER_DATASTORE": int(
+        os.environ.get("CLONE_MAX_IN_FLIGHT_PER_DATASTORE", "4")
+    ),  # clone tasks running at once per target datastore
+    "CLONE_SUBMIT_WORKERS": int(
+        os.environ.get("CLONE_SUBMIT_WORKERS", "4")
+    ),  # threads building specs and calling Clone() per batch
+    # Adaptive clone window (AIMD per datastore)
+    "CLONE_ADAPTIVE_ENABLED": str(
+        os.environ.get("CLONE_ADAPTIVE_ENABLED", "true")
+    ).lower()
+    in ["true", "1", "yes", "on", "y"],
+    "CLONE_WINDOW_INITIAL": int(
+        os.environ.get("CLONE_WINDOW_INITIAL", "2")
+    ),  # starting window per datastore, grows up to CLONE_MAX_IN_FLIGHT_PER_DATASTORE
+    "CLONE_QUEUE_TIME_THRESHOLD": float(
+        os.environ.get("CLONE_QUEUE_TIME_THRESHOLD", "10")
+    ),  # seconds a task may sit queued in vCenter before the window shrinks
+    "CLONE_SLOWDOWN_FACTOR": float(
+        os.environ.get("CLONE_SLOWDOWN_FACTOR", "2.0")
+    ),  # shrink when clones take this many times longer than the fastest recent one
+    "CLONE_ERROR_RATE_THRESHOLD": float(
+        os.environ.get("CLONE_ERROR_RATE_THRESHOLD", "0.2")
+    ),  # shrink when this share of recent clones failed
+    "CLONE_ADAPT_COOLDOWN": int(
+        os.environ.get("CLONE_ADAPT_COOLDOWN", "30")
+    ),  # minimum seconds between two decreases on the same datastore
+    # Datastore placement
+    "PLACEMENT_POLICY": os.environ.get(
+        "PLACEMENT_POLICY", "most-free"
+    ),  # most-free, round-robin or weighted
+    "PLACEMENT_MIN_FREE_PERCENT": float(
+        os.environ.get("PLACEMENT_MIN_FREE_PERCENT", "10")
+    ),  # share of capacity a datastore must keep free after a clone
+    "HOST_PLACEMENT": os.environ.get(
+        "HOST_PLACEMENT", "off"
+    ),  # off (vCenter picks at power-on), drs (PlaceVm, then load scoring) or load
+    "IP_CONFLICT_CHECK": os.environ.get(
+        "IP_CONFLICT_CHECK", "reallocate"
+    ),  # static IPs already owned by a guest: reallocate (bulk), reject or off
+    # Per-datastore template replicas for full clones
+    "TEMPLATE_REPLICAS_ENABLED": str(
+        os.environ.get("TEMPLATE_REPLICAS_ENABLED", "false")
+    ).lower()
+    in ["true", "1", "yes", "on", "y"],
+    "TEMPLATE_REPLICA_PREFIX": os.environ.get(
+        "TEMPLATE_REPLICA_PREFIX", "tpl-replica-"
+    ),  # name prefix of the replica templates
+    "TEMPLATE_REPLICA_MAX": int(
+        os.environ.get("TEMPLATE_REPLICA_MAX", "20")
+    ),  # replicas kept per vCenter; least recently used idle ones are removed
+    # Linked clones
+    "LINKED_CLONE_SNAPSHOT": os.environ.get(
+        "LINKED_CLONE_SNAPSHOT", "linked-clone-base"
+    ),  # template snapshot linked clones are based on (created when missing)
+    "LINKED_CLONE_DELTA_GB": float(
+        os.environ.get("LINKED_CLONE_DELTA_GB", "2")
+    ),  # space reserved per linked clone for its delta disk, on top of swap
+    # Instant clones
+    "INSTANT_CLONE_PARENT_PREFIX": os.environ.get(
+        "INSTANT_CLONE_PARENT_PREFIX", "ic-parent-"
+    ),  # name prefix of the running parent VMs
+    "INSTANT_CLONE_PARENT_MAX_AGE": int(
+        os.environ.get("INSTANT_CLONE_PARENT_MAX_AGE", "86400")
+    ),  # seconds before a parent is replaced by a fresh one
+    "INSTANT_CLONE_PARENT_MAX_CLONES": int(
+        os.environ.get("INSTANT_CLONE_PARENT_MAX_CLONES", "500")
+    ),  # children forked from one parent before it is replaced
+    "INSTANT_CLONE_PARENT_READY_TIMEOUT": int(
+        os.environ.get("INSTANT_CLONE_PARENT_READY_TIMEOUT", "600")
+    ),  # seconds a new parent may take to boot
+    # Provisioning job engine
+    "MAX_BATCH_SIZE": int(
+        os.environ.get("MAX_BATCH_SIZE", "5000")
+    ),  # most VMs one bulk request may provision
+    "PLAN_DEFAULT_CLONE_SECONDS": int(
+        os.environ.get("PLAN_DEFAULT_CLONE_SECONDS", "300")
+    ),  # clone duration dry runs assume when no past clone of the template is recorded
+    "DRY_RUN_MAX_VMS": int(
+        os.environ.get("DRY_RUN_MAX_VMS", "1000")
+    ),  # most VMs a dry run plans; it runs inside the web request
+    "JOB_WORKERS": int(
+        os.environ.get("JOB_WORKERS", "4")
+    ),  # provisioning batches running at once
+    "JOB_HISTORY": int(
+        os.environ.get("JOB_HISTORY", "200")
+    ),  # finished jobs kept for /api/jobs
+    # Per-job log channels
+    "LOG_CHANNEL_CAPACITY": int(
+        os.environ.get("LOG_CHANNEL_CAPACITY", "2000")
+    ),  # log lines kept per job; slower readers skip ahead
+    "LOG_MAX_CHANNELS": int(
+        os.environ.get("LOG_MAX_CHANNELS", "200")
+    ),  # job log channels kept in memory
+    "LOG_CHANNEL_RETENTION": int(
+        os.environ.get("LOG_CHANNEL_RETENTION", "3600")
+    ),  # seconds a finished job's log stays replayable
+    "STREAM_RETRY_MS": int(
+        os.environ.get("STREAM_RETRY_MS", "3000")
+    ),  # delay before a browser reconnects a dropped /stream
+    # Job and per-VM result store
+    "JOB_DB_PATH": os.environ.get("JOB_DB_PATH", "vm_provisioning.db"),
+    "JOB_DB_FLUSH_INTERVAL": float(
+        os.environ.get("JOB_DB_FLUSH_INTERVAL", "0.5")
+    ),  # seconds updates are collected into one write transaction
 }
@@ -0,0 +1,142 @@
+import ipaddress
+from collections import namedtuple
+
+from pyVmomi import vim
+
+from inventory import retrieve_object_properties
+from ip_allocation import DEFAULT_PREFIX
+
+DEFAULT_NETMASK = "255.255.255.0"
+
+# Template-derived settings of one NIC
+NicSettings = namedtuple("NicSettings", ["network", "netmask", "gateway"])
+
+
+class CompiledCustomization:
+    """
+    Everything a CustomizationSpec needs from the template, gathered once
+    per batch; spec() then only fills in one VM's hostname and IPs without
+    talking to vCenter.
+    """
+
+    def __init__(self, nics, os_type, domain="localdomain", subnets=None):
+        self.nics = tuple(nics)
+        self.os_type = os_type
+        self.domain = domain
+        self.subnets = dict(subnets or {})  # NIC index -> ipaddress network
+
+    def with_subnets(self, subnets):
+        """Copy whose NICs use the masks of the given {NIC index: network}"""
+        return CompiledCustomization(self.nics, self.os_type, self.domain, subnets)
+
+    def _address(self, index, ip):
+        """
+        (address, network) of one NIC's IP: a typed /prefix wins, then the
+        allocated subnet; IPv6 falls back to DEFAULT_PREFIX and IPv4 to the
+        template's mask (network None)
+        """
+        interface = ipaddress.ip_interface(str(ip).strip())
+        subnet = self.subnets.get(index)
+        if "/" in str(ip):
+            return str(interface.ip), interface.network
+        if subnet is not None and subnet.version == interface.version:
+            return str(interface.ip), subnet
+        if interface.version == 6:
+            return str(interface.ip), ipaddress.ip_interface(f"{interface.ip}/{DEFAULT_PREFIX[6]}").network
+        return str(interface.ip), None
+
+    def spec(self, hostname, ip_list):
+        nic_settings = []
+        for index, (nic, ip) in enumerate(zip(self.nics, ip_list)):
+            adapter = vim.vm.customization.AdapterMapping()
+            subnet = None
+            if ip:
+                ip, subnet = self._address(index, ip)
+            if ip and subnet is not None and subnet.version == 6:
+                adapter.adapter = vim.vm.customization.IPSettings(
+                    ip=vim.vm.customization.DhcpIpGenerator(),
+                    ipV6Spec=vim.vm.customization.IPSettings.IpV6AddressSpec(
+                        ip=[vim.vm.customization.FixedIpV6(ipAddress=ip, subnetMask=subnet.prefixlen)]
+                    ),
+                )
+            elif ip:
+                adapter.adapter = vim.vm.customization.IPSettings(
+                    ip=vim.vm.customization.FixedIp(ipAddress=ip),
+                    subnetMask=str(subnet.netmask) if subnet is not None else nic.netmask or DEFAULT_NETMASK,
+                    gateway=[nic.gateway] if nic.gateway else [],
+                )
+            else:
+                adapter.adapter = vim.vm.customization.IPSettings(
+                    ip=vim.vm.customization.DhcpIpGenerator()
+                )
+            nic_settings.append(adapter)
+
+        if self.os_type == "windows":
+            ident = vim.vm.customization.Sysprep(
+                guiUnattended=vim.vm.customization.GuiUnattended(
+                    autoLogon=False, autoLogonCount=1, timeZone=190
+                ),
+                userData=vim.vm.customization.UserData(
+                    computerName=vim.vm.customization.FixedName(name=hostname),
+                    fullName="Administrator",
+                    orgName="Organization",
+                ),
+                identification=vim.vm.customization.Identification(),
+            )
+        else:
+            ident = vim.vm.customization.LinuxPrep(
+                hostName=vim.vm.customization.FixedName(name=hostname), domain=self.domain
+            )
+        return vim.vm.customization.Specification(
+            nicSettingMap=nic_settings,
+            globalIPSettings=vim.vm.customization.GlobalIPSettings(),
+            identity=ident,
+        )
+
+
+def _pool_settings(content, datacenter):
+    """network moId -> (netmask, gateway) from the datacenter's IP pools"""
+    settings = {}
+    try:
+        pools = content.ipPoolManager.QueryIpPools(dc=datacenter)
+    except Exception:
+        return settings
+    for pool in pools or []:
+        config = pool.ipv4Config
+        if config is None:
+            continue
+        for association in pool.networkAssociation or []:
+            if association.network is not None:
+                settings[association.network._moId] = (config.subnetMask, config.gateway)
+    return settings
+
+
+def compile_customization(content, template_vm, datacenter, os_type=None, logger=print):
+    """
+    Inspect the template's NICs, the IP pools of their networks and the
+    guest OS family in two calls, for every VM of a batch to share
+    """
+    logger("🔍 Analyzing template network configuration...")
+    rows = retrieve_object_properties(
+        content, [template_vm], ["config.hardware.device", "config.guestId"]
+    )
+    row = rows[0] if rows else {}
+    guest_id = (row.get("config.guestId") or "").lower()
+    if guest_id:
+        os_type = "windows" if guest_id.startswith("win") else "linux"
+    os_type = os_type or "linux"
+
+    pools = _pool_settings(content, datacenter)
+    nics = []
+    for device in row.get("config.hardware.device") or []:
+        if not isinstance(device, vim.vm.device.VirtualEthernetCard):
+            continue
+        network = getattr(device.backing, "network", None) if device.backing else None
+        netmask, gateway = pools.get(network._moId, (None, None)) if network is not None else (None, None)
+        nics.append(NicSettings(network, netmask, gateway))
+
+    logger(f"📋 Found {len(nics)} NICs in template ({os_type} guest)")
+    for i, nic in enumerate(nics, 1):
+        if nic.netmask or nic.gateway:
+            logger(f"   NIC{i}: IP pool mask {nic.netmask or DEFAULT_NETMASK}, gateway {nic.gateway or '-'}")
+    return CompiledCustomization(nics, os_type)
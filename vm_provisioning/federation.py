@@ -0,0 +1,148 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config import config
+
+
+class Site:
+    """
+    One vCenter of the federation. datacenter, cluster and network name
+    where its share of a federated batch goes; None uses the batch's own.
+    """
+
+    def __init__(self, name, host, datacenter=None, cluster=None, network=None):
+        self.name = name
+        self.host = host
+        self.datacenter = datacenter
+        self.cluster = cluster
+        self.network = network
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "host": self.host,
+            "datacenter": self.datacenter,
+            "cluster": self.cluster,
+            "network": self.network,
+        }
+
+
+def parse_sites(text):
+    """Sites from "bkk=vc-bkk.example.com/DC1/Cluster1/VM Network; cnx=vc-cnx.example.com" """
+    sites = []
+    for entry in (text or "").split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, target = entry.partition("=")
+        if not sep or not name.strip() or not target.strip():
+            raise ValueError(f"Invalid vCenter site '{entry}' (use name=host[/datacenter/cluster/network])")
+        parts = [part.strip() or None for part in target.split("/", 3)]
+        parts += [None] * (4 - len(parts))
+        sites.append(Site(name.strip(), *parts))
+    names = [site.name for site in sites]
+    if len(set(names)) != len(names):
+        raise ValueError("vCenter site names must be unique")
+    return sites
+
+
+def split_batch(count, capacities):
+    """
+    Share count VMs out over the sites in proportion to how many clones
+    each has room for ({site name: clones}); largest remainders get the
+    leftover VMs and no site gets more than its capacity.
+    """
+    room = {name: max(0, int(capacity)) for name, capacity in capacities.items()}
+    total = sum(room.values())
+    if total < count:
+        raise ValueError(f"The sites have room for {total} clone(s), {count} requested")
+    if not count:
+        return {name: 0 for name in room}
+    shares = {name: count * capacity / total for name, capacity in room.items()}
+    split = {name: int(share) for name, share in shares.items()}
+    leftover = count - sum(split.values())
+    for name in sorted(room, key=lambda name: (split[name] - shares[name], -room[name]))[:leftover]:
+        split[name] += 1
+    return split
+
+
+class Federation:
+    """
+    The registered vCenters and concurrent fan-out over them.
+
+    fan_out() runs one call per site on its own thread, so a query over N
+    sites takes about as long as the slowest site instead of the sum.
+    Sites that fail or do not answer within the timeout are reported
+    alongside the results of the others.
+    """
+
+    def __init__(self, sites=(), timeout=30):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sites = {}  # name -> Site, in registration order
+        for site in sites:
+            self.register(site)
+
+    def register(self, site):
+        with self._lock:
+            if site.name in self._sites:
+                raise ValueError(f"vCenter site '{site.name}' is already registered")
+            self._sites[site.name] = site
+        return site
+
+    def unregister(self, name):
+        with self._lock:
+            return self._sites.pop(name, None)
+
+    @property
+    def sites(self):
+        with self._lock:
+            return list(self._sites.values())
+
+    def get(self, name):
+        with self._lock:
+            return self._sites.get(name)
+
+    def fan_out(self, call, sites=None, timeout=None):
+        """
+        call(site) for every site at once; returns [(site, result, error)]
+        in site order, error being None or the message of what went wrong.
+        With timeout=None the federation's timeout applies; pass 0 to wait
+        for every site.
+        """
+        sites = self.sites if sites is None else list(sites)
+        if not sites:
+            return []
+        timeout = self.timeout if timeout is None else timeout
+        executor = ThreadPoolExecutor(max_workers=len(sites), thread_name_prefix="federation")
+        try:
+            futures = [executor.submit(call, site) for site in sites]
+            wait(futures, timeout=timeout or None)
+        finally:
+            # A site that did not answer in time keeps its thread, not the caller
+            executor.shutdown(wait=False)
+        outcome = []
+        for site, future in zip(sites, futures):
+            if not future.done():
+                outcome.append((site, None, f"no answer within {timeout}s"))
+            elif future.exception() is not None:
+                outcome.append((site, None, str(future.exception())))
+            else:
+                outcome.append((site, future.result(), None))
+        return outcome
+
+    def merged(self, call, sites=None):
+        """
+        Fan a list-returning call out and merge the lists, tagging every item
+        with its site: ([{'name': item, 'site': name}], {site name: error})
+        """
+        items, errors = [], {}
+        for site, result, error in self.fan_out(call, sites):
+            if error is not None:
+                errors[site.name] = error
+                continue
+            items.extend({"name": item, "site": site.name} for item in result or [])
+        return items, errors
+
+
+federation = Federation(parse_sites(config["VCENTER_SITES"]), timeout=config["FEDERATION_QUERY_TIMEOUT"])
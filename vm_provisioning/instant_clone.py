@@ -0,0 +1,261 @@
+import threading
+import time
+
+from pyVmomi import vim, vmodl
+
+from config import config
+from inventory import PropertyCollector, has_privileges, retrieve_object_properties
+from task_tracker import wait_for_task
+
+# extraConfig keys read by the identity script inside the parent's guest
+GUESTINFO_PREFIX = "guestinfo.ic."
+
+# What a user must hold on a parent to fork children from it
+CLONE_PRIVILEGES = ["VirtualMachine.Provisioning.Clone"]
+
+
+def identity_config(hostname, ips):
+    """
+    extraConfig entries carrying one child's identity.
+
+    Instant clones resume the parent's running guest, so neither LinuxPrep
+    nor Sysprep runs; a script in the guest reads guestinfo.ic.hostname and
+    guestinfo.ic.nic<N>.ip (absent: DHCP) and applies them after the fork.
+    That script is not shipped with this app: the template must carry it
+    (see readme.md).
+    """
+    options = [vim.option.OptionValue(key=f"{GUESTINFO_PREFIX}hostname", value=hostname)]
+    for nic, ip in enumerate(ips, 1):
+        if ip:
+            options.append(vim.option.OptionValue(key=f"{GUESTINFO_PREFIX}nic{nic}.ip", value=ip))
+    return options
+
+
+def instant_clone_spec(name, hostname, ips, datastore, pool, folder):
+    location = vim.vm.RelocateSpec(datastore=datastore, pool=pool, folder=folder)
+    return vim.vm.InstantCloneSpec(
+        name=name, location=location, config=identity_config(hostname, ips)
+    )
+
+
+class Parent:
+    """A running VM instant clones are forked from"""
+
+    def __init__(self, key, vm, name):
+        self.key = key
+        self.vm = vm
+        self.name = name
+        self.created_at = time.time()
+        self.clones = 0
+        self.in_use = 0
+        self.retired = False
+        self.users = set()  # vCenter users found allowed to clone from it
+
+    def vm_for(self, si):
+        """The parent VM bound to the caller's session (it may have been found by another one)"""
+        return vim.VirtualMachine(self.vm._moId, si._stub)
+
+
+class ParentManager:
+    """
+    Running parent VMs for instant clones, one per template, ESXi host and
+    datastore of each vCenter.
+
+    A parent is a full clone of the template powered on on its host;
+    children fork from its running state and stay on that host. acquire()
+    reuses the current parent (also one left by an earlier run, found by
+    name) or creates it. A parent older than max_age or that has served
+    max_clones children is retired: new clones get a fresh parent and the
+    old one is powered off and destroyed once no clone uses it any more.
+    Parents are shared between users: each one must hold the clone
+    privilege on a parent before it is handed out, and a parent removed or
+    powered off outside this app is replaced.
+
+    Parents are not frozen. Since vSphere 6.7 InstantClone_Task forks a
+    running VM directly, stunning it only for the fork, and freezing needs
+    vmware-rpctool run inside the guest, for which this app has no guest
+    credentials. The child's identity is applied by the guest script after
+    the fork instead (see identity_config).
+    """
+
+    def __init__(self, prefix="ic-parent-", max_age=86400, max_clones=500, ready_timeout=600):
+        self.prefix = prefix
+        self.max_age = max_age
+        self.max_clones = max_clones
+        self.ready_timeout = ready_timeout
+        self._lock = threading.Lock()
+        self._parents = {}  # (vCenter host, template, ESXi host, datastore moIds) -> Parent
+        self._key_locks = {}  # same key -> Lock serialising parent creation
+        self.stats = {"created": 0, "reused": 0, "retired": 0}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _expired(self, parent):
+        return (
+            time.time() - parent.created_at > self.max_age
+            or parent.clones >= self.max_clones
+        )
+
+    def acquire(self, si, vcenter_host, template_vm, host, datastore, pool, folder, logger=print, user=None):
+        """
+        Parent for the next clone on host/datastore; pair with release().
+        Fork from parent.vm_for(si), not parent.vm.
+        """
+        key = (vcenter_host, template_vm._moId, host._moId, datastore._moId)
+        with self._key_lock(key):
+            with self._lock:
+                parent = self._parents.get(key)
+            if parent is not None and self._expired(parent):
+                logger(f"♻️ Retiring instant-clone parent {parent.name} after {parent.clones} clone(s)")
+                self._retire(si, parent, logger)
+                parent = None
+            if parent is not None and self._power_state(si, parent.vm_for(si)) != "poweredOn":
+                logger(f"♻️ Instant-clone parent {parent.name} was removed or stopped; replacing it")
+                self._retire(si, parent, logger)
+                parent = None
+            if parent is None:
+                parent = self._open(si, key, template_vm, host, datastore, pool, folder, logger)
+                parent.users.add(user)
+            self._check_allowed(si, parent, user)
+            with self._lock:
+                self._parents[key] = parent
+                parent.clones += 1
+                parent.in_use += 1
+            return parent
+
+    def release(self, si, parent, logger=print):
+        """A clone from parent finished; destroys a retired parent nobody uses"""
+        with self._lock:
+            parent.in_use -= 1
+            destroy = parent.retired and parent.in_use <= 0
+        if destroy:
+            self._destroy(si, parent, logger)
+
+    @staticmethod
+    def _power_state(si, vm):
+        """runtime.powerState of vm, None once it no longer exists"""
+        try:
+            rows = retrieve_object_properties(si.RetrieveContent(), [vm], ["runtime.powerState"])
+        except vmodl.fault.ManagedObjectNotFound:
+            return None
+        return rows[0].get("runtime.powerState") if rows else None
+
+    def _check_allowed(self, si, parent, user):
+        """Raise unless user may clone from parent (checked once per parent and user)"""
+        with self._lock:
+            if user in parent.users:
+                return
+        if not has_privileges(si.RetrieveContent(), parent.vm_for(si), CLONE_PRIVILEGES):
+            raise Exception(f"{user or 'This user'} may not clone from instant-clone parent {parent.name}")
+        with self._lock:
+            parent.users.add(user)
+
+    def _retire(self, si, parent, logger):
+        with self._lock:
+            parent.retired = True
+            if self._parents.get(parent.key) is parent:
+                del self._parents[parent.key]
+            destroy = parent.in_use <= 0
+        self.stats["retired"] += 1
+        if destroy:
+            self._destroy(si, parent, logger)
+
+    def _open(self, si, key, template_vm, host, datastore, pool, folder, logger):
+        content = si.RetrieveContent()
+        names = {}
+        for obj in (template_vm, host, datastore):
+            rows = retrieve_object_properties(content, [obj], ["name"])
+            names[obj._moId] = rows[0].get("name", obj._moId) if rows else obj._moId
+        name = (
+            f"{self.prefix}{names[template_vm._moId]}-"
+            f"{names[host._moId].split('.')[0]}-{names[datastore._moId]}"
+        )
+        vm = content.searchIndex.FindChild(folder, name)
+        if vm is not None:
+            if self._power_state(si, vm) == "poweredOn":
+                logger(f"🧬 Reusing instant-clone parent {name}")
+                self.stats["reused"] += 1
+                return Parent(key, vm, name)
+            # A stopped leftover cannot be forked from; start over
+            self._destroy(si, Parent(key, vm, name), logger)
+
+        logger(f"🧬 Creating instant-clone parent {name} on {names[host._moId]}")
+        spec = vim.vm.CloneSpec(
+            location=vim.vm.RelocateSpec(host=host, datastore=datastore, pool=pool),
+            powerOn=True,
+        )
+        result = wait_for_task(si, template_vm.Clone(folder=folder, name=name, spec=spec), name)
+        if not result.succeeded:
+            raise Exception(f"Could not create instant-clone parent {name}: {result.error_message}")
+        vm = result.result
+        self._wait_ready(si, vm, name)
+        self.stats["created"] += 1
+        logger(f"✅ Instant-clone parent {name} is running")
+        return Parent(key, vm, name)
+
+    def _wait_ready(self, si, vm, name):
+        """Wait until the parent's guest has VMware Tools running"""
+        content = si.RetrieveContent()
+        # A private collector keeps this filter out of the shared session collector
+        collector = content.propertyCollector.CreatePropertyCollector()
+        try:
+            spec = PropertyCollector.FilterSpec(
+                objectSet=[PropertyCollector.ObjectSpec(obj=vm, skip=False)],
+                propSet=[
+                    PropertyCollector.PropertySpec(
+                        type=vim.VirtualMachine, pathSet=["guest.toolsRunningStatus"], all=False
+                    )
+                ],
+            )
+            collector.CreateFilter(spec, partialUpdates=False)
+            deadline = time.time() + self.ready_timeout
+            version = ""
+            status = None
+            while status != "guestToolsRunning":
+                left = deadline - time.time()
+                if left <= 0:
+                    raise Exception(
+                        f"Instant-clone parent {name} did not boot within {self.ready_timeout}s "
+                        f"(VMware Tools {status or 'not reporting'})"
+                    )
+                options = PropertyCollector.WaitOptions(maxWaitSeconds=max(1, int(left)))
+                update_set = collector.WaitForUpdatesEx(version, options)
+                if update_set is None:
+                    continue
+                version = update_set.version
+                for filter_update in update_set.filterSet or []:
+                    for obj_update in filter_update.objectSet or []:
+                        for change in obj_update.changeSet or []:
+                            if change.name == "guest.toolsRunningStatus":
+                                status = change.val
+        finally:
+            try:
+                collector.DestroyPropertyCollector()
+            except Exception:
+                pass
+
+    def _destroy(self, si, parent, logger):
+        vm = parent.vm_for(si)
+        try:
+            state = self._power_state(si, vm)
+            if state is None:
+                # Already removed outside this app
+                return
+            if state == "poweredOn":
+                wait_for_task(si, vm.PowerOffVM_Task(), parent.name)
+            result = wait_for_task(si, vm.Destroy_Task(), parent.name)
+            if not result.succeeded:
+                raise Exception(result.error_message)
+            logger(f"🗑️ Destroyed instant-clone parent {parent.name}")
+        except Exception as e:
+            logger(f"⚠️ Could not destroy instant-clone parent {parent.name}: {e}")
+
+
+parents = ParentManager(
+    prefix=config["INSTANT_CLONE_PARENT_PREFIX"],
+    max_age=config["INSTANT_CLONE_PARENT_MAX_AGE"],
+    max_clones=config["INSTANT_CLONE_PARENT_MAX_CLONES"],
+    ready_timeout=config["INSTANT_CLONE_PARENT_READY_TIMEOUT"],
+)
@@ -0,0 +1,155 @@
+import ipaddress
+
+from pyVmomi import vim, vmodl
+
+from config import config
+
+PropertyCollector = vmodl.query.PropertyCollector
+
+
+def _collect(content, filter_spec, page_size=None):
+    """Run RetrievePropertiesEx and follow ContinueRetrievePropertiesEx pages"""
+    page_size = page_size or config["INVENTORY_PAGE_SIZE"]
+    collector = content.propertyCollector
+    options = PropertyCollector.RetrieveOptions(maxObjects=page_size)
+    rows = []
+    result = collector.RetrievePropertiesEx([filter_spec], options)
+    while result:
+        for obj_content in result.objects:
+            row = {"obj": obj_content.obj}
+            for prop in obj_content.propSet or []:
+                row[prop.name] = prop.val
+            rows.append(row)
+        if not result.token:
+            break
+        result = collector.ContinueRetrievePropertiesEx(result.token)
+    return rows
+
+
+def view_filter_spec(view, obj_type, path_set):
+    """FilterSpec walking a ContainerView and collecting path_set of obj_type"""
+    return multi_view_filter_spec(view, {obj_type: path_set})
+
+
+def multi_view_filter_spec(view, type_paths):
+    """FilterSpec walking a ContainerView, with one property list per type"""
+    traversal = PropertyCollector.TraversalSpec(
+        name="traverseView", path="view", skip=False, type=vim.view.ContainerView
+    )
+    obj_spec = PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+    prop_specs = [
+        PropertyCollector.PropertySpec(type=obj_type, pathSet=list(paths), all=False)
+        for obj_type, paths in type_paths.items()
+    ]
+    return PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+
+
+def retrieve_properties(content, obj_type, path_set, container=None, recursive=True, page_size=None):
+    """
+    Fetch the given property paths for every obj_type object below container
+    in a single RetrievePropertiesEx call (plus continuation pages).
+
+    Returns a list of dicts: {'obj': <managed object>, '<path>': value, ...}.
+    Properties that are unset on an object are simply absent from its dict.
+    """
+    view = content.viewManager.CreateContainerView(
+        container or content.rootFolder, [obj_type], recursive
+    )
+    try:
+        return _collect(content, view_filter_spec(view, obj_type, path_set), page_size)
+    finally:
+        view.Destroy()
+
+
+def retrieve_types(content, type_paths, container=None, page_size=None):
+    """Like retrieve_properties, for several types in the same call"""
+    view = content.viewManager.CreateContainerView(
+        container or content.rootFolder, list(type_paths), True
+    )
+    try:
+        return _collect(content, multi_view_filter_spec(view, type_paths), page_size)
+    finally:
+        view.Destroy()
+
+
+def retrieve_object_properties(content, objects, path_set, page_size=None):
+    """Fetch path_set for an explicit list of managed objects of the same type"""
+    objects = list(objects)
+    if not objects:
+        return []
+    obj_specs = [PropertyCollector.ObjectSpec(obj=obj, skip=False) for obj in objects]
+    prop_spec = PropertyCollector.PropertySpec(
+        type=type(objects[0]), pathSet=list(path_set), all=False
+    )
+    filter_spec = PropertyCollector.FilterSpec(objectSet=obj_specs, propSet=[prop_spec])
+    return _collect(content, filter_spec, page_size)
+
+
+def has_privileges(content, entity, privileges):
+    """Whether the user of this session holds every privilege on entity"""
+    granted = content.authorizationManager.HasPrivilegeOnEntity(
+        entity, content.sessionManager.currentSession.key, list(privileges)
+    )
+    return bool(granted) and all(granted)
+
+
+def find_datacenter_ref(content, datacenter_name):
+    """Datacenter managed object for a name, using one bulk name fetch"""
+    for row in retrieve_properties(content, vim.Datacenter, ["name"]):
+        if row.get("name") == datacenter_name:
+            return row["obj"]
+    return None
+
+
+def list_names(content, obj_type, container=None):
+    """Sorted names of all obj_type objects below container"""
+    rows = retrieve_properties(content, obj_type, ["name"], container=container)
+    return sorted(row["name"] for row in rows if "name" in row)
+
+
+def is_helper_vm(name):
+    """
+    VMs this app keeps for itself (replica_cache template copies,
+    instant-clone parents) are not offered in inventory listings
+    """
+    prefixes = (config["TEMPLATE_REPLICA_PREFIX"], config["INSTANT_CLONE_PARENT_PREFIX"])
+    return bool(name) and name.startswith(tuple(p for p in prefixes if p))
+
+
+def list_templates(content):
+    """Rows (obj, name) for every VM marked as template, helper VMs left out"""
+    rows = retrieve_properties(content, vim.VirtualMachine, ["name", "config.template"])
+    return [row for row in rows if row.get("config.template") and not is_helper_vm(row.get("name"))]
+
+
+def guest_ip_owners(content, container=None):
+    """
+    {address: VM name} for every IP a guest below container reports, from
+    guest.ipAddress and guest.net in a single property fetch
+    """
+    owners = {}
+    rows = retrieve_properties(
+        content, vim.VirtualMachine, ["name", "guest.ipAddress", "guest.net"], container=container
+    )
+    for row in rows:
+        name = row.get("name", row["obj"]._moId)
+        addresses = [row.get("guest.ipAddress")]
+        for nic in row.get("guest.net") or []:
+            addresses.extend(nic.ipAddress or [])
+        for address in addresses:
+            if not address:
+                continue
+            try:
+                # Normalised so "fd00::0a" and "fd00::a" collide; drop %zone
+                address = str(ipaddress.ip_address(address.split("%")[0]))
+            except ValueError:
+                continue
+            owners.setdefault(address, name)
+    return owners
+
+
+def count_nics(devices):
+    """Number of virtual ethernet cards in a config.hardware.device list"""
+    return len(
+        [d for d in devices or [] if isinstance(d, vim.vm.device.VirtualEthernetCard)]
+    )
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class InventoryCache:
+    """
+    Server-side inventory cache keyed by (vCenter host, kind, args, user);
+    users can have different permissions on the same vCenter, so each sees
+    only what was loaded with their own credentials.
+
+    Entries expire after the TTL configured for their kind and the cache is
+    bounded by max_entries with least-recently-used eviction. Concurrent misses
+    on the same key are collapsed so only one caller queries vCenter while the
+    others wait for its result. invalidate() bumps the host's generation, so
+    a load that was already running when it was called is not stored.
+    """
+
+    def __init__(self, ttls, default_ttl=300, max_entries=512):
+        self.ttls = dict(ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._loading = {}  # key -> threading.Event
+        self._generations = {}  # host -> invalidations so far
+        self._epoch = 0  # invalidations of all hosts so far
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _ttl(self, kind):
+        return self.ttls.get(kind, self.default_ttl)
+
+    def _generation(self, host):
+        """Current generation of host's entries (caller holds the lock)"""
+        return self._epoch, self._generations.get(host, 0)
+
+    def get_or_load(self, host, kind, loader, *args, user=None):
+        """Return the cached value for (host, kind, args, user) or call loader(*args)"""
+        key = (host, kind, args, user)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+                if entry:
+                    del self._entries[key]
+                pending = self._loading.get(key)
+                if pending is None:
+                    pending = self._loading[key] = threading.Event()
+                    generation = self._generation(host)
+                    self.stats["misses"] += 1
+                    break
+            # Another request is already loading this key
+            pending.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                # The loader failed or the entry was invalidated; try ourselves
+                continue
+
+        try:
+            value = loader(*args)
+            self._store(key, value, generation)
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.set()
+
+    def _store(self, key, value, generation):
+        ttl = self._ttl(key[1])
+        if ttl <= 0:
+            return
+        with self._lock:
+            if self._generation(key[0]) != generation:
+                # Invalidated while loading: the value may predate the change
+                return
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, host=None, kinds=None):
+        """Drop entries for a host (all hosts if None), optionally only some kinds"""
+        with self._lock:
+            if host is None:
+                self._epoch += 1
+            else:
+                self._generations[host] = self._generations.get(host, 0) + 1
+            for key in list(self._entries):
+                if host is not None and key[0] != host:
+                    continue
+                if kinds is not None and key[1] not in kinds:
+                    continue
+                del self._entries[key]
+                self.stats["invalidations"] += 1
+
+    def snapshot(self):
+        """Size and hit/miss counters for diagnostics"""
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), max_entries=self.max_entries)
@@ -0,0 +1,214 @@
+import threading
+import time
+
+from pyVmomi import vim
+
+from config import config
+from inventory import retrieve_properties, retrieve_types
+
+# Managed object kinds the index distinguishes; subclasses (for example
+# DistributedVirtualPortgroup under Network) are indexed under their base kind
+INDEXED_KINDS = (
+    vim.VirtualMachine,
+    vim.Datacenter,
+    vim.ClusterComputeResource,
+    vim.Network,
+    vim.Datastore,
+)
+
+# Properties needed to build the index from one bulk fetch
+INDEX_PROPERTIES = {
+    vim.Folder: ["name", "parent"],
+    vim.Datacenter: ["name", "parent"],
+    vim.ClusterComputeResource: ["name", "parent"],
+    vim.Network: ["name", "parent"],
+    vim.Datastore: ["name", "parent"],
+    vim.VirtualMachine: ["name", "parent"],
+}
+
+
+def kind_of(obj_or_type):
+    """Base kind used as the first part of index keys"""
+    cls = obj_or_type if isinstance(obj_or_type, type) else type(obj_or_type)
+    for kind in INDEXED_KINDS:
+        if issubclass(cls, kind):
+            return kind
+    return None
+
+
+def datacenter_of(obj, parent_of):
+    """Walk parent links (parent_of(obj) -> parent) up to the owning Datacenter"""
+    depth = 0
+    while obj is not None and depth < 64:
+        if isinstance(obj, vim.Datacenter):
+            return obj
+        obj = parent_of(obj)
+        depth += 1
+    return None
+
+
+def escape_path_part(name):
+    """Escape one inventory path element the way vCenter expects"""
+    return name.replace("%", "%25").replace("/", "%2f").replace("\\", "%5c")
+
+
+def find_by_inventory_path(content, *parts, expected_type=None):
+    """SearchIndex.FindByInventoryPath for a path built from raw names"""
+    path = "/".join(escape_path_part(p) for p in parts)
+    obj = content.searchIndex.FindByInventoryPath(path)
+    if obj is not None and expected_type is not None and not isinstance(obj, expected_type):
+        return None
+    return obj
+
+
+class InventoryIndex:
+    """
+    Hash index from (kind, name, datacenter moId) to managed object references.
+
+    Every object is also reachable without a datacenter (key datacenter None),
+    which is how VMs and templates are looked up by name alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = {}  # (kind, name, dc moId or None) -> [objects]
+        self._keys = {}  # object -> keys it is filed under
+
+    def __len__(self):
+        return len(self._keys)
+
+    def put(self, obj, name, datacenter=None):
+        kind = kind_of(obj)
+        with self._lock:
+            self.remove(obj)
+            if kind is None or name is None:
+                return
+            keys = [(kind, name, None)]
+            if datacenter is not None:
+                keys.append((kind, name, datacenter._moId))
+            for key in keys:
+                self._index.setdefault(key, []).append(obj)
+            self._keys[obj] = keys
+
+    def remove(self, obj):
+        with self._lock:
+            for key in self._keys.pop(obj, []):
+                bucket = self._index.get(key, [])
+                if obj in bucket:
+                    bucket.remove(obj)
+                if not bucket:
+                    self._index.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            self._keys.clear()
+
+    def find(self, obj_type, name, datacenter=None):
+        """O(1) lookup; None when no object of that kind has that name"""
+        key = (kind_of(obj_type), name, datacenter._moId if datacenter is not None else None)
+        with self._lock:
+            bucket = self._index.get(key)
+            if not bucket:
+                return None
+            for obj in bucket:
+                if isinstance(obj, obj_type):
+                    return obj
+            return None
+
+
+def find_by_name(content, obj_type, name, datacenter=None):
+    """
+    One-off lookup without an index: a single name fetch for obj_type
+    below datacenter (or the whole inventory)
+    """
+    for row in retrieve_properties(content, obj_type, ["name"], container=datacenter):
+        if row.get("name") == name and isinstance(row["obj"], obj_type):
+            return row["obj"]
+    return None
+
+
+def build_index(content):
+    """Build an InventoryIndex from a single bulk name/parent fetch"""
+    rows = retrieve_types(content, INDEX_PROPERTIES)
+    parents = {row["obj"]: row.get("parent") for row in rows}
+    index = InventoryIndex()
+    for row in rows:
+        if isinstance(row["obj"], vim.Datacenter):
+            index.put(row["obj"], row.get("name"))
+        else:
+            index.put(row["obj"], row.get("name"), datacenter_of(row.get("parent"), parents.get))
+    return index
+
+
+class CachedIndex:
+    """
+    An InventoryIndex built from a bulk fetch and reused for INVENTORY_INDEX_TTL.
+
+    Hits are confirmed with a single name read so renamed or deleted objects
+    cause one rebuild instead of a wrong answer. Misses and stale hits only
+    rebuild once the index is min_rebuild seconds old, so lookups of names
+    that do not exist cannot turn every call into a full inventory fetch.
+    """
+
+    def __init__(self, ttl, min_rebuild=None):
+        self.ttl = ttl
+        self.min_rebuild = config["INVENTORY_INDEX_MIN_REBUILD"] if min_rebuild is None else min_rebuild
+        self._lock = threading.Lock()
+        self._index = None
+        self._built_at = 0
+
+    def _current(self, content, force=False):
+        with self._lock:
+            age = time.time() - self._built_at
+            if force and age < self.min_rebuild:
+                force = False
+            if force or self._index is None or age > self.ttl:
+                self._index = build_index(content)
+                self._built_at = time.time()
+            return self._index
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+    def find(self, content, obj_type, name, datacenter=None):
+        for attempt in range(2):
+            if attempt > 0 and time.time() - self._built_at < self.min_rebuild:
+                # Rebuilt moments ago, a rebuild would not know more
+                return None
+            obj = self._current(content, force=attempt > 0).find(obj_type, name, datacenter)
+            if obj is None:
+                if attempt == 0:
+                    # Possibly created after the index was built
+                    continue
+                return None
+            bound = type(obj)(obj._moId, stub=content.rootFolder._stub)
+            try:
+                if bound.name == name:
+                    return bound
+            except vim.fault.ManagedObjectNotFound:
+                pass
+        return None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(vcenter_host, vcenter_user):
+    """Shared CachedIndex for (host, user)"""
+    key = (vcenter_host, vcenter_user)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = CachedIndex(config["INVENTORY_INDEX_TTL"])
+        return index
+
+
+def invalidate_indexes(vcenter_host=None):
+    """Drop the indexes of one vCenter (all with None), e.g. after provisioning"""
+    with _indexes_lock:
+        for (host, _user), index in _indexes.items():
+            if vcenter_host is None or host == vcenter_host:
+                index.invalidate()
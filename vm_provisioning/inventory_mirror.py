@@ -0,0 +1,393 @@
+import atexit
+import hmac
+import logging
+import threading
+import time
+
+from pyVmomi import vim
+
+from config import config
+from inventory import PropertyCollector, is_helper_vm, multi_view_filter_spec
+from inventory_index import InventoryIndex, datacenter_of
+from vcenter_pool import _digest, pool_for
+
+# Property paths mirrored per managed object type
+MIRRORED_PROPERTIES = {
+    vim.Folder: ["name", "parent"],
+    vim.Datacenter: ["name", "parent"],
+    vim.ClusterComputeResource: ["name", "parent"],
+    vim.Network: ["name", "parent"],
+    vim.Datastore: [
+        "name",
+        "parent",
+        "summary.freeSpace",
+        "summary.capacity",
+        "summary.accessible",
+        "summary.maintenanceMode",
+    ],
+    vim.VirtualMachine: ["name", "parent", "config.template"],
+}
+
+# Extra paths watched only on templates (kept off the 20k-VM view on purpose)
+TEMPLATE_PROPERTIES = ["config.hardware.device"]
+
+
+def rebind(obj, stub):
+    """Copy of a mirrored managed object reference bound to another session's stub"""
+    if obj is None:
+        return None
+    return type(obj)(obj._moId, stub=stub)
+
+
+class InventoryMirror(threading.Thread):
+    """
+    In-process copy of a vCenter inventory kept current by WaitForUpdatesEx.
+
+    One filtered PropertyCollector view over folders, datacenters, clusters,
+    networks, datastores and VMs is created once; the first update set is the
+    full load and afterwards only deltas arrive. Templates additionally get a
+    per-object filter for their device list so NIC counts need no round trip.
+    Each update set is applied incrementally: only the objects it carries
+    (and the subtree of a moved folder or datacenter) are reindexed, and only
+    VMs whose template flag changed get a device filter added or dropped.
+    The mirror holds one pooled session for its lifetime.
+    """
+
+    def __init__(self, host, user, pwd, wait_seconds=30, logger=None):
+        super().__init__(name=f"inventory-mirror-{host}", daemon=True)
+        self.host = host
+        self.user = user
+        self._pwd = pwd
+        self.pwd_digest = _digest(pwd)
+        self.wait_seconds = wait_seconds
+        self.log = logger or logging.getLogger(__name__)
+        self.ready = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.RLock()
+        self._objects = {}  # managed object -> {property path: value}
+        self._children = {}  # managed object -> set of objects whose parent it is
+        self._session = None
+        self._collector = None
+        self._view = None
+        self._view_filter = None
+        self._template_filters = {}  # template VM -> PropertyFilter
+        self.index = InventoryIndex()  # (kind, name, datacenter) -> object
+        self.version = ""
+        self.last_update = None
+        self.stats = {"full_loads": 0, "update_sets": 0, "object_updates": 0, "errors": 0}
+
+    # ---- sync loop -------------------------------------------------------
+    def run(self):
+        backoff = 1
+        while not self._stopping.is_set():
+            try:
+                self._open()
+                backoff = 1
+                while not self._stopping.is_set():
+                    self._wait_once()
+            except Exception as e:
+                if self._stopping.is_set():
+                    break
+                self.stats["errors"] += 1
+                self.log.warning(
+                    f"Inventory mirror for {self.host} lost sync ({e}); reloading in {backoff}s"
+                )
+                self._close(discard=True)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 60)
+        self._close()
+
+    def _open(self):
+        self._session = pool_for(self.host).acquire(self.host, self.user, self._pwd)
+        content = self._session.si.RetrieveContent()
+        # A private collector keeps our filters out of the shared session collector
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateContainerView(
+            content.rootFolder, list(MIRRORED_PROPERTIES), True
+        )
+        spec = multi_view_filter_spec(self._view, MIRRORED_PROPERTIES)
+        self._view_filter = self._collector.CreateFilter(spec, partialUpdates=True)
+        with self._lock:
+            self._objects.clear()
+            self._children.clear()
+            self.index.clear()
+        self._template_filters = {}
+        self.version = ""
+        self.stats["full_loads"] += 1
+
+    def _close(self, discard=False):
+        # Destroying the collector also destroys its filters
+        cleanup = [
+            (self._collector, "DestroyPropertyCollector"),
+            (self._view, "Destroy"),
+        ]
+        for obj, method in cleanup:
+            if obj is None:
+                continue
+            try:
+                getattr(obj, method)()
+            except Exception:
+                pass
+        self._collector = self._view = self._view_filter = None
+        self._template_filters = {}
+        if self._session is not None:
+            pool_for(self.host).release(self._session, discard=discard)
+            self._session = None
+        self.ready.clear()
+
+    def _wait_once(self):
+        options = PropertyCollector.WaitOptions(maxWaitSeconds=self.wait_seconds)
+        update_set = self._collector.WaitForUpdatesEx(self.version, options)
+        if update_set is None:
+            # Nothing changed within maxWaitSeconds; the initial load is done
+            self.ready.set()
+            return
+        self.version = update_set.version
+        moved, reparented, flagged = set(), set(), set()
+        with self._lock:
+            for filter_update in update_set.filterSet or []:
+                from_view = filter_update.filter == self._view_filter
+                for obj_update in filter_update.objectSet or []:
+                    changed = self._apply(obj_update, from_view)
+                    if changed & {"name", "parent"}:
+                        moved.add(obj_update.obj)
+                    if "parent" in changed:
+                        reparented.add(obj_update.obj)
+                    if "config.template" in changed:
+                        flagged.add(obj_update.obj)
+            self._reindex(moved, reparented)
+        self.stats["update_sets"] += 1
+        self.last_update = time.time()
+        self._sync_template_filters(flagged)
+        if not update_set.truncated:
+            self.ready.set()
+
+    def _apply(self, obj_update, from_view):
+        """Apply one object update; returns the mirrored paths it changed"""
+        self.stats["object_updates"] += 1
+        obj = obj_update.obj
+        if obj_update.kind == "leave":
+            if from_view:
+                props = self._objects.pop(obj, None) or {}
+                self._children.get(props.get("parent"), set()).discard(obj)
+                self._children.pop(obj, None)
+                return {"name", "parent", "config.template"}
+            props = self._objects.get(obj)
+            for path in TEMPLATE_PROPERTIES:
+                if props:
+                    props.pop(path, None)
+            return set()
+        props = self._objects.setdefault(obj, {})
+        changed = set()
+        for change in obj_update.changeSet or []:
+            if change.name == "parent":
+                self._children.get(props.get("parent"), set()).discard(obj)
+            if change.op in ("remove", "indirectRemove"):
+                props.pop(change.name, None)
+            else:
+                props[change.name] = change.val
+            if change.name == "parent" and props.get("parent") is not None:
+                self._children.setdefault(props["parent"], set()).add(obj)
+            changed.add(change.name)
+        return changed
+
+    def _parent_of(self, obj):
+        return self._objects.get(obj, {}).get("parent")
+
+    def _descendants(self, roots):
+        """Every mirrored object below the given folders/datacenters"""
+        found, pending = set(), list(roots)
+        while pending:
+            for child in self._children.get(pending.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    pending.append(child)
+        return found
+
+    def _reindex(self, moved, reparented=()):
+        """Keep the name index in step with the objects touched by an update set"""
+        if not moved:
+            return
+        # A moved folder or datacenter can take a subtree to another datacenter
+        containers = [obj for obj in reparented if isinstance(obj, (vim.Folder, vim.Datacenter))]
+        if containers:
+            moved = set(moved) | self._descendants(containers)
+        for obj in moved:
+            props = self._objects.get(obj)
+            if props is None:
+                self.index.remove(obj)
+            elif isinstance(obj, vim.Datacenter):
+                self.index.put(obj, props.get("name"))
+            else:
+                self.index.put(obj, props.get("name"), self._datacenter_of(props.get("parent")))
+
+    def _sync_template_filters(self, flagged):
+        """Add or drop device-list filters for VMs whose template flag changed"""
+        with self._lock:
+            templates = {
+                obj
+                for obj in flagged
+                if isinstance(obj, vim.VirtualMachine)
+                and self._objects.get(obj, {}).get("config.template")
+            }
+        for obj in flagged:
+            if obj in self._template_filters and obj not in templates:
+                prop_filter = self._template_filters.pop(obj)
+                try:
+                    prop_filter.DestroyPropertyFilter()
+                except Exception:
+                    pass
+                with self._lock:
+                    props = self._objects.get(obj)
+                    for path in TEMPLATE_PROPERTIES:
+                        if props:
+                            props.pop(path, None)
+        for obj in templates - set(self._template_filters):
+            spec = PropertyCollector.FilterSpec(
+                objectSet=[PropertyCollector.ObjectSpec(obj=obj, skip=False)],
+                propSet=[
+                    PropertyCollector.PropertySpec(
+                        type=vim.VirtualMachine, pathSet=TEMPLATE_PROPERTIES, all=False
+                    )
+                ],
+            )
+            self._template_filters[obj] = self._collector.CreateFilter(spec, partialUpdates=True)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        collector = self._collector
+        if collector is not None:
+            try:
+                collector.CancelWaitForUpdates()
+            except Exception:
+                pass
+        if self.is_alive():
+            self.join(timeout)
+
+    # ---- queries (no vCenter round trips) -------------------------------
+    def _datacenter_of(self, obj):
+        """Walk mirrored parent links up to the owning Datacenter"""
+        return datacenter_of(obj, self._parent_of)
+
+    def _select(self, obj_type, datacenter_name=None, datacenter=None):
+        with self._lock:
+            rows = []
+            for obj, props in self._objects.items():
+                if not isinstance(obj, obj_type) or "name" not in props:
+                    continue
+                if datacenter_name is not None or datacenter is not None:
+                    dc = self._datacenter_of(props.get("parent"))
+                    if dc is None:
+                        continue
+                    if datacenter is not None and dc._moId != datacenter._moId:
+                        continue
+                    if (
+                        datacenter_name is not None
+                        and self._objects.get(dc, {}).get("name") != datacenter_name
+                    ):
+                        continue
+                rows.append((obj, props))
+            return rows
+
+    def template_names(self):
+        return sorted(
+            props["name"]
+            for obj, props in self._select(vim.VirtualMachine)
+            if props.get("config.template") and not is_helper_vm(props["name"])
+        )
+
+    def datacenter_names(self):
+        return sorted(props["name"] for obj, props in self._select(vim.Datacenter))
+
+    def cluster_names(self, datacenter_name):
+        return sorted(
+            props["name"]
+            for obj, props in self._select(
+                vim.ClusterComputeResource, datacenter_name=datacenter_name
+            )
+        )
+
+    def network_names(self, datacenter_name):
+        return sorted(
+            props["name"]
+            for obj, props in self._select(vim.Network, datacenter_name=datacenter_name)
+        )
+
+    def nic_count(self, template_name):
+        """NIC count of a template, or None when its devices are not mirrored yet"""
+        for obj, props in self._select(vim.VirtualMachine):
+            if props.get("name") == template_name and props.get("config.template"):
+                devices = props.get("config.hardware.device")
+                if devices is None:
+                    return None
+                return len(
+                    [d for d in devices if isinstance(d, vim.vm.device.VirtualEthernetCard)]
+                )
+        return None
+
+    def find(self, obj_type, name, datacenter=None):
+        """Mirrored obj_type named name (optionally inside datacenter), O(1)"""
+        return self.index.find(obj_type, name, datacenter)
+
+    def properties(self, obj):
+        """Snapshot of the mirrored properties of one object"""
+        with self._lock:
+            return dict(self._objects.get(obj, {}))
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_mirror(vcenter_host, vcenter_user, vcenter_pass):
+    """
+    Running, fully loaded mirror for (host, user), starting it on first use.
+
+    Returns None when the mirror is disabled or not ready within
+    INVENTORY_MIRROR_READY_TIMEOUT; callers then query vCenter directly.
+    Like VCenterSessionPool, a mirror is only handed to callers presenting
+    the password it was started with; others query vCenter directly, which
+    checks their password. A mirror that is not loaded (e.g. its password
+    was changed) is replaced by one started with the caller's password.
+    """
+    if not config["INVENTORY_MIRROR_ENABLED"]:
+        return None
+    key = (vcenter_host, vcenter_user)
+    digest = _digest(vcenter_pass)
+    started = False
+    stale = None
+    with _mirrors_lock:
+        mirror = _mirrors.get(key)
+        if mirror is not None and not hmac.compare_digest(mirror.pwd_digest, digest):
+            if mirror.is_alive() and mirror.ready.is_set():
+                return None
+            stale, mirror = mirror, None
+        if mirror is None or not mirror.is_alive():
+            started = True
+            mirror = InventoryMirror(
+                vcenter_host,
+                vcenter_user,
+                vcenter_pass,
+                wait_seconds=config["INVENTORY_MIRROR_WAIT_SECONDS"],
+            )
+            _mirrors[key] = mirror
+            mirror.start()
+    if stale is not None:
+        stale.stop(timeout=0)
+    # Only the caller that started the mirror waits for the full load; while a
+    # mirror is reloading everyone else falls back to direct queries at once
+    timeout = config["INVENTORY_MIRROR_READY_TIMEOUT"] if started else 0
+    if mirror.ready.wait(timeout):
+        return mirror
+    return None
+
+
+def stop_mirrors():
+    with _mirrors_lock:
+        mirrors = list(_mirrors.values())
+        _mirrors.clear()
+    for mirror in mirrors:
+        mirror.stop()
+
+
+atexit.register(stop_mirrors)
@@ -0,0 +1,221 @@
+import ipaddress
+
+# Prefix length assumed when a starting address has none and no IP pool mask is known
+DEFAULT_PREFIX = {4: 24, 6: 64}
+
+
+class AllocationError(ValueError):
+    """Raised for an invalid NIC range or one without enough free addresses"""
+
+
+def prefix_length(netmask):
+    """Prefix length of a dotted IPv4 netmask, None when there is none"""
+    if not netmask:
+        return None
+    try:
+        return ipaddress.ip_network(f"0.0.0.0/{netmask}").prefixlen
+    except ValueError:
+        return None
+
+
+def normalize(address):
+    """Canonical text of an address (drops a /prefix), as guest_ip_owners keys it"""
+    try:
+        return str(ipaddress.ip_address(str(address).split("/")[0].strip()))
+    except ValueError:
+        return address
+
+
+def conflicts(addresses, taken):
+    """(address, owner) for each of addresses some other VM already uses"""
+    found = []
+    for address in addresses:
+        if address:
+            owner = taken.get(normalize(address))
+            if owner is not None:
+                found.append((address, owner))
+    return found
+
+
+def describe_conflicts(found, limit=5):
+    text = ", ".join(f"{address} (used by {owner})" for address, owner in found[:limit])
+    if len(found) > limit:
+        text += f" and {len(found) - limit} more"
+    return text
+
+
+def _merge(ranges):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def parse_ranges(text, version=None):
+    """
+    Exclusions like "10.0.0.1-10.0.0.9, 10.0.0.20, 10.0.0.64/28" as sorted,
+    merged (first, last) integer ranges
+    """
+    ranges = []
+    for part in (text or "").replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "/" in part:
+                net = ipaddress.ip_network(part, strict=False)
+                first, last = net.network_address, net.broadcast_address
+            elif "-" in part:
+                low, high = part.split("-", 1)
+                first, last = ipaddress.ip_address(low.strip()), ipaddress.ip_address(high.strip())
+            else:
+                first = last = ipaddress.ip_address(part)
+        except ValueError:
+            raise AllocationError(f"Invalid exclusion '{part}'")
+        if first.version != last.version or (version and first.version != version):
+            raise AllocationError(f"Exclusion '{part}' is not an IPv{version or first.version} range")
+        ranges.append((min(int(first), int(last)), max(int(first), int(last))))
+    return _merge(ranges)
+
+
+class NicRange:
+    """
+    Addresses one NIC hands out: from the start address to the end of its
+    subnet, skipping the network address, the IPv4 broadcast address, the
+    gateway and any excluded ranges.
+
+    start is "10.0.0.10" or "10.0.0.10/24" (IPv6 alike); without a prefix
+    length, prefix (e.g. the IP pool's mask) applies when the start is an
+    IPv{prefix_version} address, otherwise DEFAULT_PREFIX.
+    """
+
+    def __init__(self, start, prefix=None, exclude=None, gateway=None, prefix_version=4):
+        start = str(start).strip()
+        try:
+            if "/" not in start:
+                version = ipaddress.ip_address(start).version
+                if not prefix or version != prefix_version:
+                    prefix = DEFAULT_PREFIX[version]
+                start = f"{start}/{prefix}"
+            interface = ipaddress.ip_interface(start)
+        except ValueError as e:
+            raise AllocationError(f"Invalid starting address '{start}': {e}")
+        self.network = interface.network
+        self.start = interface.ip
+        self._address = type(self.start)
+
+        version = self.network.version
+        reserved = []
+        # Point-to-point links (/31, /127) and single hosts use every address
+        if self.network.prefixlen < self.network.max_prefixlen - 1:
+            reserved.append((int(self.network.network_address),) * 2)
+            if version == 4:
+                reserved.append((int(self.network.broadcast_address),) * 2)
+        if gateway:
+            try:
+                gateway = ipaddress.ip_address(gateway)
+            except ValueError:
+                raise AllocationError(f"Invalid gateway '{gateway}'")
+            if gateway.version == version:
+                reserved.append((int(gateway),) * 2)
+        self._skip = _merge(reserved + parse_ranges(exclude, version))
+
+    def take(self, count, taken=None, reallocate=True):
+        """
+        The next count free addresses as strings, walking the range once.
+
+        taken maps addresses already in use to their owner; with reallocate
+        those are passed over, otherwise they are handed out and listed in
+        self.conflicts like the passed-over ones.
+        """
+        self.conflicts = []
+        taken = taken or {}
+        out = []
+        current = int(self.start)
+        last = int(self.network.broadcast_address)
+        skip = [r for r in self._skip if r[1] >= current]
+        i = 0
+        while len(out) < count:
+            if i < len(skip) and skip[i][0] <= current:
+                current = skip[i][1] + 1
+                i += 1
+                continue
+            if current > last:
+                raise AllocationError(
+                    f"{self.network} has {len(out)} free address(es) from {self.start}, {count} needed"
+                )
+            address = str(self._address(current))
+            current += 1
+            owner = taken.get(address)
+            if owner is not None:
+                self.conflicts.append((address, owner))
+                if reallocate:
+                    continue
+            out.append(address)
+        return out
+
+    @staticmethod
+    def describe(network, addresses):
+        return f"{addresses[0]} – {addresses[-1]} in {network} ({len(addresses)} addresses)"
+
+
+class IpPlan:
+    """
+    Per-VM view of a batch's IPs kept as one address column per NIC;
+    plan[i] builds VM i's list (None for DHCP NICs) only when asked
+    """
+
+    __slots__ = ("columns", "count")
+
+    def __init__(self, columns, count):
+        self.columns = columns  # per NIC: addresses, or None for DHCP
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return [column[i] if column is not None else None for column in self.columns]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+def plan_ips(count, starts, exclusions=None, prefixes=None, gateways=None, taken=None, reallocate=True):
+    """
+    IPs for a whole bulk batch, computed up front.
+
+    starts holds every NIC's starting address (None: DHCP); exclusions,
+    prefixes and gateways are optional lists in the same NIC order. The
+    prefixes come from IP pool masks and so only apply to IPv4 starts. Addresses
+    in taken ({address: owner}, see inventory.guest_ip_owners) are skipped,
+    or with reallocate=False make the plan fail.
+    Returns (IpPlan, {nic index: (network, addresses, conflicts)} for the
+    NICs that were allocated).
+    """
+    columns, allocated = [], {}
+    for nic, start in enumerate(starts):
+        if not start:
+            columns.append(None)
+            continue
+        option = lambda values: values[nic] if values and nic < len(values) else None
+        nic_range = NicRange(
+            start, prefix=option(prefixes), exclude=option(exclusions), gateway=option(gateways)
+        )
+        try:
+            addresses = nic_range.take(count, taken, reallocate)
+        except AllocationError as e:
+            raise AllocationError(f"NIC {nic + 1}: {e}")
+        if nic_range.conflicts and not reallocate:
+            raise AllocationError(
+                f"NIC {nic + 1}: addresses already in use: {describe_conflicts(nic_range.conflicts)}"
+            )
+        columns.append(addresses)
+        allocated[nic] = (nic_range.network, addresses, nic_range.conflicts)
+    return IpPlan(columns, count), allocated
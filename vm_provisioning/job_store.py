@@ -0,0 +1,300 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT,
+    description TEXT,
+    params TEXT,
+    state TEXT,
+    message TEXT,
+    error TEXT,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    vcenter_host TEXT,
+    template TEXT,
+    clone_mode TEXT,
+    demo INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_owner_created ON jobs (owner, created_at);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+
+CREATE TABLE IF NOT EXISTS vms (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    idx INTEGER,
+    hostname TEXT,
+    ips TEXT,
+    task TEXT,
+    status TEXT,
+    progress INTEGER,
+    error TEXT,
+    submitted_at REAL,
+    completed_at REAL,
+    duration REAL,
+    ready_seconds REAL,
+    PRIMARY KEY (job_id, name)
+);
+CREATE INDEX IF NOT EXISTS vms_job ON vms (job_id, idx);
+CREATE INDEX IF NOT EXISTS vms_name ON vms (name);
+CREATE INDEX IF NOT EXISTS vms_job_status ON vms (job_id, status, completed_at);
+"""
+
+# Indexes on added columns, created once older databases have them
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_template ON jobs (vcenter_host, template, clone_mode);
+"""
+
+JOB_COLUMNS = [
+    "id",
+    "owner",
+    "description",
+    "params",
+    "state",
+    "message",
+    "error",
+    "created_at",
+    "started_at",
+    "finished_at",
+]
+
+# Job params also kept in columns of their own so clone_durations can use an index
+PARAM_COLUMNS = ["vcenter_host", "template", "clone_mode", "demo"]
+
+VM_COLUMNS = [
+    "idx",
+    "hostname",
+    "ips",
+    "task",
+    "status",
+    "progress",
+    "error",
+    "submitted_at",
+    "completed_at",
+    "duration",
+    "ready_seconds",
+]
+
+# Job columns added after the first release: (name, type), added to older
+# databases and filled from the params of the jobs already there
+ADDED_JOB_COLUMNS = [
+    ("vcenter_host", "TEXT"),
+    ("template", "TEXT"),
+    ("clone_mode", "TEXT DEFAULT 'full'"),
+    ("demo", "INTEGER DEFAULT 0"),
+]
+
+# VM columns added after the first release: (name, type), added to older databases
+ADDED_VM_COLUMNS = [("ready_seconds", "REAL")]
+
+
+class JobStore:
+    """
+    SQLite (WAL mode) persistence for jobs and their per-VM rows.
+
+    Writes are queued and applied by one writer thread in batches: updates
+    arriving within flush_interval of each other share one transaction and
+    repeated updates of the same row are merged first. Reads use a
+    connection per thread and never wait for the writer.
+    """
+
+    def __init__(self, path, flush_interval=0.5, batch_size=500, logger=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, int(batch_size))
+        self.log = logger or logging.getLogger(__name__)
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self.stats = {"batches": 0, "job_writes": 0, "vm_writes": 0, "errors": 0}
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in ADDED_JOB_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                conn.execute(
+                    f"UPDATE jobs SET {column} = IFNULL(json_extract(params, '$.{column}'), {column})"
+                )
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(vms)")}
+        for column, kind in ADDED_VM_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE vms ADD COLUMN {column} {kind}")
+        conn.executescript(INDEXES)
+        # Jobs that were running when the process stopped will never finish
+        conn.execute(
+            "UPDATE jobs SET state = 'failed', error = 'Interrupted by application restart', "
+            "finished_at = ? WHERE state IN ('queued', 'running')",
+            (time.time(),),
+        )
+        conn.commit()
+        conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name="job-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # ---- writes (queued) -------------------------------------------------
+    def save_job(self, record):
+        """Queue an upsert of a job record (dict with JOB_COLUMNS keys)"""
+        self._queue.put(("job", record["id"], dict(record)))
+
+    def save_vm(self, job_id, name, fields):
+        """Queue an upsert of the given fields of one VM row"""
+        fields = {k: v for k, v in fields.items() if k in VM_COLUMNS}
+        self._queue.put(("vm", (job_id, name), fields))
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far is written"""
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            if batch[0][0] != "flush":
+                # Let closely spaced updates share one transaction
+                time.sleep(self.flush_interval)
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply(conn, batch)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.log.error(f"Job store write of {len(batch)} update(s) failed: {e}")
+                conn.rollback()
+            for kind, _key, payload in batch:
+                if kind == "flush":
+                    payload.set()
+
+    def _apply(self, conn, batch):
+        jobs = {}
+        vms = {}
+        for kind, key, payload in batch:
+            if kind == "job":
+                jobs[key] = payload
+            elif kind == "vm":
+                vms.setdefault(key, {}).update(payload)
+        with conn:
+            columns = JOB_COLUMNS + PARAM_COLUMNS
+            for record in jobs.values():
+                params = record.get("params") or {}
+                row = [record.get(col) for col in JOB_COLUMNS]
+                row[JOB_COLUMNS.index("params")] = json.dumps(params)
+                row += [
+                    params.get("vcenter_host"),
+                    params.get("template"),
+                    params.get("clone_mode") or "full",
+                    int(bool(params.get("demo"))),
+                ]
+                conn.execute(
+                    f"INSERT OR REPLACE INTO jobs ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' for _ in columns)})",
+                    row,
+                )
+            for (job_id, name), fields in vms.items():
+                cols = list(fields)
+                updates = ", ".join(f"{col} = excluded.{col}" for col in cols) or "name = name"
+                conn.execute(
+                    f"INSERT INTO vms (job_id, name{''.join(', ' + c for c in cols)}) "
+                    f"VALUES (?, ?{', ?' * len(cols)}) "
+                    f"ON CONFLICT (job_id, name) DO UPDATE SET {updates}",
+                    [job_id, name] + [fields[c] for c in cols],
+                )
+        self.stats["batches"] += 1
+        self.stats["job_writes"] += len(jobs)
+        self.stats["vm_writes"] += len(vms)
+
+    # ---- reads -----------------------------------------------------------
+    def _job_dict(self, row, include_vms=True):
+        data = dict(row)
+        data["params"] = json.loads(data["params"] or "{}")
+        now = time.time()
+        data["queued_seconds"] = (data["started_at"] or now) - data["created_at"]
+        data["run_seconds"] = (
+            (data["finished_at"] or now) - data["started_at"] if data["started_at"] else None
+        )
+        counts = self._reader().execute(
+            "SELECT status, COUNT(*) FROM vms WHERE job_id = ? AND status IS NOT NULL GROUP BY status",
+            (data["id"],),
+        )
+        data["counts"] = {status: n for status, n in counts}
+        if include_vms:
+            data["vms"] = self.job_vms(data["id"])
+        return data
+
+    def get_job(self, job_id, include_vms=True):
+        row = self._reader().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job_dict(row, include_vms) if row else None
+
+    def job_vms(self, job_id):
+        rows = self._reader().execute(
+            "SELECT * FROM vms WHERE job_id = ? ORDER BY idx, name", (job_id,)
+        )
+        return [{k: v for k, v in dict(row).items() if k != "job_id"} for row in rows]
+
+    def list_jobs(self, owner=None, limit=50, offset=0):
+        """Newest first, optionally only those of one owner"""
+        if owner is None:
+            rows = self._reader().execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ? OFFSET ?", (limit, offset)
+            )
+        else:
+            rows = self._reader().execute(
+                "SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (owner, limit, offset),
+            )
+        return [self._job_dict(row, include_vms=False) for row in rows.fetchall()]
+
+    def latest_finished_job(self, owner):
+        row = self._reader().execute(
+            "SELECT * FROM jobs WHERE owner = ? AND state IN ('succeeded', 'failed') "
+            "ORDER BY finished_at DESC LIMIT 1",
+            (owner,),
+        ).fetchone()
+        return self._job_dict(row) if row else None
+
+    def clone_durations(self, vcenter_host, template, clone_mode="full", limit=200):
+        """Durations (seconds) of the latest successful real clones of a template"""
+        rows = self._reader().execute(
+            "SELECT vms.duration FROM jobs JOIN vms ON vms.job_id = jobs.id "
+            "WHERE jobs.vcenter_host = ? AND jobs.template = ? AND jobs.clone_mode = ? "
+            "AND jobs.demo = 0 AND vms.status = 'success' AND vms.duration IS NOT NULL "
+            "ORDER BY vms.completed_at DESC LIMIT ?",
+            (vcenter_host, template, clone_mode, limit),
+        )
+        return [duration for (duration,) in rows]
+
+    def find_vm(self, name, owner=None, limit=20):
+        """Most recent rows for a VM name across all jobs, optionally only those of one owner"""
+        query = (
+            "SELECT vms.*, jobs.owner, jobs.created_at AS job_created_at FROM vms "
+            "JOIN jobs ON jobs.id = vms.job_id WHERE vms.name = ? "
+        )
+        params = [name]
+        if owner is not None:
+            query += "AND jobs.owner = ? "
+            params.append(owner)
+        rows = self._reader().execute(query + "ORDER BY jobs.created_at DESC LIMIT ?", (*params, limit))
+        return [dict(row) for row in rows]
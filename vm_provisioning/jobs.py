@@ -0,0 +1,289 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+FINISHED = (SUCCEEDED, FAILED)
+
+# Row fields copied into vm.state events when they change
+VM_EVENT_FIELDS = ("hostname", "ips", "error", "duration", "ready_seconds")
+
+
+class Job:
+    """
+    One provisioning batch: its state, timings and per-VM results.
+
+    With an emit(event, data) callback every VM update is also published as
+    a "vm.state" event and followed by a "job.progress" event, so clients
+    can follow the batch without parsing log lines. A VM whose guest came up
+    (ready_seconds is set) is also announced with a "vm.ready" event.
+    """
+
+    def __init__(self, job_id, owner, description, params=None, store=None, emit=None):
+        self.id = job_id
+        self.owner = owner
+        self.description = description
+        self.params = dict(params or {})
+        self.state = QUEUED
+        self.message = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._vms = OrderedDict()  # VM name -> result fields
+        self._store = store
+        self._emit = emit
+        self._counts = {}  # VM status -> number of VMs in it
+        self._progress_total = 0  # sum of the per-VM progress percentages
+        self._expected = 0  # VMs in the batch, reported or not
+
+    @property
+    def finished(self):
+        return self.state in FINISHED
+
+    def record(self):
+        """Job columns as persisted by JobStore"""
+        return {
+            "id": self.id,
+            "owner": self.owner,
+            "description": self.description,
+            "params": self.params,
+            "state": self.state,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def expect(self, total):
+        """Batch size, so progress counts VMs the batch has not reported yet"""
+        with self._lock:
+            self._expected = total
+
+    def save(self):
+        if self._store is not None:
+            self._store.save_job(self.record())
+
+    def update_vm(self, name, **fields):
+        """Merge fields into the result row of one VM; unchanged fields are ignored"""
+        with self._lock:
+            row = self._vms.get(name)
+            if row is None:
+                row = self._vms[name] = {"name": name, "idx": len(self._vms)}
+                fields = dict(fields, idx=row["idx"])
+            else:
+                fields = {key: value for key, value in fields.items() if row.get(key) != value}
+                if not fields:
+                    return
+            status, progress = row.get("status"), row.get("progress") or 0
+            row.update(fields)
+            if row.get("status") != status:
+                if status is not None:
+                    self._counts[status] -= 1
+                self._counts[row.get("status")] = self._counts.get(row.get("status"), 0) + 1
+            self._progress_total += (row.get("progress") or 0) - progress
+            event = self._vm_event(row, fields) if self._emit is not None else None
+            progress_event = self._progress_event() if event is not None else None
+            ready_event = (
+                self._ready_event(row)
+                if event is not None and fields.get("ready_seconds") is not None
+                else None
+            )
+        if self._store is not None:
+            self._store.save_vm(self.id, name, fields)
+        if event is not None:
+            self._emit("vm.state", event)
+            if ready_event is not None:
+                self._emit("vm.ready", ready_event)
+            self._emit("job.progress", progress_event)
+
+    def _vm_event(self, row, fields):
+        """Compact vm.state payload for an update (caller holds the lock)"""
+        event = {
+            "i": row["idx"],
+            "vm": row["name"],
+            "state": row.get("status"),
+            "pct": row.get("progress") or 0,
+            "ts": round(time.time(), 3),
+        }
+        event.update((key, fields[key]) for key in VM_EVENT_FIELDS if fields.get(key) is not None)
+        for key in ("duration", "ready_seconds"):
+            if key in event:
+                event[key] = round(event[key], 1)
+        return event
+
+    def _ready_event(self, row):
+        """vm.ready payload: time from clone completion to a running guest (caller holds the lock)"""
+        return {
+            "i": row["idx"],
+            "vm": row["name"],
+            "hostname": row.get("hostname"),
+            "ips": row.get("ips"),
+            "ready_seconds": round(row["ready_seconds"], 1),
+            "ts": round(time.time(), 3),
+        }
+
+    def _progress_event(self):
+        """Compact job.progress payload (caller holds the lock)"""
+        total = max(self._expected, len(self._vms))
+        return {
+            "state": self.state,
+            "total": total,
+            "done": self._counts.get("success", 0),
+            "failed": self._counts.get("failed", 0),
+            "pct": round(self._progress_total / total) if total else 0,
+            "ts": round(time.time(), 3),
+        }
+
+    def snapshot(self):
+        """Current vm.state payload of every VM plus job.progress, for resyncing a client"""
+        with self._lock:
+            return {
+                "vms": [self._vm_event(row, row) for row in self._vms.values()],
+                "progress": self._progress_event(),
+            }
+
+    def emit_progress(self):
+        """Publish a job.progress event, e.g. after a job state change"""
+        if self._emit is not None:
+            with self._lock:
+                event = self._progress_event()
+            self._emit("job.progress", event)
+
+    def set_vms(self, vms):
+        """Merge a final list of per-VM result dicts keyed by 'name'"""
+        for vm in vms:
+            fields = dict(vm)
+            self.update_vm(fields.pop("name", None), **fields)
+
+    @property
+    def vms(self):
+        with self._lock:
+            return [dict(row) for row in self._vms.values()]
+
+    def to_dict(self, include_vms=True):
+        now = time.time()
+        data = {
+            "id": self.id,
+            "owner": self.owner,
+            "description": self.description,
+            "params": self.params,
+            "state": self.state,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": ((self.started_at or now) - self.created_at),
+            "run_seconds": (
+                (self.finished_at or now) - self.started_at if self.started_at else None
+            ),
+        }
+        with self._lock:
+            data["counts"] = dict(
+                sorted((status, n) for status, n in self._counts.items() if status and n)
+            )
+        if include_vms:
+            data["vms"] = self.vms
+        return data
+
+
+class JobManager:
+    """
+    Runs provisioning jobs on a bounded worker pool.
+
+    submit() (or create() followed by start()) registers a job and returns at
+    once; target(job) runs on a worker and may return a message string or a
+    dict with 'message' and 'vms'. Only
+    the newest `history` finished jobs are kept in memory; with a JobStore
+    every job and per-VM update is also persisted there.
+    """
+
+    def __init__(self, workers=4, history=200, store=None, logger=None):
+        self.workers = max(1, int(workers))
+        self.history = max(1, int(history))
+        self.store = store
+        self.log = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job id -> Job, oldest first
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="provision-job"
+        )
+
+    def create(self, owner, description, params=None, emitter=None):
+        """
+        Register a queued job without starting it; emitter(job_id), when
+        given, returns the emit(event, data) callback of the new job
+        """
+        job_id = uuid.uuid4().hex
+        emit = emitter(job_id) if emitter is not None else None
+        job = Job(job_id, owner, description, params, store=self.store, emit=emit)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.save()
+        return job
+
+    def start(self, job, target, on_finish=None):
+        """Queue target(job); on_finish(job) runs after it succeeded or failed"""
+        self._executor.submit(self._run, job, target, on_finish)
+        return job
+
+    def submit(self, owner, description, target, params=None, on_finish=None):
+        return self.start(self.create(owner, description, params), target, on_finish)
+
+    def _run(self, job, target, on_finish):
+        job.state = RUNNING
+        job.started_at = time.time()
+        job.save()
+        job.emit_progress()
+        try:
+            result = target(job)
+            if isinstance(result, dict):
+                job.message = result.get("message")
+                if result.get("vms") is not None:
+                    job.set_vms(result["vms"])
+            else:
+                job.message = result
+            job.state = SUCCEEDED
+        except Exception as e:
+            job.error = str(e)
+            job.state = FAILED
+            self.log.error(f"Job {job.id} ({job.description}) failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            job.save()
+            job.emit_progress()
+        if on_finish is not None:
+            try:
+                on_finish(job)
+            except Exception as e:
+                self.log.error(f"Job {job.id} completion hook failed: {e}")
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond history (caller holds the lock)"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, owner=None):
+        """Jobs, newest first, optionally only those of one owner"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in reversed(jobs) if owner is None or job.owner == owner]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
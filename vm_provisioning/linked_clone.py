@@ -0,0 +1,154 @@
+import threading
+
+from pyVmomi import vim
+
+from config import config
+from inventory import retrieve_object_properties, retrieve_properties
+from task_tracker import wait_for_task
+
+# Custom attribute set on a template while ensure_snapshot has it turned into a VM
+CONVERTING_FIELD = "vm-provisioning-snapshot-in-progress"
+
+_locks = {}  # (vCenter host, VM moId) -> Lock
+_locks_guard = threading.Lock()
+_recovered = set()  # vCenter hosts checked for half-converted templates
+
+
+def _lock_for(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def find_snapshot(snapshot_trees, name):
+    """Snapshot managed object called name anywhere in a snapshot tree, or None"""
+    for tree in snapshot_trees or []:
+        if tree.name == name:
+            return tree.snapshot
+        found = find_snapshot(tree.childSnapshotList, name)
+        if found is not None:
+            return found
+    return None
+
+
+def lookup_snapshot(content, vm, name=None):
+    """(linked-clone snapshot of vm or None, vm's name/snapshot/config.template properties)"""
+    name = name or config["LINKED_CLONE_SNAPSHOT"]
+    rows = retrieve_object_properties(content, [vm], ["name", "snapshot", "config.template"])
+    props = rows[0] if rows else {}
+    info = props.get("snapshot")
+    return find_snapshot(info.rootSnapshotList if info else None, name), props
+
+
+def converting_field(content, create=False):
+    """Definition of CONVERTING_FIELD, added when create is set; None if missing"""
+    manager = content.customFieldsManager
+    for field in manager.field or []:
+        if field.name == CONVERTING_FIELD and field.managedObjectType in (None, vim.VirtualMachine):
+            return field
+    if not create:
+        return None
+    return manager.AddFieldDefinition(name=CONVERTING_FIELD, moType=vim.VirtualMachine)
+
+
+def _set_converting(content, field, vm, on):
+    content.customFieldsManager.SetField(entity=vm, key=field.key, value="1" if on else "")
+
+
+def recover_templates(si, host, logger=print):
+    """
+    Mark templates as templates again that an interrupted ensure_snapshot
+    left as VMs, found by CONVERTING_FIELD. Runs once per vCenter, before
+    the first snapshot this process takes there.
+    """
+    with _locks_guard:
+        if host in _recovered:
+            return
+        _recovered.add(host)
+    content = si.RetrieveContent()
+    field = converting_field(content)
+    if field is None:
+        return
+    rows = retrieve_properties(content, vim.VirtualMachine, ["name", "customValue"])
+    for row in rows:
+        if not any(value.key == field.key and value.value for value in row.get("customValue") or []):
+            continue
+        vm = row["obj"]
+        with _lock_for((host, vm._moId)):
+            try:
+                props = retrieve_object_properties(content, [vm], ["config.template"])
+                if props and not props[0].get("config.template"):
+                    vm.MarkAsTemplate()
+                    logger(f"🩹 Marked {row.get('name')} as a template again after an interrupted snapshot")
+                _set_converting(content, field, vm, False)
+            except Exception as e:
+                logger(f"⚠️ Could not restore template {row.get('name')}: {e}")
+                with _locks_guard:
+                    _recovered.discard(host)
+
+
+def ensure_snapshot(si, host, vm, pool, name=None, logger=print):
+    """
+    Snapshot that linked clones of vm are based on, created on first use.
+
+    Templates cannot be snapshotted, so a template is turned into a VM in
+    pool for the snapshot and marked as a template again afterwards, even
+    when the snapshot fails. The template carries CONVERTING_FIELD while it
+    is a VM, so recover_templates() can restore it if the process dies
+    meanwhile. Linked clones keep reading the template's disks through the
+    snapshot; delete it after updating the template so the next batch takes
+    a fresh one.
+    """
+    name = name or config["LINKED_CLONE_SNAPSHOT"]
+    content = si.RetrieveContent()
+    recover_templates(si, host, logger)
+    # Concurrent batches from the same template must not both create it
+    with _lock_for((host, vm._moId)):
+        snapshot, props = lookup_snapshot(content, vm, name)
+        if snapshot is not None:
+            logger(f"🔗 Using snapshot '{name}' of {props.get('name')} for linked clones")
+            return snapshot
+
+        is_template = bool(props.get("config.template"))
+        logger(f"📸 Creating snapshot '{name}' on {props.get('name')} for linked clones")
+        field = None
+        if is_template:
+            try:
+                field = converting_field(content, create=True)
+                _set_converting(content, field, vm, True)
+            except Exception as e:
+                # Without the marker an interrupted run cannot be recovered automatically
+                field = None
+                logger(f"⚠️ Could not flag {props.get('name')} while it is converted: {e}")
+            try:
+                vm.MarkAsVirtualMachine(pool=pool)
+            except Exception:
+                if field is not None:
+                    _set_converting(content, field, vm, False)
+                raise
+        try:
+            task = vm.CreateSnapshot_Task(
+                name=name,
+                description="Base of linked clones created by VM provisioning",
+                memory=False,
+                quiesce=False,
+            )
+            result = wait_for_task(si, task, name)
+        finally:
+            if is_template:
+                try:
+                    vm.MarkAsTemplate()
+                except Exception as e:
+                    # The marker stays, so the next recover_templates() retries
+                    logger(f"⚠️ Could not mark {props.get('name')} as a template again: {e}")
+                    with _locks_guard:
+                        _recovered.discard(host)
+                    raise
+                if field is not None:
+                    try:
+                        _set_converting(content, field, vm, False)
+                    except Exception as e:
+                        # Harmless: recover_templates() finds a template and clears it
+                        logger(f"⚠️ Could not clear the conversion flag of {props.get('name')}: {e}")
+        if not result.succeeded:
+            raise Exception(f"Could not snapshot {props.get('name')}: {result.error_message}")
+        return result.result
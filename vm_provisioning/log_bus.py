@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class Channel:
+    """
+    Bounded event history of one job plus the condition its readers wait on.
+
+    Every entry is an (event name, data) pair: "log" entries carry a text
+    line, the others a dict. Entries get increasing sequence numbers. The
+    ring buffer keeps the newest `capacity` entries; publishers never block,
+    and a reader that falls more than `capacity` entries behind skips ahead
+    and has the gap counted as dropped.
+    """
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self._buffer = deque(maxlen=max(1, int(capacity)))  # (seq, event, data)
+        self._cond = threading.Condition()
+        self.last_seq = 0
+        self.closed = False
+        self.closed_at = None
+        self.created_at = time.time()
+        self.stats = {"published": 0, "evicted": 0, "subscribers": 0, "resumed": 0, "dropped": 0}
+
+    def publish(self, data, event="log"):
+        with self._cond:
+            if self.closed:
+                return None
+            if len(self._buffer) == self._buffer.maxlen:
+                self.stats["evicted"] += 1
+            self.last_seq += 1
+            self._buffer.append((self.last_seq, event, data))
+            self.stats["published"] += 1
+            self._cond.notify_all()
+            return self.last_seq
+
+    def close(self):
+        with self._cond:
+            if not self.closed:
+                self.closed = True
+                self.closed_at = time.time()
+            self._cond.notify_all()
+
+    def read(self, after_seq, timeout=None):
+        """
+        Entries with seq > after_seq, waiting up to timeout for the first one.
+
+        Returns (entries, dropped): entries are (seq, event, data) tuples and
+        dropped counts entries after after_seq that were already evicted from
+        the ring buffer.
+        """
+        with self._cond:
+            if self.last_seq <= after_seq and not self.closed:
+                self._cond.wait(timeout)
+            messages = [entry for entry in self._buffer if entry[0] > after_seq]
+            first = messages[0][0] if messages else self.last_seq + 1
+            dropped = max(0, first - after_seq - 1)
+            if dropped:
+                self.stats["dropped"] += dropped
+            return messages, dropped
+
+    def attach(self, delta=1, resumed=False):
+        with self._cond:
+            self.stats["subscribers"] += delta
+            if resumed:
+                self.stats["resumed"] += 1
+
+    def snapshot(self):
+        with self._cond:
+            return dict(
+                self.stats,
+                buffered=len(self._buffer),
+                capacity=self._buffer.maxlen,
+                last_seq=self.last_seq,
+                closed=self.closed,
+            )
+
+
+class Subscription:
+    """One reader's cursor into a Channel"""
+
+    def __init__(self, channel, after_seq=0):
+        self.channel = channel
+        self.cursor = after_seq
+        self.dropped = 0
+
+    def read(self, timeout=None):
+        messages, dropped = self.channel.read(self.cursor, timeout)
+        self.dropped += dropped
+        if messages:
+            self.cursor = messages[-1][0]
+        return messages
+
+    @property
+    def finished(self):
+        """Channel closed and everything in it has been read"""
+        return self.channel.closed and self.cursor >= self.channel.last_seq
+
+    def close(self):
+        self.channel.attach(-1)
+
+
+class LogBus:
+    """
+    Per-job event channels with any number of subscribers each.
+
+    Memory is bounded per channel by `capacity`; closed channels are kept for
+    `retention` seconds so late readers can still replay them, and at most
+    `max_channels` channels exist (oldest closed ones are evicted first).
+    """
+
+    def __init__(self, capacity=2000, max_channels=200, retention=3600):
+        self.capacity = capacity
+        self.max_channels = max(1, int(max_channels))
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._channels = OrderedDict()  # name -> Channel, oldest first
+
+    def channel(self, name, create=False):
+        with self._lock:
+            channel = self._channels.get(name)
+            if channel is None and create:
+                self._prune()
+                channel = self._channels[name] = Channel(name, self.capacity)
+            return channel
+
+    def _prune(self):
+        """Drop expired closed channels and keep under max_channels (caller holds the lock)"""
+        now = time.time()
+        for name, channel in list(self._channels.items()):
+            if channel.closed and now - channel.closed_at > self.retention:
+                del self._channels[name]
+        closed = [name for name, channel in self._channels.items() if channel.closed]
+        while len(self._channels) >= self.max_channels and closed:
+            del self._channels[closed.pop(0)]
+
+    def publish(self, name, data, event="log"):
+        return self.channel(name, create=True).publish(data, event)
+
+    def logger(self, name):
+        """A logger(message) callable that publishes log lines to channel name"""
+        channel = self.channel(name, create=True)
+        return channel.publish
+
+    def emitter(self, name):
+        """An emit(event, data) callable that publishes typed events to channel name"""
+        channel = self.channel(name, create=True)
+        return lambda event, data: channel.publish(data, event)
+
+    def close(self, name):
+        channel = self.channel(name)
+        if channel is not None:
+            channel.close()
+
+    def subscribe(self, name, after_seq=0):
+        """
+        Subscription replaying channel name from after_seq, or None if unknown.
+
+        A reconnecting client passes the last sequence number it saw and only
+        receives what came after it.
+        """
+        channel = self.channel(name)
+        if channel is None:
+            return None
+        after_seq = min(max(0, int(after_seq)), channel.last_seq)
+        channel.attach(resumed=after_seq > 0)
+        return Subscription(channel, after_seq)
+
+    def snapshot(self, name=None):
+        if name is not None:
+            channel = self.channel(name)
+            return channel.snapshot() if channel else None
+        with self._lock:
+            channels = list(self._channels.values())
+        return {
+            "channels": len(channels),
+            "open": sum(1 for c in channels if not c.closed),
+            "buffered": sum(c.snapshot()["buffered"] for c in channels),
+            "dropped": sum(c.stats["dropped"] for c in channels),
+            "evicted": sum(c.stats["evicted"] for c in channels),
+        }
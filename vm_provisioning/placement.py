@@ -0,0 +1,388 @@
+import random
+import threading
+
+from pyVmomi import vim
+
+from config import config
+from inventory import retrieve_object_properties
+
+DATASTORE_PROPERTIES = [
+    "name",
+    "summary.freeSpace",
+    "summary.capacity",
+    "summary.accessible",
+    "summary.maintenanceMode",
+]
+
+HOST_PROPERTIES = [
+    "name",
+    "datastore",
+    "runtime.connectionState",
+    "runtime.inMaintenanceMode",
+    "runtime.powerState",
+    "summary.hardware.cpuMhz",
+    "summary.hardware.numCpuCores",
+    "summary.hardware.memorySize",
+    "summary.quickStats.overallCpuUsage",
+    "summary.quickStats.overallMemoryUsage",
+]
+
+GB = 1024 ** 3
+MB = 1024 ** 2
+
+
+class PlacementError(Exception):
+    """Raised when no datastore can take another clone"""
+
+
+class SpaceLedger:
+    """
+    Process-wide bytes reserved by clones that are planned or in flight.
+
+    freeSpace reported by vCenter does not yet include clones that are still
+    running, so every batch subtracts what all batches have reserved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reserved = {}  # (vCenter host, datastore moId) -> bytes
+
+    def reserve(self, ds_key, size):
+        with self._lock:
+            self._reserved[ds_key] = self._reserved.get(ds_key, 0) + size
+
+    def release(self, ds_key, size):
+        with self._lock:
+            left = self._reserved.get(ds_key, 0) - size
+            if left > 0:
+                self._reserved[ds_key] = left
+            else:
+                self._reserved.pop(ds_key, None)
+
+    def reserved(self, ds_key):
+        with self._lock:
+            return self._reserved.get(ds_key, 0)
+
+    def copy(self):
+        """Independent ledger starting from the current reservations (for what-if planning)"""
+        other = SpaceLedger()
+        with self._lock:
+            other._reserved = dict(self._reserved)
+        return other
+
+
+ledger = SpaceLedger()
+
+
+class DatastoreCandidate:
+    """One cluster datastore as seen by the placer"""
+
+    def __init__(self, host, row):
+        self.obj = row["obj"]
+        self.key = (host, self.obj._moId)
+        self.name = row.get("name", self.obj._moId)
+        self.free = row.get("summary.freeSpace") or 0
+        self.capacity = row.get("summary.capacity") or 0
+        self.accessible = bool(row.get("summary.accessible"))
+        self.maintenance_mode = row.get("summary.maintenanceMode") or "normal"
+        self.planned = 0  # clones of this batch placed here
+        self.consumed = 0  # bytes written by clones of this batch that finished
+
+    def excluded(self):
+        """Reason this datastore must not be used, or None"""
+        if not self.accessible:
+            return "not accessible"
+        if self.maintenance_mode != "normal":
+            return f"maintenance mode {self.maintenance_mode}"
+        return None
+
+    def available(self, ledger):
+        return self.free - self.consumed - ledger.reserved(self.key)
+
+    def fits(self, size, ledger, min_free_percent):
+        return self.available(ledger) - size >= self.capacity * min_free_percent / 100
+
+
+def most_free(candidates, ledger):
+    return max(candidates, key=lambda c: c.available(ledger))
+
+
+def weighted(candidates, ledger):
+    """Random pick weighted by available space"""
+    weights = [max(c.available(ledger), 1) for c in candidates]
+    return random.choices(candidates, weights=weights)[0]
+
+
+class RoundRobin:
+    def __init__(self):
+        self._next = 0
+
+    def __call__(self, candidates, ledger):
+        choice = candidates[self._next % len(candidates)]
+        self._next += 1
+        return choice
+
+
+POLICIES = {
+    "most-free": lambda: most_free,
+    "round-robin": RoundRobin,
+    "weighted": lambda: weighted,
+}
+
+
+class DatastorePlacer:
+    """
+    Spreads the clones of one batch over the usable datastores of a cluster.
+
+    Each clone reserves the template's committed size on its datastore until
+    finish() is called; a datastore only takes another clone while it keeps
+    min_free_percent of its capacity free afterwards. The policy picks among
+    the datastores that fit: "most-free", "round-robin" or "weighted".
+    """
+
+    def __init__(self, candidates, clone_size, policy=None, min_free_percent=None, ledger=ledger):
+        policy = policy or config["PLACEMENT_POLICY"]
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown placement policy '{policy}' (use {', '.join(POLICIES)})")
+        self.policy_name = policy
+        self.policy = POLICIES[policy]()
+        self.candidates = list(candidates)
+        self.clone_size = clone_size or 0
+        self.min_free_percent = (
+            config["PLACEMENT_MIN_FREE_PERCENT"] if min_free_percent is None else min_free_percent
+        )
+        self.ledger = ledger
+        self._lock = threading.Lock()
+        self._placed = {}  # clone key -> DatastoreCandidate
+
+    @classmethod
+    def for_cluster(cls, content, host, cluster, template_vm, linked=False, **kwargs):
+        """
+        Fetch all cluster datastores and the template size in two bulk calls.
+        A linked clone only needs room for its swap file and delta disk.
+        """
+        rows = retrieve_object_properties(content, cluster.datastore, DATASTORE_PROPERTIES)
+        template = retrieve_object_properties(
+            content, [template_vm], ["summary.storage.committed", "config.hardware.memoryMB"]
+        )
+        template = template[0] if template else {}
+        if linked:
+            clone_size = (template.get("config.hardware.memoryMB") or 0) * MB + int(
+                config["LINKED_CLONE_DELTA_GB"] * GB
+            )
+        else:
+            clone_size = template.get("summary.storage.committed", 0)
+        return cls([DatastoreCandidate(host, row) for row in rows], clone_size, **kwargs)
+
+    @property
+    def usable(self):
+        return [c for c in self.candidates if c.excluded() is None]
+
+    def describe(self):
+        """Log lines summarising the datastores and why any are skipped"""
+        lines = [
+            f"💾 Placing clones of {self.clone_size / GB:.1f} GB each "
+            f"({self.policy_name}, keeping {self.min_free_percent:g}% free)"
+        ]
+        for c in sorted(self.candidates, key=lambda c: c.name):
+            reason = c.excluded()
+            state = f"skipped: {reason}" if reason else (
+                f"{c.available(self.ledger) / GB:.1f} GB available of {c.capacity / GB:.1f} GB"
+            )
+            lines.append(f"   • {c.name}: {state}")
+        return lines
+
+    def place(self, key):
+        """Reserve space for one clone; returns its DatastoreCandidate"""
+        with self._lock:
+            fitting = [
+                c for c in self.usable
+                if c.fits(self.clone_size, self.ledger, self.min_free_percent)
+            ]
+            if not fitting:
+                raise PlacementError(
+                    f"no datastore has {self.clone_size / GB:.1f} GB free "
+                    f"above the {self.min_free_percent:g}% reserve"
+                )
+            choice = self.policy(fitting, self.ledger)
+            self.ledger.reserve(choice.key, self.clone_size)
+            choice.planned += 1
+            self._placed[key] = choice
+            return choice
+
+    def finish(self, key, succeeded):
+        """Drop the reservation of a finished clone; a successful one keeps its space"""
+        with self._lock:
+            choice = self._placed.pop(key, None)
+            if choice is None:
+                return
+            self.ledger.release(choice.key, self.clone_size)
+            if succeeded:
+                choice.consumed += self.clone_size
+
+    def release_all(self):
+        """Give back reservations of clones that never finished"""
+        with self._lock:
+            placed, self._placed = self._placed, {}
+        for choice in placed.values():
+            self.ledger.release(choice.key, self.clone_size)
+
+    def room(self):
+        """How many more clones fit on the usable datastores"""
+        size = max(1, self.clone_size)
+        return sum(
+            max(0, int((c.available(self.ledger) - c.capacity * self.min_free_percent / 100) // size))
+            for c in self.usable
+        )
+
+    def spread(self):
+        """datastore name -> clones placed there"""
+        return {c.name: c.planned for c in self.candidates if c.planned}
+
+
+class HostCandidate:
+    """One cluster host with its current load and the clones planned onto it"""
+
+    def __init__(self, row):
+        self.obj = row["obj"]
+        self.name = row.get("name", self.obj._moId)
+        self.datastores = {ds._moId for ds in row.get("datastore") or []}
+        self.connection_state = row.get("runtime.connectionState")
+        self.maintenance = bool(row.get("runtime.inMaintenanceMode"))
+        self.power_state = row.get("runtime.powerState")
+        self.core_mhz = row.get("summary.hardware.cpuMhz") or 0
+        self.cpu_capacity = self.core_mhz * (row.get("summary.hardware.numCpuCores") or 0)
+        self.memory_capacity = row.get("summary.hardware.memorySize") or 0
+        self.cpu_used = row.get("summary.quickStats.overallCpuUsage") or 0  # MHz
+        self.memory_used = (row.get("summary.quickStats.overallMemoryUsage") or 0) * MB
+        self.planned = 0
+
+    def excluded(self):
+        """Reason this host must not receive clones, or None"""
+        if self.connection_state != "connected":
+            return f"connection {self.connection_state}"
+        if self.maintenance:
+            return "maintenance mode"
+        if self.power_state not in (None, "poweredOn"):
+            return f"power {self.power_state}"
+        return None
+
+    def load(self, vm_cpus, vm_memory):
+        """
+        Projected utilisation (0..1+) once the planned clones run; a booting
+        guest is counted as keeping all its vCPUs busy
+        """
+        vms = self.planned + 1
+        cpu = (self.cpu_used + vms * vm_cpus * self.core_mhz) / max(self.cpu_capacity, 1)
+        memory = (self.memory_used + vms * vm_memory) / max(self.memory_capacity, 1)
+        return max(cpu, memory)
+
+
+class HostPlacer:
+    """
+    Picks the ESXi host of every clone so a batch starts spread out.
+
+    With use_drs the cluster is asked first (ClusterComputeResource.PlaceVm);
+    when DRS has no recommendation the host with the lowest projected
+    CPU/memory load that mounts the clone's datastore is used, and after the
+    first PlaceVm fault (DRS disabled, unsupported) DRS is not asked again.
+    Host stats are fetched once per batch and every placement adds the
+    template's vCPUs and memory to its host.
+    """
+
+    def __init__(self, cluster, template_vm, candidates, vm_cpus, vm_memory, use_drs=True):
+        self.cluster = cluster
+        self.template_vm = template_vm
+        self.candidates = list(candidates)
+        self.vm_cpus = vm_cpus or 1
+        self.vm_memory = vm_memory or 0
+        self.use_drs = use_drs
+        self.drs_error = None
+        self._lock = threading.Lock()
+        self.stats = {"drs": 0, "scored": 0, "drs_errors": 0}
+
+    @classmethod
+    def for_cluster(cls, content, cluster, template_vm, **kwargs):
+        """Fetch all cluster hosts and the template's size in two bulk calls"""
+        rows = retrieve_object_properties(content, cluster.host, HOST_PROPERTIES)
+        template = retrieve_object_properties(
+            content, [template_vm], ["config.hardware.numCPU", "config.hardware.memoryMB"]
+        )
+        hardware = template[0] if template else {}
+        return cls(
+            cluster,
+            template_vm,
+            [HostCandidate(row) for row in rows],
+            hardware.get("config.hardware.numCPU"),
+            (hardware.get("config.hardware.memoryMB") or 0) * MB,
+            **kwargs,
+        )
+
+    @property
+    def usable(self):
+        return [h for h in self.candidates if h.excluded() is None]
+
+    def describe(self):
+        lines = [f"🖥️  Host placement ({'DRS, then ' if self.use_drs else ''}load scoring):"]
+        for h in sorted(self.candidates, key=lambda h: h.name):
+            reason = h.excluded()
+            state = f"skipped: {reason}" if reason else (
+                f"CPU {h.cpu_used / max(h.cpu_capacity, 1):.0%}, "
+                f"memory {h.memory_used / max(h.memory_capacity, 1):.0%}"
+            )
+            lines.append(f"   • {h.name}: {state}")
+        return lines
+
+    def place(self, name, clone_spec):
+        """
+        Set clone_spec.location.host for one clone; returns (host name, how)
+        or None when no host qualifies and the choice is left to vCenter
+        """
+        datastore = clone_spec.location.datastore
+        host = self._recommend(name, clone_spec) if self.use_drs else None
+        how = "DRS"
+        with self._lock:
+            if host is None:
+                how = "load"
+                fitting = [
+                    h for h in self.usable
+                    if datastore is None or datastore._moId in h.datastores
+                ]
+                if not fitting:
+                    return None
+                host = min(fitting, key=lambda h: h.load(self.vm_cpus, self.vm_memory))
+            host.planned += 1
+            self.stats["drs" if how == "DRS" else "scored"] += 1
+        clone_spec.location.host = host.obj
+        return host.name, how
+
+    def _recommend(self, name, clone_spec):
+        """HostCandidate DRS recommends for this clone, or None"""
+        try:
+            spec = vim.cluster.PlacementSpec(
+                placementType="clone",
+                vm=self.template_vm,
+                cloneName=name,
+                cloneSpec=clone_spec,
+                relocateSpec=clone_spec.location,
+            )
+            if clone_spec.location.datastore is not None:
+                spec.datastores = [clone_spec.location.datastore]
+            result = self.cluster.PlaceVm(spec)
+        except Exception as e:
+            with self._lock:
+                self.stats["drs_errors"] += 1
+                self.drs_error = str(e)
+                self.use_drs = False
+            return None
+        by_id = {h.obj._moId: h for h in self.usable}
+        for recommendation in result.recommendations or []:
+            for action in recommendation.action or []:
+                target = getattr(action, "targetHost", None)
+                if target is not None and target._moId in by_id:
+                    return by_id[target._moId]
+        return None
+
+    def spread(self):
+        """host name -> clones placed there"""
+        return {h.name: h.planned for h in self.candidates if h.planned}
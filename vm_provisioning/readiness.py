@@ -0,0 +1,271 @@
+import ipaddress
+import logging
+import threading
+import time
+
+from pyVmomi import vim, vmodl
+
+from config import config
+from inventory import PropertyCollector
+from ip_allocation import normalize
+
+# Guest properties watched for every new VM
+READINESS_PROPERTIES = [
+    "guest.toolsRunningStatus",
+    "guest.ipAddress",
+    "guest.net",
+    "guest.hostName",
+]
+
+TOOLS_RUNNING = "guestToolsRunning"
+
+
+def reported_ips(props):
+    """Addresses a guest reports, normalised, without loopback and link-local ones"""
+    addresses = [props.get("guest.ipAddress")]
+    for nic in props.get("guest.net") or []:
+        addresses.extend(nic.ipAddress or [])
+    found = []
+    for address in addresses:
+        if not address:
+            continue
+        try:
+            ip = ipaddress.ip_address(str(address).split("%")[0])
+        except ValueError:
+            continue
+        if ip.is_loopback or ip.is_link_local or ip.is_unspecified:
+            continue
+        if str(ip) not in found:
+            found.append(str(ip))
+    return found
+
+
+def hostname_matches(reported, expected):
+    """Guest host name is the customized one (Windows cuts names to 15 characters)"""
+    reported = (reported or "").split(".")[0].lower()
+    expected = (expected or "").split(".")[0].lower()
+    return reported == expected or (len(reported) == 15 and expected.startswith(reported))
+
+
+class Watched:
+    """What one VM must report before it counts as ready"""
+
+    def __init__(self, key, expected_ips, hostname, since, require_ip=True):
+        self.key = key
+        self.expected_ips = [normalize(ip) for ip in expected_ips or [] if ip]
+        self.hostname = hostname
+        self.since = since
+        self.require_ip = require_ip
+
+    def waiting_for(self, props):
+        """What the guest has not reported yet, or None once it is ready"""
+        tools = props.get("guest.toolsRunningStatus")
+        if tools != TOOLS_RUNNING:
+            return f"VMware Tools {tools or 'not reporting'}"
+        reported = reported_ips(props)
+        missing = [ip for ip in self.expected_ips if ip not in reported]
+        if missing:
+            return f"{', '.join(missing)} not reported"
+        if not reported and self.require_ip:
+            return "no IP address reported"
+        if self.hostname and not hostname_matches(props.get("guest.hostName"), self.hostname):
+            return f"host name {props.get('guest.hostName') or '-'} is not {self.hostname} yet"
+        return None
+
+
+class ReadinessResult:
+    """Outcome of waiting for one VM's guest"""
+
+    def __init__(self, key, vm, props, since, reason=None):
+        self.key = key
+        self.vm = vm
+        self.tools = props.get("guest.toolsRunningStatus")
+        self.ips = reported_ips(props)
+        self.reason = reason  # None when ready, else what was still missing
+        self.seconds = time.time() - since
+
+    @property
+    def ready(self):
+        return self.reason is None
+
+
+class ReadinessTracker:
+    """
+    Waits for many new VMs to come up through one WaitForUpdatesEx loop.
+
+    Works like task_tracker.TaskTracker: watched VMs sit in a ListView that
+    one PropertyCollector filter traverses, so every VM of a batch is
+    followed at once and each change of its guest properties arrives in the
+    next update set. A VM is ready once VMware Tools run, the guest reports
+    an IP address (all expected static ones, if given) and, when a host name
+    is given, customization has set it. results() yields a ReadinessResult
+    per VM the moment it is ready; after deadline() has passed it yields one
+    for every VM still waiting, with what it was waiting for.
+    """
+
+    def __init__(self, si, wait_seconds=None, logger=None):
+        self.wait_seconds = wait_seconds or config["TASK_TRACKER_WAIT_SECONDS"]
+        self.log = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._watched = {}  # vm -> Watched
+        self._props = {}  # vm -> {property path: value}
+        self._expected = 0  # VMs announced with expect() but not watched yet
+        self._deadline = None
+        self._closed = False
+        self.version = ""
+        self.stats = {"watched": 0, "ready": 0, "update_sets": 0}
+        content = si.RetrieveContent()
+        # A private collector keeps this filter out of the shared session collector
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateListView([])
+        traversal = PropertyCollector.TraversalSpec(
+            name="traverseList", path="view", skip=False, type=vim.view.ListView
+        )
+        spec = PropertyCollector.FilterSpec(
+            objectSet=[PropertyCollector.ObjectSpec(obj=self._view, skip=True, selectSet=[traversal])],
+            propSet=[
+                PropertyCollector.PropertySpec(
+                    type=vim.VirtualMachine, pathSet=READINESS_PROPERTIES, all=False
+                )
+            ],
+        )
+        self._collector.CreateFilter(spec, partialUpdates=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def expect(self, count):
+        """Announce count VMs that will be registered later by watch()"""
+        with self._lock:
+            self._expected += count
+
+    def watch(self, vm, key=None, expected_ips=None, hostname=None, since=None, require_ip=True):
+        """
+        Follow a new VM; time to ready is measured from since (default: now).
+        With require_ip=False running VMware Tools are enough.
+        """
+        with self._lock:
+            self._watched[vm] = Watched(
+                vm if key is None else key, expected_ips, hostname, since or time.time(), require_ip
+            )
+            self._expected = max(0, self._expected - 1)
+            self.stats["watched"] += 1
+        try:
+            self._view.ModifyListView(add=[vm])
+        except Exception:
+            with self._lock:
+                self._watched.pop(vm, None)
+            raise
+
+    def forget(self):
+        """An expected VM will never be watched (its clone failed)"""
+        with self._lock:
+            self._expected = max(0, self._expected - 1)
+            idle = not self._expected and not self._watched
+        if idle:
+            self.wake()
+
+    def deadline(self, seconds):
+        """
+        Every VM is watched now: the ones still waiting get seconds more
+        before results() reports them as not ready
+        """
+        with self._lock:
+            self._expected = 0
+            self._deadline = time.time() + seconds
+        self.wake()
+
+    def wake(self):
+        """Interrupt a blocked results() so it re-checks what is outstanding"""
+        try:
+            self._collector.CancelWaitForUpdates()
+        except Exception:
+            pass
+
+    @property
+    def waiting(self):
+        with self._lock:
+            return len(self._watched)
+
+    @property
+    def outstanding(self):
+        """VMs still coming up plus VMs expected but not yet watched"""
+        with self._lock:
+            return len(self._watched) + self._expected
+
+    def results(self):
+        """Yield a ReadinessResult per VM as it becomes ready or the deadline passes"""
+        while self.outstanding:
+            deadline = self._deadline
+            wait_seconds = self.wait_seconds
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    for result in self._expire():
+                        yield result
+                    return
+                wait_seconds = max(1, min(wait_seconds, int(remaining) + 1))
+            options = PropertyCollector.WaitOptions(maxWaitSeconds=wait_seconds)
+            try:
+                update_set = self._collector.WaitForUpdatesEx(self.version, options)
+            except vmodl.fault.RequestCanceled:
+                # wake(): the watched VMs or the deadline changed
+                continue
+            if update_set is None:
+                continue
+            self.version = update_set.version
+            self.stats["update_sets"] += 1
+            for result in self._apply(update_set):
+                yield result
+
+    def _apply(self, update_set):
+        done = []
+        with self._lock:
+            for filter_update in update_set.filterSet or []:
+                for obj_update in filter_update.objectSet or []:
+                    vm = obj_update.obj
+                    if obj_update.kind == "leave" or vm not in self._watched:
+                        continue
+                    props = self._props.setdefault(vm, {})
+                    for change in obj_update.changeSet or []:
+                        if change.op in ("remove", "indirectRemove"):
+                            props.pop(change.name, None)
+                        else:
+                            props[change.name] = change.val
+                    watched = self._watched[vm]
+                    if watched.waiting_for(props) is None:
+                        del self._watched[vm]
+                        done.append(ReadinessResult(watched.key, vm, self._props.pop(vm), watched.since))
+            self.stats["ready"] += len(done)
+        if done:
+            # Ready VMs have nothing more to report
+            try:
+                self._view.ModifyListView(remove=[r.vm for r in done])
+            except Exception as e:
+                self.log.debug(f"Could not drop ready VMs from the readiness view: {e}")
+        return done
+
+    def _expire(self):
+        with self._lock:
+            watched, self._watched = self._watched, {}
+            self._expected = 0
+            props = self._props
+            self._props = {}
+        return [
+            ReadinessResult(w.key, vm, props.get(vm, {}), w.since, w.waiting_for(props.get(vm, {})))
+            for vm, w in watched.items()
+        ]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Destroying the collector also destroys its filter
+        for obj, method in [(self._collector, "DestroyPropertyCollector"), (self._view, "DestroyView")]:
+            try:
+                getattr(obj, method)()
+            except Exception:
+                pass
@@ -0,0 +1,235 @@
+import threading
+import time
+
+from pyVmomi import vim, vmodl
+
+from config import config
+from inventory import has_privileges, retrieve_object_properties
+from placement import ledger
+from task_tracker import wait_for_task
+
+# Marker in a replica's annotation recording the source changeVersion
+VERSION_MARKER = "source changeVersion="
+
+# What a user must hold on a replica to clone VMs from it
+DEPLOY_PRIVILEGES = ["VirtualMachine.Provisioning.DeployTemplate"]
+
+
+class Replica:
+    """A template copy living on one datastore"""
+
+    def __init__(self, key, vm, name, version):
+        self.key = key
+        self.vm = vm
+        self.name = name
+        self.version = version
+        self.last_used = time.time()
+        self.in_use = 0
+        self.stale = False
+        self.reserved = 0  # bytes held in the space ledger while the copy is new
+        self.users = set()  # vCenter users found allowed to deploy from it
+
+    def vm_for(self, si):
+        """The replica bound to the caller's session (it may have been found by another one)"""
+        return vim.VirtualMachine(self.vm._moId, si._stub)
+
+
+class ReplicaCache:
+    """
+    One copy of each template per target datastore, created on first use.
+    A new copy's size stays reserved in the placement space ledger until
+    the batch that created it is done, since that batch placed its clones
+    against free space measured before the copy existed.
+
+    Cloning from a replica on the target datastore is a local copy instead
+    of streaming the template's disks across the storage fabric for every
+    VM. A replica records the template's config.changeVersion it was copied
+    at; once the template changes the replica is replaced. At most
+    max_replicas are kept per vCenter, evicting the least recently used
+    idle ones; replicas found by name from an earlier run are adopted.
+    Replicas are shared between users, each of whom must hold the deploy
+    privilege on one before it is handed out; a replica deleted outside
+    this app is forgotten and copied again.
+    """
+
+    def __init__(self, prefix="tpl-replica-", max_replicas=20):
+        self.prefix = prefix
+        self.max_replicas = max(1, int(max_replicas))
+        self._lock = threading.Lock()
+        self._replicas = {}  # (vCenter host, template moId, datastore moId) -> Replica
+        self._key_locks = {}
+        self.stats = {"hits": 0, "created": 0, "adopted": 0, "replaced": 0, "evicted": 0}
+
+    @staticmethod
+    def template_info(content, template_vm):
+        """Name, changeVersion, size and datastores of a template (one property fetch per batch)"""
+        rows = retrieve_object_properties(
+            content,
+            [template_vm],
+            ["name", "config.changeVersion", "datastore", "summary.storage.committed"],
+        )
+        row = rows[0] if rows else {}
+        return {
+            "name": row.get("name", template_vm._moId),
+            "version": row.get("config.changeVersion"),
+            "datastores": {ds._moId for ds in row.get("datastore") or []},
+            "size": row.get("summary.storage.committed") or 0,
+        }
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def acquire(
+        self, si, vcenter_host, template_vm, info, datastore, datastore_name, pool, folder,
+        logger=print, user=None,
+    ):
+        """
+        Replica of template_vm on datastore, or None when the template is
+        already stored there; pair a returned replica with release() and
+        clone from replica.vm_for(si)
+        """
+        if datastore._moId in info["datastores"]:
+            return None
+        key = (vcenter_host, template_vm._moId, datastore._moId)
+        with self._key_lock(key):
+            with self._lock:
+                replica = self._replicas.get(key)
+            if replica is not None and replica.version != info["version"]:
+                logger(f"♻️ Template {info['name']} changed; replacing replica {replica.name}")
+                self.stats["replaced"] += 1
+                self._drop(si, replica, logger)
+                replica = None
+            if replica is not None and not self._exists(si, replica):
+                logger(f"♻️ Template replica {replica.name} was removed outside this app; copying it again")
+                self.stats["replaced"] += 1
+                self._drop(si, replica, logger)
+                replica = None
+            if replica is None:
+                replica = self._open(si, key, template_vm, info, datastore, datastore_name, pool, folder, logger)
+                replica.users.add(user)
+            else:
+                self.stats["hits"] += 1
+            self._check_allowed(si, replica, user)
+            with self._lock:
+                self._replicas[key] = replica
+                replica.in_use += 1
+                replica.last_used = time.time()
+        self._evict(si, vcenter_host, logger)
+        return replica
+
+    def release(self, si, replica, logger=print):
+        with self._lock:
+            replica.in_use -= 1
+            replica.last_used = time.time()
+            destroy = replica.stale and replica.in_use <= 0
+            if replica.in_use <= 0:
+                # Batches placing from now on see the copy in freeSpace
+                self._unreserve(replica)
+        if destroy:
+            self._destroy(si, replica, logger)
+
+    @staticmethod
+    def _exists(si, replica):
+        try:
+            rows = retrieve_object_properties(si.RetrieveContent(), [replica.vm_for(si)], ["name"])
+        except vmodl.fault.ManagedObjectNotFound:
+            return False
+        return bool(rows)
+
+    def _check_allowed(self, si, replica, user):
+        """Raise unless user may deploy from replica (checked once per replica and user)"""
+        with self._lock:
+            if user in replica.users:
+                return
+        if not has_privileges(si.RetrieveContent(), replica.vm_for(si), DEPLOY_PRIVILEGES):
+            raise Exception(f"{user or 'This user'} may not deploy from template replica {replica.name}")
+        with self._lock:
+            replica.users.add(user)
+
+    @staticmethod
+    def _unreserve(replica):
+        if replica.reserved:
+            ledger.release((replica.key[0], replica.key[2]), replica.reserved)
+            replica.reserved = 0
+
+    def _drop(self, si, replica, logger):
+        """Forget a replica; destroyed now or when its last clone finishes"""
+        with self._lock:
+            replica.stale = True
+            if self._replicas.get(replica.key) is replica:
+                del self._replicas[replica.key]
+            destroy = replica.in_use <= 0
+        if destroy:
+            self._destroy(si, replica, logger)
+
+    def _evict(self, si, vcenter_host, logger):
+        with self._lock:
+            mine = [r for k, r in self._replicas.items() if k[0] == vcenter_host]
+            idle = sorted((r for r in mine if r.in_use <= 0), key=lambda r: r.last_used)
+            victims = idle[: max(0, len(mine) - self.max_replicas)]
+        for replica in victims:
+            logger(f"🧹 Evicting least recently used template replica {replica.name}")
+            self.stats["evicted"] += 1
+            self._drop(si, replica, logger)
+
+    def _open(self, si, key, template_vm, info, datastore, datastore_name, pool, folder, logger):
+        content = si.RetrieveContent()
+        name = f"{self.prefix}{info['name']}-{datastore_name}"
+        vm = content.searchIndex.FindChild(folder, name)
+        if vm is not None:
+            rows = retrieve_object_properties(content, [vm], ["config.annotation"])
+            annotation = (rows[0].get("config.annotation") if rows else None) or ""
+            if f"{VERSION_MARKER}{info['version']}" in annotation:
+                logger(f"📀 Using template replica {name}")
+                self.stats["adopted"] += 1
+                return Replica(key, vm, name, info["version"])
+            # Left over from an older template version
+            self._destroy(si, Replica(key, vm, name, None), logger)
+
+        logger(f"📀 Copying template {info['name']} to {datastore_name} as {name}")
+        ds_key = (key[0], datastore._moId)
+        ledger.reserve(ds_key, info["size"])
+        spec = vim.vm.CloneSpec(
+            location=vim.vm.RelocateSpec(datastore=datastore, pool=pool),
+            template=True,
+            powerOn=False,
+            config=vim.vm.ConfigSpec(
+                annotation=f"Replica of {info['name']} ({VERSION_MARKER}{info['version']})"
+            ),
+        )
+        try:
+            result = wait_for_task(si, template_vm.Clone(folder=folder, name=name, spec=spec), name)
+        except Exception:
+            ledger.release(ds_key, info["size"])
+            raise
+        if not result.succeeded:
+            ledger.release(ds_key, info["size"])
+            raise Exception(f"Could not create template replica {name}: {result.error_message}")
+        self.stats["created"] += 1
+        replica = Replica(key, result.result, name, info["version"])
+        replica.reserved = info["size"]
+        return replica
+
+    def _destroy(self, si, replica, logger):
+        with self._lock:
+            self._unreserve(replica)
+        try:
+            result = wait_for_task(si, replica.vm_for(si).Destroy_Task(), replica.name)
+            if not result.succeeded:
+                raise Exception(result.error_message)
+            logger(f"🗑️ Removed template replica {replica.name}")
+        except vmodl.fault.ManagedObjectNotFound:
+            # Already removed outside this app
+            pass
+        except Exception as e:
+            logger(f"⚠️ Could not remove template replica {replica.name}: {e}")
+
+
+replicas = (
+    ReplicaCache(
+        prefix=config["TEMPLATE_REPLICA_PREFIX"], max_replicas=config["TEMPLATE_REPLICA_MAX"]
+    )
+    if config["TEMPLATE_REPLICAS_ENABLED"]
+    else None
+)
@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+
+from pyVmomi import vim, vmodl
+
+from config import config
+from inventory import PropertyCollector
+
+# Task properties watched for every tracked task
+TASK_PROPERTIES = [
+    "info.state",
+    "info.error",
+    "info.result",
+    "info.queueTime",
+    "info.startTime",
+    "info.completeTime",
+]
+
+FINISHED_STATES = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+
+
+class TaskResult:
+    """Final state of one tracked task"""
+
+    def __init__(self, key, task, props):
+        self.key = key
+        self.task = task
+        self.state = props.get("info.state")
+        self.error = props.get("info.error")
+        self.result = props.get("info.result")
+        self.queue_time = props.get("info.queueTime")
+        self.start_time = props.get("info.startTime")
+        self.complete_time = props.get("info.completeTime")
+
+    @property
+    def succeeded(self):
+        return self.state == vim.TaskInfo.State.success
+
+    @property
+    def error_message(self):
+        if self.error is None:
+            return "Unknown error"
+        return str(getattr(self.error, "localizedMessage", None) or getattr(self.error, "msg", None) or self.error)
+
+    @property
+    def queued_seconds(self):
+        """Seconds the task waited in vCenter's queue before it started"""
+        if self.queue_time is None or self.start_time is None:
+            return None
+        return max(0.0, (self.start_time - self.queue_time).total_seconds())
+
+    @property
+    def duration(self):
+        """Seconds between vCenter starting and finishing the task, if known"""
+        if self.start_time is None or self.complete_time is None:
+            return None
+        return (self.complete_time - self.start_time).total_seconds()
+
+
+class TaskTracker:
+    """
+    Completion tracking for many vCenter tasks through one WaitForUpdatesEx loop.
+
+    Tracked tasks are added to a ListView that a single PropertyCollector
+    filter traverses, so registering a task costs one ModifyListView call and
+    every state change arrives in the next update set. completed() yields a
+    TaskResult the moment each task succeeds or fails, in finishing order.
+    Tasks may be registered from another thread while completed() runs;
+    expect() tells completed() to keep waiting for tasks not submitted yet.
+    """
+
+    def __init__(self, si, wait_seconds=None, logger=None):
+        self.wait_seconds = wait_seconds or config["TASK_TRACKER_WAIT_SECONDS"]
+        self.log = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._pending = {}  # task -> key
+        self._props = {}  # task -> {property path: value}
+        self._expected = 0  # tasks announced with expect() but not tracked yet
+        self._closed = False
+        self.version = ""
+        self.stats = {"tracked": 0, "update_sets": 0}
+        content = si.RetrieveContent()
+        # A private collector keeps this filter out of the shared session collector
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateListView([])
+        traversal = PropertyCollector.TraversalSpec(
+            name="traverseList", path="view", skip=False, type=vim.view.ListView
+        )
+        spec = PropertyCollector.FilterSpec(
+            objectSet=[PropertyCollector.ObjectSpec(obj=self._view, skip=True, selectSet=[traversal])],
+            propSet=[PropertyCollector.PropertySpec(type=vim.Task, pathSet=TASK_PROPERTIES, all=False)],
+        )
+        self._collector.CreateFilter(spec, partialUpdates=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def expect(self, count):
+        """Announce count tasks that will be registered later by track()"""
+        with self._lock:
+            self._expected += count
+
+    def track(self, task, key=None):
+        """Register a task; key identifies it in the TaskResult (default: the task)"""
+        with self._lock:
+            self._pending[task] = task if key is None else key
+            self._expected = max(0, self._expected - 1)
+            self.stats["tracked"] += 1
+        try:
+            self._view.ModifyListView(add=[task])
+        except Exception:
+            with self._lock:
+                self._pending.pop(task, None)
+            raise
+
+    def forget(self):
+        """An expected task will never be submitted (its submission failed)"""
+        with self._lock:
+            self._expected = max(0, self._expected - 1)
+            idle = not self._expected and not self._pending
+        if idle:
+            self.wake()
+
+    def wake(self):
+        """Interrupt a blocked completed() so it re-checks what is outstanding"""
+        try:
+            self._collector.CancelWaitForUpdates()
+        except Exception:
+            pass
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    @property
+    def outstanding(self):
+        """Tasks still running plus tasks expected but not yet tracked"""
+        with self._lock:
+            return len(self._pending) + self._expected
+
+    def completed(self, timeout=None):
+        """
+        Yield a TaskResult per tracked task as each one finishes.
+
+        Stops when no tracked or expected task is outstanding. With a timeout,
+        raises TimeoutError once that many seconds pass without all tasks
+        finishing.
+        """
+        deadline = time.time() + timeout if timeout else None
+        options = PropertyCollector.WaitOptions(maxWaitSeconds=self.wait_seconds)
+        while self.outstanding:
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError(f"{self.outstanding} task(s) still running after {timeout}s")
+            try:
+                update_set = self._collector.WaitForUpdatesEx(self.version, options)
+            except vmodl.fault.RequestCanceled:
+                # wake(): the set of outstanding tasks changed
+                continue
+            if update_set is None:
+                continue
+            self.version = update_set.version
+            self.stats["update_sets"] += 1
+            for result in self._apply(update_set):
+                yield result
+
+    def _apply(self, update_set):
+        done = []
+        with self._lock:
+            for filter_update in update_set.filterSet or []:
+                for obj_update in filter_update.objectSet or []:
+                    task = obj_update.obj
+                    if obj_update.kind == "leave" or task not in self._pending:
+                        continue
+                    props = self._props.setdefault(task, {})
+                    for change in obj_update.changeSet or []:
+                        if change.op in ("remove", "indirectRemove"):
+                            props.pop(change.name, None)
+                        else:
+                            props[change.name] = change.val
+                    if props.get("info.state") in FINISHED_STATES:
+                        key = self._pending.pop(task)
+                        done.append(TaskResult(key, task, self._props.pop(task)))
+        if done:
+            # Finished tasks have nothing more to report
+            try:
+                self._view.ModifyListView(remove=[r.task for r in done])
+            except Exception as e:
+                self.log.debug(f"Could not drop finished tasks from the task view: {e}")
+        return done
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Destroying the collector also destroys its filter
+        for obj, method in [(self._collector, "DestroyPropertyCollector"), (self._view, "DestroyView")]:
+            try:
+                getattr(obj, method)()
+            except Exception:
+                pass
+
+
+def wait_for_task(si, task, key=None, timeout=None):
+    """Block until one task finishes; returns its TaskResult"""
+    with TaskTracker(si) as tracker:
+        tracker.track(task, key)
+        for result in tracker.completed(timeout=timeout):
+            return result
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import deque
+
+from clone_scheduler import limiter
+from config import config
+
+
+class DatastoreStats:
+    """Recent clone outcomes on one datastore"""
+
+    def __init__(self, history):
+        self.outcomes = deque(maxlen=history)  # (finished at, succeeded)
+        self.durations = deque(maxlen=history)  # seconds, successful clones only
+        self.avg_duration = None  # EWMA of clone duration, seconds
+        self.successes_since_change = 0
+        self.last_decrease = 0
+
+    def record(self, succeeded, duration):
+        self.outcomes.append((time.time(), succeeded))
+        if succeeded and duration is not None:
+            self.avg_duration = (
+                duration if self.avg_duration is None else 0.7 * self.avg_duration + 0.3 * duration
+            )
+            self.durations.append(duration)
+
+    @property
+    def baseline(self):
+        """Fastest recent clone duration"""
+        return min(self.durations) if self.durations else None
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def rate_per_minute(self, span=300):
+        """Completions per minute over the last span seconds"""
+        since = time.time() - span
+        recent = [t for t, _ in self.outcomes if t >= since]
+        if len(recent) < 2:
+            return None
+        elapsed = max(time.time() - recent[0], 1)
+        return len(recent) * 60 / elapsed
+
+
+class AdaptiveThrottle:
+    """
+    AIMD controller for the per-datastore clone windows of an InFlightLimiter.
+
+    Every finished clone is an observation. The window shrinks by
+    decrease_factor when vCenter kept the task queued for longer than
+    queue_threshold, when clones on the datastore take slowdown_factor times
+    longer than the fastest recent one, or when the recent error rate passes
+    error_threshold; at most once per cooldown. After a full window of clean
+    completions it grows by one, up to the limiter's max_per_datastore.
+    observe() returns a log line for every change so operators can see why
+    throughput moved.
+    """
+
+    def __init__(
+        self,
+        limiter,
+        queue_threshold=10,
+        slowdown_factor=2.0,
+        error_threshold=0.2,
+        decrease_factor=0.5,
+        cooldown=30,
+        history=20,
+    ):
+        self.limiter = limiter
+        self.queue_threshold = queue_threshold
+        self.slowdown_factor = slowdown_factor
+        self.error_threshold = error_threshold
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.history = history
+        self._lock = threading.Lock()
+        self._stats = {}  # (vCenter host, datastore moId) -> DatastoreStats
+
+    def observe(self, ds_key, result, label=None):
+        """Feed one finished clone; returns a log line when the window changed"""
+        label = label or ds_key[1]
+        with self._lock:
+            stats = self._stats.setdefault(ds_key, DatastoreStats(self.history))
+            stats.record(result.succeeded, result.duration)
+            window = self.limiter.window(ds_key)
+            reason = self._congestion(stats, result)
+            if reason:
+                if time.time() - stats.last_decrease < self.cooldown or window <= 1:
+                    return None
+                size = self.limiter.set_window(ds_key, max(1, int(window * self.decrease_factor)))
+                stats.last_decrease = time.time()
+                stats.successes_since_change = 0
+                if size == window:
+                    return None
+                return f"📉 Clone window on {label}: {window} → {size} ({reason})"
+            if not result.succeeded:
+                return None
+            stats.successes_since_change += 1
+            if stats.successes_since_change < window or window >= self.limiter.max_per_datastore:
+                return None
+            size = self.limiter.set_window(ds_key, window + 1)
+            stats.successes_since_change = 0
+            rate = stats.rate_per_minute()
+            rate_msg = f", {rate:.1f} clones/min" if rate is not None else ""
+            return f"📈 Clone window on {label}: {window} → {size} ({window} clean completions{rate_msg})"
+
+    def _congestion(self, stats, result):
+        """Reason to back off, or None"""
+        queued = result.queued_seconds
+        if queued is not None and queued > self.queue_threshold:
+            return f"vCenter queued the task for {queued:.0f}s"
+        if len(stats.outcomes) >= 5 and stats.error_rate() > self.error_threshold:
+            return f"error rate {stats.error_rate():.0%} over the last {len(stats.outcomes)} clones"
+        if (
+            result.succeeded
+            and stats.baseline
+            and stats.avg_duration
+            and stats.avg_duration > stats.baseline * self.slowdown_factor
+        ):
+            return f"clones slowed to {stats.avg_duration:.0f}s from {stats.baseline:.0f}s"
+        return None
+
+
+throttle = (
+    AdaptiveThrottle(
+        limiter,
+        queue_threshold=config["CLONE_QUEUE_TIME_THRESHOLD"],
+        slowdown_factor=config["CLONE_SLOWDOWN_FACTOR"],
+        error_threshold=config["CLONE_ERROR_RATE_THRESHOLD"],
+        cooldown=config["CLONE_ADAPT_COOLDOWN"],
+    )
+    if config["CLONE_ADAPTIVE_ENABLED"]
+    else None
+)
@@ -0,0 +1,287 @@
+import atexit
+import hashlib
+import hmac
+import logging
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+from pyVim.connect import SmartConnect, Disconnect
+from pyVmomi import vim
+
+from config import config
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no vCenter session becomes available before the timeout"""
+
+
+class PooledSession:
+    """An authenticated ServiceInstance owned by the pool"""
+
+    def __init__(self, key, si, pwd_digest):
+        self.key = key
+        self.si = si
+        self.pwd_digest = pwd_digest
+        self.created_at = time.time()
+        self.last_checked = self.created_at
+        self.last_used = self.created_at
+
+    @property
+    def host(self):
+        return self.key[0]
+
+    @property
+    def user(self):
+        return self.key[1]
+
+
+def _digest(password):
+    return hashlib.sha256((password or "").encode("utf-8")).digest()
+
+
+class VCenterSessionPool:
+    """
+    Reusable vCenter sessions keyed by (host, user).
+
+    Sessions are checked out exclusively, verified with a cheap keepalive when
+    they have been idle for longer than keepalive_interval, and transparently
+    re-authenticated when vCenter has expired them. The total number of live
+    sessions is capped; when the cap is reached the least recently used idle
+    session of another key is closed, otherwise callers wait for a release.
+    """
+
+    def __init__(
+        self,
+        port=443,
+        max_sessions=8,
+        max_per_key=4,
+        keepalive_interval=60,
+        acquire_timeout=30,
+        logger=None,
+    ):
+        self.port = int(port)
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_per_key = max(1, min(int(max_per_key), self.max_sessions))
+        self.keepalive_interval = keepalive_interval
+        self.acquire_timeout = acquire_timeout
+        self.log = logger or logging.getLogger(__name__)
+        self._cond = threading.Condition()
+        self._idle = {}  # key -> [PooledSession], most recently used last
+        self._live = {}  # key -> number of sessions (idle + checked out)
+        self._closed = False
+        self.stats = {"created": 0, "reused": 0, "relogins": 0, "discarded": 0}
+
+    # ---- connection handling -------------------------------------------
+    def _connect(self, host, user, pwd):
+        context = ssl._create_unverified_context()
+        return SmartConnect(
+            host=host, user=user, pwd=pwd, port=self.port, sslContext=context
+        )
+
+    def _disconnect(self, session):
+        try:
+            Disconnect(session.si)
+        except Exception as e:
+            self.log.debug(f"Disconnect of {session.user}@{session.host} failed: {e}")
+
+    def _is_alive(self, session):
+        """Keepalive probe: one property read that fails once the session expired"""
+        try:
+            return session.si.content.sessionManager.currentSession is not None
+        except vim.fault.NotAuthenticated:
+            return False
+        except Exception:
+            return False
+
+    def _relogin(self, session, pwd):
+        """Re-authenticate an expired session, reconnecting if the stub is unusable"""
+        self.stats["relogins"] += 1
+        try:
+            session.si.content.sessionManager.Login(session.user, pwd)
+        except Exception as e:
+            self.log.info(
+                f"Re-login on existing stub for {session.user}@{session.host} failed ({e}), reconnecting"
+            )
+            self._disconnect(session)
+            session.si = self._connect(session.host, session.user, pwd)
+            session.created_at = time.time()
+
+    def _prepare(self, session, pwd):
+        now = time.time()
+        if now - session.last_checked >= self.keepalive_interval:
+            if not self._is_alive(session):
+                self._relogin(session, pwd)
+            session.last_checked = time.time()
+        session.last_used = time.time()
+        return session
+
+    # ---- bookkeeping ----------------------------------------------------
+    def _total_live(self):
+        return sum(self._live.values())
+
+    def _forget(self, key):
+        """Drop one live slot for key (caller holds the lock)"""
+        self._live[key] -= 1
+        if self._live[key] <= 0:
+            del self._live[key]
+        self._cond.notify_all()
+
+    def _evict_lru_idle(self, exclude_key):
+        """Close the least recently used idle session of another key"""
+        candidates = [
+            s
+            for key, idle in self._idle.items()
+            if key != exclude_key
+            for s in idle
+        ]
+        if not candidates:
+            return None
+        victim = min(candidates, key=lambda s: s.last_used)
+        self._idle[victim.key].remove(victim)
+        if not self._idle[victim.key]:
+            del self._idle[victim.key]
+        self._forget(victim.key)
+        self.stats["discarded"] += 1
+        return victim
+
+    # ---- public API -----------------------------------------------------
+    def acquire(self, host, user, pwd, timeout=None):
+        """Check out an authenticated session for (host, user)"""
+        key = (host, user)
+        digest = _digest(pwd)
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        while True:
+            session = None
+            victims = []
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("vCenter session pool is closed")
+                idle = self._idle.get(key, [])
+                while idle:
+                    candidate = idle.pop()
+                    if hmac.compare_digest(candidate.pwd_digest, digest):
+                        session = candidate
+                        break
+                    # Password changed: sessions opened with the old one are stale
+                    victims.append(candidate)
+                    self._forget(key)
+                if not idle:
+                    self._idle.pop(key, None)
+
+                if session is None:
+                    if self._live.get(key, 0) < self.max_per_key:
+                        if self._total_live() >= self.max_sessions:
+                            victim = self._evict_lru_idle(key)
+                            if victim:
+                                victims.append(victim)
+                        if self._total_live() < self.max_sessions:
+                            self._live[key] = self._live.get(key, 0) + 1
+                            create = True
+                    if not create:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise PoolExhaustedError(
+                                f"No vCenter session available for {user}@{host} within {timeout}s"
+                            )
+                        self._cond.wait(remaining)
+
+            for victim in victims:
+                self._disconnect(victim)
+
+            if session is not None:
+                try:
+                    self._prepare(session, pwd)
+                except Exception:
+                    self.release(session, discard=True)
+                    raise
+                self.stats["reused"] += 1
+                return session
+
+            if create:
+                try:
+                    si = self._connect(host, user, pwd)
+                except Exception:
+                    with self._cond:
+                        self._forget(key)
+                    raise
+                self.stats["created"] += 1
+                return PooledSession(key, si, digest)
+
+    def release(self, session, discard=False):
+        """Return a session to the pool, or close it when discard is set"""
+        with self._cond:
+            if discard or self._closed:
+                self._forget(session.key)
+                self.stats["discarded"] += 1
+            else:
+                session.last_used = time.time()
+                self._idle.setdefault(session.key, []).append(session)
+                self._cond.notify_all()
+                return
+        self._disconnect(session)
+
+    @contextmanager
+    def session(self, host, user, pwd):
+        """Context manager yielding a pooled ServiceInstance"""
+        session = self.acquire(host, user, pwd)
+        discard = False
+        try:
+            yield session.si
+        except vim.fault.NotAuthenticated:
+            discard = True
+            raise
+        finally:
+            self.release(session, discard=discard)
+
+    def close_all(self):
+        """Log out every idle session; checked-out sessions close on release"""
+        with self._cond:
+            self._closed = True
+            sessions = [s for idle in self._idle.values() for s in idle]
+            for s in sessions:
+                self._forget(s.key)
+            self._idle.clear()
+        for s in sessions:
+            self._disconnect(s)
+
+
+_pools = {}  # vCenter host -> VCenterSessionPool
+_pools_lock = threading.Lock()
+
+
+def pool_for(vcenter_host):
+    """
+    The session pool of one vCenter. Every vCenter gets its own, so the
+    sites of a federation do not compete for one set of sessions.
+    """
+    with _pools_lock:
+        pool = _pools.get(vcenter_host)
+        if pool is None:
+            pool = _pools[vcenter_host] = VCenterSessionPool(
+                port=config["VCENTER_PORT"],
+                max_sessions=config["VCENTER_POOL_MAX_SESSIONS"],
+                max_per_key=config["VCENTER_POOL_MAX_PER_USER"],
+                keepalive_interval=config["VCENTER_KEEPALIVE_INTERVAL"],
+                acquire_timeout=config["VCENTER_POOL_ACQUIRE_TIMEOUT"],
+            )
+        return pool
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+atexit.register(close_all)
+
+
+def vcenter_session(vcenter_host, vcenter_user, vcenter_pass):
+    """Borrow a pooled ServiceInstance: ``with vcenter_session(h, u, p) as si:``"""
+    return pool_for(vcenter_host).session(vcenter_host, vcenter_user, vcenter_pass)
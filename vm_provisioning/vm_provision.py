@@ -1,220 +1,235 @@
-from pyVim.connect import SmartConnect, Disconnect
 from pyVmomi import vim
-import ssl
-import atexit
+import threading
 import time
 from datetime import datetime
 import ipaddress
 import random
 
-
-def get_template_names(vcenter_host, vcenter_user, vcenter_pass):
-    """Get all VM templates from vCenter"""
-    context = ssl._create_unverified_context()
-    si = SmartConnect(
-        host=vcenter_host, user=vcenter_user, pwd=vcenter_pass, sslContext=context
-    )
-    atexit.register(Disconnect, si)
-
-    content = si.RetrieveContent()
-    templates = []
-
-    container = content.viewManager.CreateContainerView(
-        content.rootFolder, [vim.VirtualMachine], True
+from vcenter_pool import pool_for, vcenter_session
+from task_tracker import TaskTracker
+from readiness import ReadinessTracker
+from clone_scheduler import CloneJob, CloneScheduler, limiter
+from batch_plan import (
+    VmRecord,
+    bulk_plan,
+    estimate_seconds,
+    individual_plan,
+    numbered_name,
+    typical_duration,
+)
+from throttle import throttle
+from federation import federation, split_batch
+from config import config
+from placement import (
+    GB,
+    DatastoreCandidate,
+    DatastorePlacer,
+    HostCandidate,
+    HostPlacer,
+    PlacementError,
+    SpaceLedger,
+    ledger as space_ledger,
+)
+from linked_clone import ensure_snapshot, lookup_snapshot
+from instant_clone import instant_clone_spec, parents
+from replica_cache import replicas
+from customization import DEFAULT_NETMASK, CompiledCustomization, NicSettings, compile_customization
+from ip_allocation import (
+    AllocationError,
+    NicRange,
+    conflicts,
+    describe_conflicts,
+    normalize,
+    plan_ips,
+    prefix_length,
+)
+from inventory_mirror import get_mirror, rebind
+from inventory_index import find_by_inventory_path, find_by_name, get_index, invalidate_indexes
+from inventory import (
+    count_nics,
+    find_datacenter_ref,
+    guest_ip_owners,
+    list_names,
+    list_templates,
+    retrieve_object_properties,
+)
+
+
+# Inventory the demo mode pretends to provision into
+DEMO_DATASTORES = ['datastore1', 'datastore2', 'SSD-Storage']
+DEMO_DATASTORE_FREE_GB = 500
+DEMO_DATASTORE_CAPACITY_GB = 1000
+DEMO_TEMPLATE_GB = 12.5
+DEMO_TEMPLATE_CPUS = 2
+DEMO_TEMPLATE_MEMORY_GB = 4
+
+
+def demo_placers(vcenter_host, clone_mode):
+    """
+    DatastorePlacer and HostPlacer over the demo inventory, so a demo dry
+    run is planned and estimated by plan_only() like a real one
+    """
+    datastores = [
+        DatastoreCandidate(vcenter_host, {
+            'obj': vim.Datastore(f'datastore-demo-{i}'),
+            'name': name,
+            'summary.freeSpace': DEMO_DATASTORE_FREE_GB * GB,
+            'summary.capacity': DEMO_DATASTORE_CAPACITY_GB * GB,
+            'summary.accessible': True,
+            'summary.maintenanceMode': 'normal',
+        })
+        for i, name in enumerate(DEMO_DATASTORES, 1)
+    ]
+    hosts = [
+        HostCandidate({
+            'obj': vim.HostSystem(f'host-demo-{i}'),
+            'name': f'esxi-{i:02d}.demo.local',
+            'datastore': [c.obj for c in datastores],
+            'runtime.connectionState': 'connected',
+            'runtime.inMaintenanceMode': False,
+            'runtime.powerState': 'poweredOn',
+            'summary.hardware.cpuMhz': 2600,
+            'summary.hardware.numCpuCores': 32,
+            'summary.hardware.memorySize': 512 * GB,
+            'summary.quickStats.overallCpuUsage': 16000,
+            'summary.quickStats.overallMemoryUsage': 160 * 1024,
+        })
+        for i in range(1, 4)
+    ]
+    # Same clone sizes as DatastorePlacer.for_cluster
+    if clone_mode in ('linked', 'instant'):
+        clone_size = DEMO_TEMPLATE_MEMORY_GB * GB + int(config["LINKED_CLONE_DELTA_GB"] * GB)
+    else:
+        clone_size = int(DEMO_TEMPLATE_GB * GB)
+    placer = DatastorePlacer(datastores, clone_size, policy='round-robin', ledger=SpaceLedger())
+    host_placer = HostPlacer(
+        None, None, hosts, DEMO_TEMPLATE_CPUS, DEMO_TEMPLATE_MEMORY_GB * GB, use_drs=False
     )
+    return placer, host_placer
 
-    for vm in container.view:
-        if vm.config and vm.config.template:
-            templates.append(vm.name)
 
-    container.Destroy()
-    return sorted(templates)
+def get_template_names(vcenter_host, vcenter_user, vcenter_pass):
+    """Get all VM templates from vCenter"""
+    mirror = get_mirror(vcenter_host, vcenter_user, vcenter_pass)
+    if mirror:
+        return mirror.template_names()
+    with vcenter_session(vcenter_host, vcenter_user, vcenter_pass) as si:
+        content = si.RetrieveContent()
+        return sorted(row["name"] for row in list_templates(content))
 
 
 def get_datacenters(vcenter_host, vcenter_user, vcenter_pass):
     """Get all datacenters from vCenter"""
-    context = ssl._create_unverified_context()
-    si = SmartConnect(
-        host=vcenter_host, user=vcenter_user, pwd=vcenter_pass, sslContext=context
-    )
-    atexit.register(Disconnect, si)
-
-    content = si.RetrieveContent()
-    datacenters = []
-
-    container = content.viewManager.CreateContainerView(
-        content.rootFolder, [vim.Datacenter], True
-    )
-
-    for dc in container.view:
-        datacenters.append(dc.name)
-
-    container.Destroy()
-    return sorted(datacenters)
+    mirror = get_mirror(vcenter_host, vcenter_user, vcenter_pass)
+    if mirror:
+        return mirror.datacenter_names()
+    with vcenter_session(vcenter_host, vcenter_user, vcenter_pass) as si:
+        content = si.RetrieveContent()
+        return list_names(content, vim.Datacenter)
 
 
 def get_clusters(vcenter_host, vcenter_user, vcenter_pass, datacenter_name):
     """Get all clusters in a specific datacenter"""
-    context = ssl._create_unverified_context()
-    si = SmartConnect(
-        host=vcenter_host, user=vcenter_user, pwd=vcenter_pass, sslContext=context
-    )
-    atexit.register(Disconnect, si)
-
-    content = si.RetrieveContent()
-    clusters = []
-
-    # Find the datacenter
-    dc_container = content.viewManager.CreateContainerView(
-        content.rootFolder, [vim.Datacenter], True
-    )
-
-    datacenter = None
-    for dc in dc_container.view:
-        if dc.name == datacenter_name:
-            datacenter = dc
-            break
-
-    dc_container.Destroy()
-
-    if datacenter:
-        cluster_container = content.viewManager.CreateContainerView(
-            datacenter, [vim.ClusterComputeResource], True
-        )
-
-        for cluster in cluster_container.view:
-            clusters.append(cluster.name)
-
-        cluster_container.Destroy()
-
-    return sorted(clusters)
+    mirror = get_mirror(vcenter_host, vcenter_user, vcenter_pass)
+    if mirror:
+        return mirror.cluster_names(datacenter_name)
+    with vcenter_session(vcenter_host, vcenter_user, vcenter_pass) as si:
+        content = si.RetrieveContent()
+        datacenter = find_datacenter_ref(content, datacenter_name)
+        if not datacenter:
+            return []
+        return list_names(content, vim.ClusterComputeResource, container=datacenter)
 
 
 def get_networks(vcenter_host, vcenter_user, vcenter_pass, datacenter_name):
     """Get all networks in a specific datacenter"""
-    context = ssl._create_unverified_context()
-    si = SmartConnect(
-        host=vcenter_host, user=vcenter_user, pwd=vcenter_pass, sslContext=context
-    )
-    atexit.register(Disconnect, si)
-
-    content = si.RetrieveContent()
-    networks = []
-
-    # Find the datacenter
-    dc_container = content.viewManager.CreateContainerView(
-        content.rootFolder, [vim.Datacenter], True
-    )
-
-    datacenter = None
-    for dc in dc_container.view:
-        if dc.name == datacenter_name:
-            datacenter = dc
-            break
-
-    dc_container.Destroy()
-
-    if datacenter:
-        network_container = content.viewManager.CreateContainerView(
-            datacenter, [vim.Network], True
-        )
-
-        for network in network_container.view:
-            networks.append(network.name)
-
-        network_container.Destroy()
-
-    return sorted(networks)
+    mirror = get_mirror(vcenter_host, vcenter_user, vcenter_pass)
+    if mirror:
+        return mirror.network_names(datacenter_name)
+    with vcenter_session(vcenter_host, vcenter_user, vcenter_pass) as si:
+        content = si.RetrieveContent()
+        datacenter = find_datacenter_ref(content, datacenter_name)
+        if not datacenter:
+            return []
+        return list_names(content, vim.Network, container=datacenter)
 
 
 def get_nic_count(vcenter_host, vcenter_user, vcenter_pass, template_name):
     """Get the number of NICs in a template"""
-    context = ssl._create_unverified_context()
-    si = SmartConnect(
-        host=vcenter_host, user=vcenter_user, pwd=vcenter_pass, sslContext=context
-    )
-    atexit.register(Disconnect, si)
-
-    content = si.RetrieveContent()
-
-    container = content.viewManager.CreateContainerView(
-        content.rootFolder, [vim.VirtualMachine], True
-    )
-
-    for vm in container.view:
-        if vm.name == template_name and vm.config and vm.config.template:
-            nic_count = len(
-                [
-                    device
-                    for device in vm.config.hardware.device
-                    if isinstance(device, vim.vm.device.VirtualEthernetCard)
-                ]
-            )
-            container.Destroy()
+    mirror = get_mirror(vcenter_host, vcenter_user, vcenter_pass)
+    if mirror:
+        nic_count = mirror.nic_count(template_name)
+        if nic_count is not None:
             return nic_count
+    with vcenter_session(vcenter_host, vcenter_user, vcenter_pass) as si:
+        content = si.RetrieveContent()
+        # Fetch the device list only for the matching template, not all VMs
+        matches = [row["obj"] for row in list_templates(content) if row.get("name") == template_name]
+        if not matches:
+            return 1
+        rows = retrieve_object_properties(content, matches[:1], ["config.hardware.device"])
+        if not rows:
+            return 1
+        return count_nics(rows[0].get("config.hardware.device"))
 
-    container.Destroy()
-    return 1
 
+def _content_of(managed_object):
+    """ServiceContent for the session a managed object is bound to"""
+    return vim.ServiceInstance("ServiceInstance", stub=managed_object._stub).RetrieveContent()
 
-def find_vm_by_name(content, name):
-    """Find VM by name"""
-    container = content.viewManager.CreateContainerView(
-        content.rootFolder, [vim.VirtualMachine], True
-    )
-
-    for vm in container.view:
-        if vm.name == name:
-            container.Destroy()
-            return vm
 
-    container.Destroy()
-    return None
+def find_vm_by_name(content, name, mirror=None, index=None):
+    """Find VM by name"""
+    if mirror:
+        return rebind(mirror.find(vim.VirtualMachine, name), content.rootFolder._stub)
+    # VMs and templates can sit anywhere in the folder tree, so use the name index
+    return (index.find if index else find_by_name)(content, vim.VirtualMachine, name)
 
 
-def find_datacenter_by_name(content, name):
+def find_datacenter_by_name(content, name, mirror=None, index=None):
     """Find datacenter by name"""
-    container = content.viewManager.CreateContainerView(
-        content.rootFolder, [vim.Datacenter], True
-    )
-
-    for dc in container.view:
-        if dc.name == name:
-            container.Destroy()
-            return dc
-
-    container.Destroy()
-    return None
+    if mirror:
+        return rebind(mirror.find(vim.Datacenter, name), content.rootFolder._stub)
+    dc = find_by_inventory_path(content, name, expected_type=vim.Datacenter)
+    if dc:
+        return dc
+    # Datacenter nested in a folder
+    return (index.find if index else find_by_name)(content, vim.Datacenter, name)
 
 
-def find_cluster_by_name(datacenter, name):
+def find_cluster_by_name(datacenter, name, mirror=None, index=None, content=None):
     """Find cluster by name in datacenter"""
-    container = datacenter.parent.viewManager.CreateContainerView(
-        datacenter, [vim.ClusterComputeResource], True
+    if mirror:
+        return rebind(
+            mirror.find(vim.ClusterComputeResource, name, datacenter=datacenter),
+            datacenter._stub,
+        )
+    content = content or _content_of(datacenter)
+    cluster = find_by_inventory_path(
+        content, datacenter.name, "host", name, expected_type=vim.ClusterComputeResource
+    )
+    if cluster:
+        return cluster
+    # Cluster nested in a host subfolder
+    return (index.find if index else find_by_name)(
+        content, vim.ClusterComputeResource, name, datacenter
     )
-
-    for cluster in container.view:
-        if cluster.name == name:
-            container.Destroy()
-            return cluster
-
-    container.Destroy()
-    return None
 
 
-def find_network_by_name(datacenter, name):
+def find_network_by_name(datacenter, name, mirror=None, index=None, content=None):
     """Find network by name in datacenter"""
-    container = datacenter.parent.viewManager.CreateContainerView(
-        datacenter, [vim.Network], True
+    if mirror:
+        return rebind(
+            mirror.find(vim.Network, name, datacenter=datacenter), datacenter._stub
+        )
+    content = content or _content_of(datacenter)
+    network = find_by_inventory_path(
+        content, datacenter.name, "network", name, expected_type=vim.Network
     )
-
-    for network in container.view:
-        if network.name == name:
-            container.Destroy()
-            return network
-
-    container.Destroy()
-    return None
+    if network:
+        return network
+    # Network nested in a network subfolder
+    return (index.find if index else find_by_name)(content, vim.Network, name, datacenter)
 
 
 def configure_vm_network(vm, network, ip_map, logger):
@@ -260,11 +275,22 @@ def provision_vms_demo_mode(
     logger=print,
     individual_nodes_data=None,
     hostname_prefix=None,
+    on_vm_update=None,
+    clone_mode='full',
+    ip_exclusions=None,
+    dry_run=False,
+    clone_durations=None,
 ):
     """
     Demo mode provisioning with realistic logs using actual configuration data
     This simulates real provisioning process with the user's configuration
+    on_vm_update(name, **fields) receives the same per-VM updates as in production
+    dry_run returns a simulated plan shaped like provision_vms' dry run
     """
+    def report(name, **fields):
+        if on_vm_update:
+            on_vm_update(name, **fields)
+
     logger(f"🎭 DEMO MODE: VM Provisioning Simulation Started")
     logger(f"⚡ Using live configuration data for realistic simulation")
     
@@ -288,15 +314,15 @@ def provision_vms_demo_mode(
     time.sleep(0.7)
     logger(f"📁 Found datacenter: {datacenter_name}")
     logger(f"🏢 Located cluster: {cluster_name} (Resources: 80% CPU, 65% Memory available)")
-    logger(f"💾 Available datastores: ['datastore1', 'datastore2', 'SSD-Storage']")
+    logger(f"💾 Available datastores: {DEMO_DATASTORES}")
     logger(f"🌐 Network configuration: {network_name}")
     
     # Template analysis
     logger(f"🔍 Analyzing template: {template}")
     time.sleep(0.5)
     logger(f"💿 Template OS: Detected Linux/Windows hybrid configuration")
-    logger(f"💾 Template size: ~12.5 GB")
-    logger(f"⚙️  Template specs: 2 vCPU, 4 GB RAM, 40 GB Disk")
+    logger(f"💾 Template size: ~{DEMO_TEMPLATE_GB} GB")
+    logger(f"⚙️  Template specs: {DEMO_TEMPLATE_CPUS} vCPU, {DEMO_TEMPLATE_MEMORY_GB} GB RAM, 40 GB Disk")
     
     # Network configuration analysis
     if ip_map:
@@ -321,14 +347,24 @@ def provision_vms_demo_mode(
         total_vms = len(individual_nodes_data)
     else:
         logger(f"📦 Bulk provisioning mode: {count} VMs with prefix '{prefix}'")
+        ip_plan = None
+        if ip_map:
+            nic_keys = sorted(ip_map, key=lambda key: int(key[3:]))
+            ip_plan, allocated = plan_ips(
+                count,
+                [ip_map[key] for key in nic_keys],
+                exclusions=[(ip_exclusions or {}).get(key) for key in nic_keys],
+            )
+            for nic, (network, addresses, _) in sorted(allocated.items()):
+                logger(f"🌐 {nic_keys[nic].upper()} IPs: {NicRange.describe(network, addresses)}")
         vms_to_create = []
         for i in range(1, count + 1):
             # ใช้ prefix จาก form สำหรับ VM name (ไม่ใช่ hostname_prefix)
-            vm_name = f"{prefix}{i:02d}"
+            vm_name = numbered_name(prefix, i, count)
             
             # ใช้ hostname_prefix สำหรับ hostname (ถ้ามี)
             if hostname_prefix:
-                hostname = f"{hostname_prefix}{i:02d}"
+                hostname = numbered_name(hostname_prefix, i, count)
             else:
                 hostname = f"{vm_name}.local"
             
@@ -340,8 +376,9 @@ def provision_vms_demo_mode(
             logger(f"🔍 DEBUG: Created VM {i}: name='{vm_name}', hostname='{hostname}'")
             
             # ใช้ IPs จาก ip_map สำหรับ bulk mode
-            if ip_map:
-                vm_data['ips'] = ip_map.copy()  # ใช้ IPs ที่ user กำหนด
+            if ip_plan:
+                # IPs ที่จัดสรรจาก subnet ของแต่ละ NIC
+                vm_data['ips'] = {key: ip for key, ip in zip(nic_keys, ip_plan[i - 1]) if ip}
             else:
                 # Fallback: สร้าง IPs ตาม template
                 if template.lower() == 'centos-8-template':
@@ -358,8 +395,29 @@ def provision_vms_demo_mode(
             vms_to_create.append(vm_data)
         total_vms = count
     
+    if dry_run:
+        logger(f"🎭 Planning against the demo inventory")
+        placer, host_placer = demo_placers(vcenter_host, clone_mode)
+        customization = None
+        if clone_mode != 'instant':
+            customization = CompiledCustomization([NicSettings(None, DEFAULT_NETMASK, None)] * 9, 'linux')
+        planned = (
+            (i, {
+                'name': vm_data['name'],
+                'hostname': vm_data.get('hostname'),
+                'ips': [ip for ip in (vm_data.get('ips') or {}).values() if ip],
+            })
+            for i, vm_data in enumerate(vms_to_create, 1)
+        )
+        return plan_only(
+            planned, total_vms, placer, host_placer, customization, clone_mode, None,
+            [], vcenter_host, None, None, clone_durations, logger,
+        )
+
     logger(f"🚀 Starting provisioning of {total_vms} virtual machines...")
     logger(f"⏱️  Estimated completion time: {total_vms * 2.5:.1f} minutes")
+    for vm_data in vms_to_create:
+        report(vm_data['name'], hostname=vm_data.get('hostname'), status='pending', progress=0)
     
     # Simulate provisioning process with enhanced detailed logs
     for i, vm_data in enumerate(vms_to_create):
@@ -368,6 +426,8 @@ def provision_vms_demo_mode(
         ips = vm_data.get('ips', {})
         
         logger(f"🚀 Starting VM {i+1}/{total_vms}: {vm_name}")
+        started_at = time.time()
+        report(vm_name, status='cloning', progress=10, submitted_at=started_at)
         time.sleep(0.3)
         
         logger(f"📋 Validating configuration for {vm_name}")
@@ -388,22 +448,29 @@ def provision_vms_demo_mode(
         logger(f"💾 Cloning template for {vm_name}")
         logger(f"   • Source template: {template}")
         logger(f"   • Target datastore: datastore1")
-        logger(f"   • Clone method: Full clone")
-        time.sleep(0.6)
+        logger(f"   • Clone method: {clone_mode.capitalize()} clone")
+        time.sleep(0.6 if clone_mode == 'full' else 0.1)
         
         logger(f"📈 Clone progress: 25% - VM {vm_name}")
+        report(vm_name, progress=48)
         time.sleep(0.3)
         logger(f"📈 Clone progress: 50% - VM {vm_name}")
+        report(vm_name, progress=55)
         time.sleep(0.3)
         logger(f"📈 Clone progress: 75% - VM {vm_name}")
+        report(vm_name, progress=63)
         time.sleep(0.3)
         logger(f"📈 Clone progress: 100% - VM {vm_name}")
+        report(vm_name, progress=70)
         time.sleep(0.3)
         
         logger(f"✅ VM {vm_name} cloned successfully")
+        cloned_at = time.time()
+        report(vm_name, status='customizing')
         time.sleep(0.3)
         
         logger(f"⚙️ Applying customization for {vm_name}")
+        report(vm_name, progress=80)
         logger(f"   • Setting hostname: {hostname}")
         if ips:
             for nic, ip in ips.items():
@@ -420,9 +487,19 @@ def provision_vms_demo_mode(
         time.sleep(0.4)
         
         logger(f"🟢 VM {vm_name} powered on successfully")
+        report(vm_name, progress=90)
         time.sleep(0.3)
         
         logger(f"✅ Guest OS boot completed - VM {vm_name} ready")
+        completed_at = time.time()
+        report(
+            vm_name,
+            status='success',
+            progress=100,
+            completed_at=completed_at,
+            duration=completed_at - started_at,
+            ready_seconds=completed_at - cloned_at,
+        )
         time.sleep(0.2)
     
     # Final summary
@@ -467,8 +544,35 @@ def provision_vms(
     logger=print,
     timeout_seconds=30,  # This will now only apply to connection/discovery
     individual_nodes_data=None,  # เพิ่ม argument สำหรับ individual mode
+    on_vm_update=None,
+    clone_mode='full',
+    ip_exclusions=None,
+    dry_run=False,
+    clone_durations=None,
+    first_number=1,
+    batch_size=None,
 ):
-    """Provision VMs from template with per-VM customization (hostname, static IP)"""
+    """
+    Provision VMs from template with per-VM customization (hostname, static IP)
+
+    clone_mode 'full' copies the template's disks; 'linked' creates child
+    disks on top of the template's linked-clone snapshot instead; 'instant'
+    forks running parents of the template (one per host and datastore) and
+    passes hostname and IPs through guestinfo instead of customization.
+    In bulk mode ip_map's netN entries are starting addresses (optionally
+    with a /prefix) and ip_exclusions' netN entries addresses or ranges to
+    skip; see ip_allocation.plan_ips.
+    on_vm_update(name, **fields) is called whenever a VM's status changes;
+    results are streamed to it rather than kept, so 'vms' is None then.
+    Returns {'message', 'succeeded', 'failed', 'vms': [...] or None}.
+
+    With dry_run nothing is created: discovery, IP allocation, placement and
+    spec building run as usual and plan_only()'s result is returned;
+    clone_durations (seconds of past clones) feed its time estimate.
+
+    A bulk batch that is one site's share of a federated batch numbers its
+    VMs from first_number, padded for batch_size VMs.
+    """
     logger(f"🚀 Starting VM provisioning...")
     logger(f"📋 Template: {template}")
     logger(f"📋 Prefix: {prefix}")
@@ -476,18 +580,22 @@ def provision_vms(
     logger(f"📋 Datacenter: {datacenter_name}")
     logger(f"📋 Cluster: {cluster_name}")
     logger(f"📋 Network: {network_name}")
+    logger(f"📋 Clone mode: {clone_mode}")
     logger(f"⏱️  Timeout setting (connection/discovery only): {timeout_seconds} seconds")
     start_time = time.time()
+    session = None
+    tracker = None
+    readiness = None
+    placer = None
+    instant_parents = {}  # VM name -> instant-clone Parent it is forked from
+    replicas_used = {}  # VM name -> template Replica it is cloned from
     try:
         # Connection timeout check
         logger(f"🔌 Connecting to vCenter: {vcenter_host}")
         connection_start = time.time()
         try:
-            context = ssl._create_unverified_context()
-            si = SmartConnect(
-                host=vcenter_host, user=vcenter_user, pwd=vcenter_pass, sslContext=context
-            )
-            atexit.register(Disconnect, si)
+            session = pool_for(vcenter_host).acquire(vcenter_host, vcenter_user, vcenter_pass)
+            si = session.si
             connection_time = time.time() - connection_start
             logger(f"✅ Connected to vCenter (took {connection_time:.2f}s)")
         except Exception as conn_error:
@@ -512,9 +620,15 @@ def provision_vms(
         # Resource discovery with timeout check
         logger(f"🔍 Discovering vCenter resources...")
         discovery_start = time.time()
+        mirror = get_mirror(vcenter_host, vcenter_user, vcenter_pass)
+        index = None
+        if mirror:
+            logger(f"⚡ Using live inventory mirror for discovery")
+        else:
+            index = get_index(vcenter_host, vcenter_user)
 
         # Find required objects with individual timeout checks
-        template_vm = find_vm_by_name(content, template)
+        template_vm = find_vm_by_name(content, template, mirror=mirror, index=index)
         if not template_vm:
             logger(f"❌ Template '{template}' not found")
             logger(f"💡 Please verify:")
@@ -528,7 +642,7 @@ def provision_vms(
             logger(f"⏰ Timeout exceeded ({elapsed_time:.1f}s > {timeout_seconds}s) during template discovery")
             raise Exception(f"Operation timed out while finding template")
 
-        datacenter = find_datacenter_by_name(content, datacenter_name)
+        datacenter = find_datacenter_by_name(content, datacenter_name, mirror=mirror, index=index)
         if not datacenter:
             logger(f"❌ Datacenter '{datacenter_name}' not found")
             logger(f"💡 Available datacenters should be verified")
@@ -539,7 +653,7 @@ def provision_vms(
             logger(f"⏰ Timeout exceeded ({elapsed_time:.1f}s > {timeout_seconds}s) during datacenter discovery")
             raise Exception(f"Operation timed out while finding datacenter")
 
-        cluster = find_cluster_by_name(datacenter, cluster_name)
+        cluster = find_cluster_by_name(datacenter, cluster_name, mirror=mirror, index=index, content=content)
         if not cluster:
             logger(f"❌ Cluster '{cluster_name}' not found in datacenter '{datacenter_name}'")
             logger(f"💡 Please verify cluster name and permissions")
@@ -550,7 +664,7 @@ def provision_vms(
             logger(f"⏰ Timeout exceeded ({elapsed_time:.1f}s > {timeout_seconds}s) during cluster discovery")
             raise Exception(f"Operation timed out while finding cluster")
 
-        network = find_network_by_name(datacenter, network_name)
+        network = find_network_by_name(datacenter, network_name, mirror=mirror, index=index, content=content)
         if not network:
             logger(f"❌ Network '{network_name}' not found in datacenter '{datacenter_name}'")
             logger(f"💡 Please verify network name and accessibility")
@@ -569,253 +683,658 @@ def provision_vms(
         resource_pool = cluster.resourcePool
         # VM folder (default to datacenter's vm folder)
         vm_folder = datacenter.vmFolder
-        # Get datastore (use first available datastore in cluster)
-        datastore = cluster.datastore[0] if cluster.datastore else None
-        if not datastore:
+        # Linked clones all share one snapshot of the template
+        snapshot = None
+        actions = []  # dry run: what a real run would create first
+        if clone_mode == 'linked' and dry_run:
+            snapshot, _ = lookup_snapshot(content, template_vm)
+            if snapshot is None:
+                actions.append(f"create snapshot '{config['LINKED_CLONE_SNAPSHOT']}' on template {template}")
+        elif clone_mode == 'linked':
+            snapshot = ensure_snapshot(si, vcenter_host, template_vm, resource_pool, logger=logger)
+
+        # Spread the clones over the cluster's datastores by free space
+        # A dry run places against a copy of the shared reservations
+        placer = DatastorePlacer.for_cluster(
+            content, vcenter_host, cluster, template_vm, linked=clone_mode in ('linked', 'instant'),
+            ledger=space_ledger.copy() if dry_run else space_ledger,
+        )
+        for line in placer.describe():
+            logger(line)
+        if not placer.usable:
             logger(f"❌ No datastore available in cluster '{cluster_name}'")
             logger(f"💡 Cluster must have at least one accessible datastore")
             raise Exception("No datastore available in cluster")
-        logger(f"📁 Using datastore: {datastore.name}")
+        # Optionally pin every clone to a host so the batch's boot load is
+        # spread; instant clones always need one since they run on their
+        # parent's host (PlaceVm does not cover instant clones)
+        host_placer = None
+        if clone_mode == 'instant' or config["HOST_PLACEMENT"] in ("drs", "load"):
+            host_placer = HostPlacer.for_cluster(
+                content,
+                cluster,
+                template_vm,
+                use_drs=config["HOST_PLACEMENT"] == "drs" and clone_mode != 'instant' and not dry_run,
+            )
+            for line in host_placer.describe():
+                logger(line)
+
+        # Full clones copy from a replica of the template on their datastore
+        template_info = None
+        if replicas is not None and clone_mode == 'full':
+            template_info = replicas.template_info(content, template_vm)
+
+        os_type = 'windows' if 'win' in template.lower() else 'linux'
+        # Template NICs, IP pools and guest OS are looked up once; each VM
+        # only fills in its hostname and IPs (instant clones use guestinfo)
+        customization = None
+        if clone_mode != 'instant':
+            customization = compile_customization(
+                content, template_vm, datacenter, os_type=os_type, logger=logger
+            )
+
+        # Static IPs a running guest already reports are found before any
+        # clone, from one property fetch over the datacenter
+        conflict_check = config["IP_CONFLICT_CHECK"]
+        if individual_nodes_data:
+            has_static = any(ip for node in individual_nodes_data for ip in (node.get('ips') or {}).values())
+        else:
+            has_static = any(ip_map.values())
+        taken = {}
+        if conflict_check in ('reallocate', 'reject') and has_static:
+            taken = guest_ip_owners(content, datacenter)
+            logger(f"🔎 IP conflict pre-check: {len(taken)} address(es) in use by guests in '{datacenter_name}'")
 
         # Start cloning VMs (NO timeout for the provisioning process itself)
-        clone_tasks = []
-        vm_configs = []
+        if not dry_run:
+            tracker = TaskTracker(si)
+        # The plan is generated lazily and iterated once, as the scheduler
+        # pulls VMs for submission
         if individual_nodes_data and len(individual_nodes_data) > 0:
             # Individual mode: ใช้ข้อมูลแต่ละ node
-            for idx, node in enumerate(individual_nodes_data, 1):
-                vm_name = node.get('name') or f"vm{idx:02d}"
-                hostname = node.get('hostname') or vm_name
-                ips = []
-                node_ips = node.get('ips', {})
-                for nic_idx in range(1, 10):
-                    ip = node_ips.get(f"net{nic_idx}")
-                    ips.append(ip if ip else None)
-                vm_configs.append({'name': vm_name, 'hostname': hostname, 'ips': ips})
+            total = len(individual_nodes_data)
+            # The nodes are posted as one list already, so their plan is too
+            nodes = list(individual_plan(individual_nodes_data))
+            planned = iter(nodes)
+            if taken:
+                # Explicit addresses cannot be moved; also catch duplicates within the batch
+                found, claimed = [], dict(taken)
+                for _, vmc in nodes:
+                    found.extend(conflicts(vmc['ips'], claimed))
+                    claimed.update((normalize(ip), vmc['name']) for ip in vmc['ips'] if ip)
+                if found:
+                    raise AllocationError(f"IP conflict pre-check failed: {describe_conflicts(found)}")
         else:
-            # Bulk mode: auto-increment IP, ตั้งชื่อ, สร้าง spec ให้แต่ละ VM
-            def increment_ip(ip, n):
-                parts = list(map(int, ip.split('.')))
-                parts[-1] += n
-                for i in range(3, 0, -1):
-                    if parts[i] > 255:
-                        parts[i] -= 256
-                        parts[i-1] += 1
-                return '.'.join(map(str, parts))
-            ip_bases = []
-            for nic_idx in range(1, 10):
-                ip = ip_map.get(f"net{nic_idx}")
-                ip_bases.append(ip if ip else None)
-            for i in range(count):
-                vm_name = f"{prefix}{i+1:02d}"
-                hostname = vm_name
-                ips = []
-                for base in ip_bases:
-                    if base:
-                        ips.append(increment_ip(base, i))
-                    else:
-                        ips.append(None)
-                vm_configs.append({'name': vm_name, 'hostname': hostname, 'ips': ips})
-        logger(f"🔢 Preparing to provision {len(vm_configs)} VMs...")
-        for idx, vmc in enumerate(vm_configs, 1):
-            logger(f"➡️  [{idx}/{len(vm_configs)}] Preparing VM '{vmc['name']}' Hostname: {vmc['hostname']} IPs: {vmc['ips']}")
+            # Bulk mode: the whole batch's IPs are allocated up front from
+            # each NIC's subnet (IP pool mask and gateway when known)
+            total = count
+            nics = customization.nics if customization else ()
+            ip_plan, allocated = plan_ips(
+                count,
+                [ip_map.get(f"net{nic_idx}") for nic_idx in range(1, 10)],
+                exclusions=[(ip_exclusions or {}).get(f"net{nic_idx}") for nic_idx in range(1, 10)],
+                prefixes=[prefix_length(nic.netmask) for nic in nics],
+                gateways=[nic.gateway for nic in nics],
+                taken=taken,
+                reallocate=conflict_check == 'reallocate',
+            )
+            for nic, (network, addresses, skipped) in sorted(allocated.items()):
+                if skipped:
+                    logger(f"⚠️ NIC{nic + 1}: skipped {len(skipped)} address(es) already in use: {describe_conflicts(skipped)}")
+                logger(f"🌐 NIC{nic + 1} IPs: {NicRange.describe(network, addresses)}")
+            if customization is not None:
+                customization = customization.with_subnets(
+                    {nic: network for nic, (network, _, _) in allocated.items()}
+                )
+            planned = iter(bulk_plan(prefix, count, ip_plan, first=first_number, of=batch_size))
+        logger(f"🔢 Preparing to provision {total} VMs...")
+
+        if dry_run:
+            return plan_only(
+                planned, total, placer, host_placer, customization, clone_mode, template_info,
+                actions, vcenter_host, resource_pool, vm_folder, clone_durations, logger,
+            )
+
+        # Per-VM results stream to on_vm_update (the job store); only the
+        # VMs still in flight and the outcome counts are kept here
+        collected = None
+        if on_vm_update is None:
+            # No listener: the caller gets the rows back instead
+            collected = {}
+            on_vm_update = lambda name, **fields: collected.setdefault(name, {'name': name}).update(fields)
+        inflight = {}  # VM name -> VmRecord, until its status is final
+        final_counts = {'success': 0, 'failed': 0}
+        results_lock = threading.Lock()
+
+        def report(name, **fields):
+            with results_lock:
+                record = inflight.get(name)
+                if record is None:
+                    record = inflight[name] = VmRecord(name)
+                record.update(fields)
+                if fields.get('status') in final_counts:
+                    del inflight[name]
+                    final_counts[fields['status']] += 1
+            on_vm_update(name, **fields)
+
+        def in_flight(name):
+            with results_lock:
+                return inflight.get(name)
+
+        def make_job(idx, vmc):
+            report(
+                vmc['name'],
+                hostname=vmc['hostname'],
+                ips=', '.join(ip for ip in vmc['ips'] if ip) or 'DHCP',
+                status='pending',
+                progress=0,
+            )
+            try:
+                placed = placer.place(vmc['name'])
+            except PlacementError as e:
+                logger(f"❌ [{idx}/{total}] Cannot place VM '{vmc['name']}': {e}")
+                report(vmc['name'], status='failed', error=f"Placement failed: {e}")
+                return None
+            datastore = placed.obj
+
+            def prepare():
+                logger(f"➡️  [{idx}/{total}] Preparing VM '{vmc['name']}' Hostname: {vmc['hostname']} IPs: {vmc['ips']}")
+                if clone_mode == 'instant':
+                    return prepare_instant()
+                if template_info is not None:
+                    try:
+                        replica = replicas.acquire(
+                            si, vcenter_host, template_vm, template_info, datastore,
+                            placed.name, resource_pool, vm_folder, logger=logger, user=vcenter_user,
+                        )
+                    except Exception as e:
+                        logger(f"⚠️ {e}; cloning {vmc['name']} from the template instead")
+                        replica = None
+                    if replica is not None:
+                        replicas_used[vmc['name']] = replica
                 clone_spec = vim.vm.CloneSpec()
                 clone_spec.location = vim.vm.RelocateSpec()
                 clone_spec.location.datastore = datastore
                 clone_spec.location.pool = resource_pool
-            # Network config (vNIC mapping already handled by template)
-            # CustomizationSpec
-            os_type = 'windows' if 'win' in template.lower() else 'linux'
-            custom_spec = build_customization_spec_from_template(template_vm, vmc['hostname'], vmc['ips'], os_type=os_type, logger=logger)
-            clone_spec.customization = custom_spec
+                if snapshot is not None:
+                    clone_spec.snapshot = snapshot
+                    clone_spec.location.diskMoveType = 'createNewChildDiskBacking'
+                # Network config (vNIC mapping already handled by template)
+                # CustomizationSpec
+                custom_spec = customization.spec(vmc['hostname'], vmc['ips'])
+                clone_spec.customization = custom_spec
                 clone_spec.powerOn = True
-            try:
-                task = template_vm.Clone(folder=vm_folder, name=vmc['name'], spec=clone_spec)
-                clone_tasks.append((task, vmc['name'], time.time()))
-                logger(f"✅ Clone task initiated for {vmc['name']}")
-            except Exception as clone_error:
-                logger(f"❌ Failed to initiate clone for {vmc['name']}: {str(clone_error)}")
-                continue
-            time.sleep(0.5)
-        # Wait for all clone tasks to complete (NO global timeout)
-            success_count = 0
-            failed_count = 0
-            for task, vm_name, task_start_time in clone_tasks:
-                try:
-                logger(f"⏳ Waiting for VM '{vm_name}' to finish provisioning...")
-                    while task.info.state in [
-                        vim.TaskInfo.State.running,
-                        vim.TaskInfo.State.queued,
-                    ]:
-                        time.sleep(1)
-                    if task.info.state == vim.TaskInfo.State.success:
-                    logger(f"✅ {vm_name} cloned and customized successfully")
-                        success_count += 1
+                if host_placer is not None:
+                    host = host_placer.place(vmc['name'], clone_spec)
+                    if host:
+                        logger(f"🖥️  [{idx}/{total}] {vmc['name']} → host {host[0]} ({host[1]})")
                     else:
-                        error_msg = (
-                            str(task.info.error.localizedMessage) if task.info.error else "Unknown error"
+                        logger(f"⚠️ [{idx}/{total}] No eligible host for {vmc['name']}; vCenter will choose")
+                return clone_spec
+
+            def prepare_instant():
+                spec = instant_clone_spec(
+                    vmc['name'], vmc['hostname'], vmc['ips'], datastore, resource_pool, vm_folder
+                )
+                host = host_placer.place(vmc['name'], spec)
+                if not host:
+                    raise Exception("no eligible host for an instant-clone parent")
+                logger(f"🖥️  [{idx}/{total}] {vmc['name']} → host {host[0]} ({host[1]})")
+                instant_parents[vmc['name']] = parents.acquire(
+                    si, vcenter_host, template_vm, spec.location.host, datastore,
+                    resource_pool, vm_folder, logger=logger, user=vcenter_user,
+                )
+                return spec
+
+            def launch(clone_spec):
+                if clone_mode == 'instant':
+                    task = instant_parents[vmc['name']].vm_for(si).InstantClone_Task(spec=clone_spec)
+                else:
+                    source = replicas_used[vmc['name']].vm_for(si) if vmc['name'] in replicas_used else template_vm
+                    task = source.Clone(folder=vm_folder, name=vmc['name'], spec=clone_spec)
+                report(vmc['name'], status='cloning', progress=10, task=task._moId, submitted_at=time.time())
+                return task
+
+            def submit_failed(error):
+                # Nothing will ever finish for this VM: free what it holds now
+                name = vmc['name']
+                placer.finish(name, False)
+                if name in instant_parents:
+                    parents.release(si, instant_parents.pop(name), logger=logger)
+                if name in replicas_used:
+                    replicas.release(si, replicas_used.pop(name), logger=logger)
+                report(name, status='failed', error=f"Clone not submitted: {error}")
+                if readiness is not None:
+                    readiness.forget()
+
+            return CloneJob(
+                vmc['name'], datastore, prepare, launch,
+                datastore_name=placed.name, on_failure=submit_failed,
+            )
+
+        # A clone only counts once its guest is up: every finished clone is
+        # watched in one property filter on a thread of its own, so all the
+        # batch's guests come up side by side
+        def watch_readiness():
+            try:
+                report_readiness()
+            except Exception as e:
+                logger(f"⚠️ Readiness tracking stopped: {e}")
+
+        def report_readiness():
+            for ready in readiness.results():
+                name = ready.key
+                if ready.ready:
+                    fields = {'status': 'success', 'progress': 100, 'ready_seconds': ready.seconds}
+                    record = in_flight(name)
+                    if record is not None and record.ips == 'DHCP' and ready.ips:
+                        fields['ips'] = ', '.join(ready.ips)
+                    logger(f"🟢 {name} ready {ready.seconds:.0f}s after cloning ({', '.join(ready.ips)})")
+                    report(name, **fields)
+                else:
+                    logger(f"⏰ {name} not ready {ready.seconds:.0f}s after cloning: {ready.reason}")
+                    report(name, status='failed', error=f"Guest not ready: {ready.reason}")
+
+        readiness_thread = None
+        if config["READINESS_CHECK"]:
+            readiness = ReadinessTracker(si)
+            readiness.expect(total)
+            readiness_thread = threading.Thread(
+                target=watch_readiness, name=f"readiness-{vcenter_host}", daemon=True
+            )
+            readiness_thread.start()
+
+        # Submissions run in a worker pool bounded by the in-flight window;
+        # each finished task frees a slot for the next clone and the adaptive
+        # throttle resizes the datastore window from what it observed
+        # Jobs (placement and spec) are made only as workers pull them, so
+        # no more than the submit workers' worth exists ahead of the window
+        scheduler = CloneScheduler(tracker, vcenter_host, throttle=throttle, logger=logger)
+        scheduler.start((make_job(idx, vmc) for idx, vmc in planned), total=total)
+        # Wait for all clone tasks to complete (NO global timeout); results
+        # are reported in the order vCenter finishes them
+        logger(f"⏳ Waiting for {total} clone task(s) to finish provisioning...")
+        try:
+            for result in scheduler.results():
+                vm_name = result.key
+                placer.finish(vm_name, result.succeeded)
+                if vm_name in instant_parents:
+                    parents.release(si, instant_parents.pop(vm_name), logger=logger)
+                if vm_name in replicas_used:
+                    replicas.release(si, replicas_used.pop(vm_name), logger=logger)
+                took = result.duration
+                took_msg = f" in {took:.0f}s" if took is not None else ""
+                finished = {
+                    'duration': took,
+                    'completed_at': (
+                        result.complete_time.timestamp() if result.complete_time else time.time()
+                    ),
+                }
+                if result.succeeded and readiness is not None:
+                    logger(f"✅ {vm_name} cloned{took_msg}; waiting for its guest to come up")
+                    report(vm_name, status='customizing', progress=90, **finished)
+                    record = in_flight(vm_name) or VmRecord(vm_name)
+                    # An instant clone's identity comes from a script in the
+                    # guest that this app does not ship: only wait for Tools
+                    identity = clone_mode != 'instant'
+                    try:
+                        readiness.watch(
+                            result.result,
+                            vm_name,
+                            expected_ips=(
+                                [ip for ip in (record.ips or '').split(', ') if ip and ip != 'DHCP']
+                                if identity else None
+                            ),
+                            hostname=record.hostname if identity else None,
+                            since=finished['completed_at'],
+                            require_ip=identity,
                         )
-                        logger(f"❌ {vm_name} clone failed: {error_msg}")
-                        failed_count += 1
-                except Exception as e:
-                    logger(f"❌ Error monitoring {vm_name}: {str(e)}")
-                    failed_count += 1
-            total_time = time.time() - start_time
-            logger(f"")
-            logger(f"🎉 PROVISIONING COMPLETED")
-            logger(f"⏱️  Total time: {total_time:.2f} seconds")
-            logger(f"📊 Results:")
-            logger(f"   ✅ Successful: {success_count}")
-            logger(f"   ❌ Failed: {failed_count}")
-        logger(f"   📋 Total requested: {len(vm_configs)}")
-        completion_msg = f"Provisioning completed in {total_time:.1f}s! {success_count}/{len(vm_configs)} VMs created successfully"
-            return completion_msg
+                    except Exception as e:
+                        logger(f"⚠️ Cannot watch {vm_name}'s guest ({e}); counting the clone as done")
+                        report(vm_name, status='success', progress=100)
+                elif result.succeeded:
+                    logger(f"✅ {vm_name} cloned and customized successfully{took_msg}")
+                    report(vm_name, status='success', progress=100, **finished)
+                else:
+                    logger(f"❌ {vm_name} clone failed{took_msg}: {result.error_message}")
+                    report(vm_name, status='failed', error=result.error_message, **finished)
+                    if readiness is not None:
+                        readiness.forget()
+        except Exception as e:
+            logger(f"❌ Error monitoring clone tasks: {str(e)}")
+        finally:
+            scheduler.close()
+        if readiness is not None:
+            # One deadline for the whole batch, counted from its last clone
+            if readiness.waiting:
+                logger(
+                    f"⏳ Waiting up to {config['READINESS_TIMEOUT']}s for "
+                    f"{readiness.waiting} guest(s) to report VMware Tools and IPs..."
+                )
+            readiness.deadline(config["READINESS_TIMEOUT"])
+            readiness_thread.join()
+        spread = ", ".join(f"{name}: {n}" for name, n in sorted(placer.spread().items()))
+        if spread:
+            logger(f"📁 Datastore placement: {spread}")
+        if host_placer is not None and host_placer.drs_error:
+            logger(f"⚠️ DRS placement unavailable, used load scoring: {host_placer.drs_error}")
+        if host_placer is not None and host_placer.spread():
+            spread = ", ".join(f"{name}: {n}" for name, n in sorted(host_placer.spread().items()))
+            logger(f"🖥️  Host placement: {spread}")
+        # VMs the scheduler never pulled continue the same plan iteration
+        for _, vmc in planned:
+            report(
+                vmc['name'],
+                hostname=vmc['hostname'],
+                ips=', '.join(ip for ip in vmc['ips'] if ip) or 'DHCP',
+                status='failed',
+                error='Clone was not submitted',
+            )
+        unfinished = {
+            'pending': 'Clone was not submitted',
+            'cloning': 'Clone task outcome unknown',
+            'customizing': 'Guest readiness unknown',
+        }
+        with results_lock:
+            leftover = [(name, record.status) for name, record in inflight.items()]
+        for name, status in leftover:
+            report(name, status='failed', error=unfinished.get(status, 'Outcome unknown'))
+        success_count = final_counts['success']
+        # Includes VMs a failing plan never produced
+        failed_count = total - success_count
+        total_time = time.time() - start_time
+        logger(f"")
+        logger(f"🎉 PROVISIONING COMPLETED")
+        logger(f"⏱️  Total time: {total_time:.2f} seconds")
+        logger(f"📊 Results:")
+        logger(f"   ✅ Successful: {success_count}")
+        logger(f"   ❌ Failed: {failed_count}")
+        logger(f"   📋 Total requested: {total}")
+        outcome = "ready" if readiness is not None else "created successfully"
+        completion_msg = f"Provisioning completed in {total_time:.1f}s! {success_count}/{total} VMs {outcome}"
+        return {
+            'message': completion_msg,
+            'succeeded': success_count,
+            'failed': failed_count,
+            'vms': list(collected.values()) if collected is not None else None,
+        }
     except Exception as e:
         total_time = time.time() - start_time
         error_msg = f"Provisioning failed after {total_time:.1f}s: {str(e)}"
         logger(f"❌ {error_msg}")
         raise Exception(error_msg)
-
-
-def get_template_network_info(template_vm, logger=print):
+    finally:
+        if tracker is not None:
+            tracker.close()
+        if readiness is not None:
+            readiness.close()
+        if placer is not None:
+            placer.release_all()
+        for parent in instant_parents.values():
+            parents.release(si, parent, logger=logger)
+        for replica in replicas_used.values():
+            replicas.release(si, replica, logger=logger)
+        if session is not None:
+            pool_for(vcenter_host).release(session)
+
+
+def plan_only(
+    plan,
+    total,
+    placer,
+    host_placer,
+    customization,
+    clone_mode,
+    template_info,
+    actions,
+    vcenter_host,
+    resource_pool,
+    vm_folder,
+    clone_durations,
+    logger=print,
+):
     """
-    ดึงข้อมูล network configuration จาก template
+    Dry run of provision_vms: place and build the spec of every VM without
+    calling Clone(), then project datastore consumption and duration.
+
+    plan is the batch's (number, VM) iterable. Returns {'message', 'plan':
+    summary, 'vms': one row per VM with its planned datastore and host}.
     """
-    logger(f"🔍 Analyzing template: {template_vm.name}")
-    
-    network_info = []
-    if template_vm.config and template_vm.config.hardware:
-        for i, device in enumerate(template_vm.config.hardware.device):
-            if isinstance(device, vim.vm.device.VirtualEthernetCard):
-                nic_info = {
-                    'index': i,
-                    'device': device,
-                    'network_name': 'Unknown',
-                    'network_type': 'Unknown',
-                    'subnet': 'Unknown',
-                    'gateway': 'Unknown'
-                }
-                
-                # ดึงข้อมูล network
-                if device.backing:
-                    if hasattr(device.backing, 'network') and device.backing.network:
-                        network = device.backing.network
-                        nic_info['network_name'] = network.name
-                        nic_info['network_type'] = type(network).__name__
-                        
-                        # ดึงข้อมูล IP Pool (ถ้ามี)
-                        if hasattr(network, 'summary') and network.summary:
-                            summary = network.summary
-                            if hasattr(summary, 'ipPool') and summary.ipPool:
-                                ip_pool = summary.ipPool
-                                if hasattr(ip_pool, 'subnetAddress'):
-                                    nic_info['subnet'] = ip_pool.subnetAddress
-                                if hasattr(ip_pool, 'gateway'):
-                                    nic_info['gateway'] = ip_pool.gateway
-                
-                network_info.append(nic_info)
-                logger(f"📋 NIC{i+1}: {nic_info['network_name']} ({nic_info['network_type']})")
-                logger(f"   Subnet: {nic_info['subnet']}")
-                logger(f"   Gateway: {nic_info['gateway']}")
-    
-    return network_info
+    vms = []
+    per_datastore = {}  # datastore key -> clones planned there
+    parent_pairs = set()  # instant mode: (host, datastore) parents needed
+    replica_targets = set()  # datastores needing a template replica
+    for idx, vmc in plan:
+        row = {
+            'name': vmc['name'],
+            'hostname': vmc['hostname'],
+            'ips': ', '.join(ip for ip in vmc['ips'] if ip) or 'DHCP',
+        }
+        vms.append(row)
+        try:
+            placed = placer.place(vmc['name'])
+        except PlacementError as e:
+            row.update(status='unplaceable', error=str(e))
+            continue
+        if clone_mode == 'instant':
+            spec = instant_clone_spec(
+                vmc['name'], vmc['hostname'], vmc['ips'], placed.obj, resource_pool, vm_folder
+            )
+        else:
+            spec = vim.vm.CloneSpec(
+                location=vim.vm.RelocateSpec(datastore=placed.obj, pool=resource_pool),
+                customization=customization.spec(vmc['hostname'], vmc['ips']),
+                powerOn=True,
+            )
+        host = host_placer.place(vmc['name'], spec) if host_placer is not None else None
+        if clone_mode == 'instant' and not host:
+            row.update(status='unplaceable', error='no eligible host for an instant-clone parent')
+            continue
+        row.update(status='planned', datastore=placed.name)
+        if host:
+            row['host'] = host[0]
+            parent_pairs.add((host[0], placed.name))
+        if template_info is not None and placed.obj._moId not in template_info['datastores']:
+            replica_targets.add(placed.name)
+        per_datastore[placed.key] = per_datastore.get(placed.key, 0) + 1
+
+    if clone_mode == 'instant' and parent_pairs:
+        actions.append(f"start instant-clone parents on {len(parent_pairs)} host/datastore pair(s) unless running")
+    for name in sorted(replica_targets):
+        actions.append(f"copy the template to {name} unless a current replica exists")
+
+    datastores = []
+    for c in sorted(placer.candidates, key=lambda c: c.name):
+        if not c.planned:
+            continue
+        after = c.available(placer.ledger)
+        datastores.append({
+            'name': c.name,
+            'vms': c.planned,
+            'planned_gb': round(c.planned * placer.clone_size / GB, 1),
+            'available_gb': round((after + c.planned * placer.clone_size) / GB, 1),
+            'available_after_gb': round(after / GB, 1),
+            'free_after_percent': round(100 * after / c.capacity, 1) if c.capacity else None,
+        })
+
+    clone_seconds, source = typical_duration(clone_durations, config["PLAN_DEFAULT_CLONE_SECONDS"])
+    max_slots = max(1, min(
+        limiter.max_total - limiter.in_flight(),
+        limiter.max_per_host - limiter.in_flight(vcenter_host),
+    ))
+    seconds, concurrency = estimate_seconds(
+        per_datastore, {key: limiter.window(key) for key in per_datastore}, max_slots, clone_seconds
+    )
+    planned = sum(per_datastore.values())
+    summary = {
+        'clone_mode': clone_mode,
+        'total': total,
+        'planned': planned,
+        'unplaceable': total - planned,
+        'clone_size_gb': round(placer.clone_size / GB, 1),
+        'datastores': datastores,
+        'hosts': host_placer.spread() if host_placer is not None else {},
+        'actions': actions,
+        'concurrency': concurrency,
+        'clone_seconds': round(clone_seconds, 1),
+        'clone_seconds_source': source,
+        'estimated_seconds': round(seconds),
+        'estimated_completion': datetime.fromtimestamp(time.time() + seconds).isoformat(timespec='seconds'),
+    }
 
+    logger(f"🧮 DRY RUN: {planned}/{total} VM(s) placed, nothing was created")
+    for ds in datastores:
+        logger(
+            f"   💾 {ds['name']}: {ds['vms']} VM(s), {ds['planned_gb']} GB → "
+            f"{ds['available_after_gb']} GB of {ds['available_gb']} GB left"
+        )
+    for action in actions:
+        logger(f"   🛠️  Would {action}")
+    logger(
+        f"   ⏱️  ~{seconds / 60:.0f} min at {concurrency} concurrent clone(s) of "
+        f"~{clone_seconds:.0f}s ({source})"
+    )
+    message = (
+        f"Dry run: {planned}/{total} VMs placed on {len(datastores)} datastore(s), "
+        f"estimated {seconds / 60:.0f} min at {concurrency} concurrent clones"
+    )
+    return {'message': message, 'plan': summary, 'vms': vms}
+
+
+def site_room(vcenter_host, vcenter_user, vcenter_pass, template, datacenter_name, cluster_name, clone_mode='full'):
+    """How many more clones of template the cluster's datastores have room for"""
+    mirror = get_mirror(vcenter_host, vcenter_user, vcenter_pass)
+    index = None if mirror else get_index(vcenter_host, vcenter_user)
+    with vcenter_session(vcenter_host, vcenter_user, vcenter_pass) as si:
+        content = si.RetrieveContent()
+        template_vm = find_vm_by_name(content, template, mirror=mirror, index=index)
+        if not template_vm:
+            raise Exception(f"Template '{template}' not found")
+        datacenter = find_datacenter_by_name(content, datacenter_name, mirror=mirror, index=index)
+        if not datacenter:
+            raise Exception(f"Datacenter '{datacenter_name}' not found")
+        cluster = find_cluster_by_name(datacenter, cluster_name, mirror=mirror, index=index, content=content)
+        if not cluster:
+            raise Exception(f"Cluster '{cluster_name}' not found")
+        placer = DatastorePlacer.for_cluster(
+            content, vcenter_host, cluster, template_vm, linked=clone_mode in ('linked', 'instant')
+        )
+        return placer.room()
 
-def build_customization_spec_from_template(template_vm, hostname, ip_list, os_type='linux', logger=print):
+
+def provision_vms_federated(
+    sites,
+    vcenter_user,
+    vcenter_pass,
+    template,
+    prefix,
+    count,
+    datacenter_name,
+    cluster_name,
+    network_name,
+    ip_map=None,
+    logger=print,
+    timeout_seconds=30,
+    on_vm_update=None,
+    clone_mode='full',
+):
     """
-    สร้าง CustomizationSpec โดยดึง network settings จาก template และ override เฉพาะ IP
-    - template_vm: template VM object
-    - hostname: ชื่อ host ที่ต้องการ
-    - ip_list: list ของ IP ที่ต้องการ override (None = ใช้ DHCP)
-    - os_type: 'linux' หรือ 'windows'
+    Provision one bulk batch across several vCenters (federation.Site).
+
+    Every site reports how many clones its cluster has room for, the batch
+    is split in that proportion (federation.split_batch) and each share is
+    a provision_vms() of its own, all running at once. Each site so has
+    its own session pool, task tracker, clone scheduler and per-vCenter
+    in-flight limit. Sites without their own datacenter, cluster or network
+    use the batch's. VM names are numbered across the whole batch; static
+    IPs cannot be split over sites, so shares use DHCP.
+    Returns {'message', 'succeeded', 'failed', 'vms'} like provision_vms.
     """
-    logger(f"🔍 Analyzing template network configuration...")
-    
-    # ดึง network configuration จาก template
-    template_nics = []
-    if template_vm.config and template_vm.config.hardware:
-        for device in template_vm.config.hardware.device:
-            if isinstance(device, vim.vm.device.VirtualEthernetCard):
-                nic_info = {
-                    'device': device,
-                    'network': None,
-                    'ip_settings': None
-                }
-                # ดึง network ที่เชื่อมต่อ
-                if device.backing and hasattr(device.backing, 'network'):
-                    nic_info['network'] = device.backing.network
-                template_nics.append(nic_info)
-    
-    logger(f"📋 Found {len(template_nics)} NICs in template")
-    
-    # สร้าง CustomizationSpec
-    global_ip = vim.vm.customization.GlobalIPSettings()
-    nic_settings = []
-    
-    for i, (nic_info, new_ip) in enumerate(zip(template_nics, ip_list)):
-        adapter = vim.vm.customization.AdapterMapping()
-        
-        # ใช้ network settings จาก template
-        if nic_info['network']:
-            adapter.adapter = vim.vm.customization.IPSettings()
-            
-            # ถ้ามี IP ใหม่ ให้ override
-            if new_ip:
-                logger(f"🌐 NIC{i+1}: Override IP to {new_ip}")
-                adapter.adapter.ip = vim.vm.customization.FixedIp(ipAddress=new_ip)
-                # ใช้ subnet/gateway จาก template (ถ้ามี)
-                if hasattr(nic_info['network'], 'summary'):
-                    network_summary = nic_info['network'].summary
-                    if hasattr(network_summary, 'ipPool'):
-                        ip_pool = network_summary.ipPool
-                        if ip_pool and hasattr(ip_pool, 'subnetAddress'):
-                            adapter.adapter.subnetMask = ip_pool.subnetAddress
-                        if ip_pool and hasattr(ip_pool, 'gateway'):
-                            adapter.adapter.gateway = [ip_pool.gateway]
-            else:
-                logger(f"🌐 NIC{i+1}: Use DHCP")
-                adapter.adapter.ip = vim.vm.customization.DhcpIpGenerator()
+    if any((ip_map or {}).values()):
+        raise AllocationError("Static IPs cannot be split across vCenter sites; use DHCP or provision each site separately")
+    start_time = time.time()
+    collected = None
+    if on_vm_update is None:
+        collected = {}
+        on_vm_update = lambda name, **fields: collected.setdefault(name, {'name': name}).update(fields)
+
+    def target(site):
+        return site.datacenter or datacenter_name, site.cluster or cluster_name, site.network or network_name
+
+    logger(f"🌍 Federated batch of {count} VMs across {len(sites)} vCenter site(s)")
+    rooms = {}
+    for site, room, error in federation.fan_out(
+        lambda site: site_room(
+            site.host, vcenter_user, vcenter_pass, template, *target(site)[:2], clone_mode=clone_mode
+        ),
+        sites,
+    ):
+        if error is not None:
+            logger(f"⚠️ [{site.name}] {site.host} left out: {error}")
+            room = 0
         else:
-            # Fallback: ใช้การตั้งค่าพื้นฐาน
-            if new_ip:
-                adapter.adapter = vim.vm.customization.IPSettings(
-                    ip=vim.vm.customization.FixedIp(ipAddress=new_ip),
-                    subnetMask='255.255.255.0'
-                )
-            else:
-                adapter.adapter = vim.vm.customization.IPSettings(
-                    ip=vim.vm.customization.DhcpIpGenerator()
-                )
-        
-        nic_settings.append(adapter)
-    
-    # Identity settings
-    if os_type == 'windows':
-        ident = vim.vm.customization.Sysprep(
-            guiUnattended=vim.vm.customization.GuiUnattended(
-                autoLogon=False,
-                autoLogonCount=1,
-                timeZone=190
-            ),
-            userData=vim.vm.customization.UserData(
-                computerName=vim.vm.customization.FixedName(name=hostname),
-                fullName="Administrator",
-                orgName="Organization"
-            ),
-            identification=vim.vm.customization.Identification()
-        )
-    else:
-        ident = vim.vm.customization.LinuxPrep(
-            hostName=vim.vm.customization.FixedName(name=hostname),
-            domain='localdomain'
+            logger(f"📦 [{site.name}] {site.host}: room for {room} clone(s)")
+        rooms[site.name] = room
+    split = split_batch(count, rooms)
+
+    shares, first = {}, 1
+    for site in sites:
+        if split[site.name]:
+            shares[site.name] = (first, split[site.name])
+            logger(
+                f"🧭 [{site.name}] {split[site.name]} VM(s): "
+                f"{numbered_name(prefix, first, count)} – {numbered_name(prefix, first + split[site.name] - 1, count)}"
+            )
+        first += split[site.name]
+
+    def run(site):
+        first, share = shares[site.name]
+        datacenter, cluster, network = target(site)
+        return provision_vms(
+            site.host,
+            vcenter_user,
+            vcenter_pass,
+            template,
+            prefix,
+            share,
+            datacenter,
+            cluster,
+            network,
+            {},
+            logger=lambda message: logger(f"[{site.name}] {message}"),
+            timeout_seconds=timeout_seconds,
+            on_vm_update=on_vm_update,
+            clone_mode=clone_mode,
+            first_number=first,
+            batch_size=count,
         )
-    
-    custom_spec = vim.vm.customization.Specification()
-    custom_spec.nicSettingMap = nic_settings
-    custom_spec.globalIPSettings = global_ip
-    custom_spec.identity = ident
-    
-    logger(f"✅ CustomizationSpec created with {len(nic_settings)} NICs")
-    return custom_spec
+
+    success_count = 0
+    for site, result, error in federation.fan_out(
+        run, [site for site in sites if site.name in shares], timeout=0
+    ):
+        if error is None:
+            success_count += result['succeeded']
+            continue
+        logger(f"❌ [{site.name}] {error}")
+        # The share's VMs were not all reported; record what was not created
+        first, share = shares[site.name]
+        for _, vmc in bulk_plan(prefix, share, first=first, of=count):
+            on_vm_update(vmc['name'], hostname=vmc['hostname'], ips='DHCP', status='failed',
+                         error=f"Site {site.name} failed: {error}")
+
+    total_time = time.time() - start_time
+    logger(f"🌍 Federated batch finished: {success_count}/{count} VMs across {len(shares)} site(s) in {total_time:.1f}s")
+    completion_msg = (
+        f"Provisioning completed in {total_time:.1f}s! {success_count}/{count} VMs created successfully "
+        f"across {len(shares)} vCenter site(s)"
+    )
+    return {
+        'message': completion_msg,
+        'succeeded': success_count,
+        'failed': count - success_count,
+        'vms': list(collected.values()) if collected is not None else None,
+    }
 
 
 def build_customization_spec(hostname, ip_list, os_type='linux', netmask='255.255.255.0', gateway=None, dns=None, domain='localdomain'):